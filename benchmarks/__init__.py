@@ -0,0 +1,10 @@
+"""
+Benchmark suite for the autofocus hot paths, in airspeed velocity (asv) format.
+
+Run the suite and store the results for the current commit with `asv run`, compare two versions with
+`asv continuous main HEAD` (fails if a benchmark got slower by more than the threshold) or `asv compare`.
+Results are kept in .asv/results, so per-frame latency regressions show up between versions.
+
+The standalone *_report.py / *_benchmark.py scripts in this folder print one-off comparisons and are not part of the
+asv suite.
+"""
@@ -0,0 +1,26 @@
+import numpy as np
+
+from led_autofocus._simulation import SimulatedCamera, SimulatedGrabResult
+
+# full sensor and progressively smaller crops, down to the size of a tracking window
+SENSOR_SIZES = [(3860, 2178), (1930, 1089), (960, 540), (480, 270)]
+
+
+def make_camera(width=3860, height=2178, z_source=lambda: 0.0, **kwargs):
+    """Simulated camera with the spot scaled to the sensor size, so the default fit bounds apply at full size."""
+    scale = width / 3860
+    return SimulatedCamera(z_source, width=width, height=height, centre=(1880 * scale, 1130 * scale),
+                           sigma=230 * scale, **kwargs)
+
+
+def make_grab_result(camera, z_nm=0.0, frame_id=1):
+    return SimulatedGrabResult(camera.render(z_nm), 0, frame_id)
+
+
+def make_profile(length, noise=0.01, seed=0):
+    """Normalised x projection like the ones fitted by ImageHandler."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, length, length)
+    profile = 0.23 + 0.77 * np.exp(-(x - 0.487 * length) ** 2 / (2 * (0.06 * length) ** 2))
+    profile += rng.normal(0, noise, length)
+    return x, profile / profile.max()
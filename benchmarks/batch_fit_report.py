@@ -0,0 +1,50 @@
+"""
+Speed and agreement of fit_gaussian_batch against a Python loop of fit_gaussian, for a synthetic calibration sweep.
+
+Run with: python benchmarks/batch_fit_report.py
+"""
+import time
+
+import numpy as np
+
+from led_autofocus._fit_utilities import Gaussian1D, fit_gaussian, fit_gaussian_batch, get_initial_guess_batch
+
+N_FRAMES = 500
+LENGTH = 3860
+
+
+def main():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, LENGTH, LENGTH)
+
+    # widths sweeping through focus, as in a z calibration
+    truths = np.stack([np.full(N_FRAMES, 0.23),
+                       1880 + rng.normal(0, 5, N_FRAMES),
+                       np.linspace(120, 340, N_FRAMES),
+                       np.full(N_FRAMES, 0.77)], axis=1)
+    profiles = np.stack([Gaussian1D(x, *truth) for truth in truths]) + rng.normal(0, 0.01, (N_FRAMES, LENGTH))
+    guesses = get_initial_guess_batch(x, profiles)
+
+    start = time.perf_counter()
+    loop = []
+    for profile, guess in zip(profiles, guesses):
+        try:
+            loop.append(fit_gaussian(x, profile, guess))
+        except RuntimeError:
+            loop.append(np.full(4, np.nan))
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    params, ier = fit_gaussian_batch(x, profiles, guesses)
+    batch_time = time.perf_counter() - start
+
+    loop = np.array(loop)
+    print(f"{N_FRAMES} profiles of {LENGTH} samples")
+    print(f"fit_gaussian loop:  {loop_time:.2f} s")
+    print(f"fit_gaussian_batch: {batch_time:.2f} s ({loop_time / batch_time:.1f}x)")
+    print(f"status codes: {dict(zip(*np.unique(ier, return_counts=True)))}")
+    print(f"max |difference| [i0, x0, sx, amp]: {np.nanmax(np.abs(params - loop), axis=0)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+
+from led_autofocus._fit_utilities import (Gaussian1D, fit_gaussian, fit_gaussian_fast, fit_gaussian_batch,
+                                          get_initial_guess_batch)
+
+from ._common import make_profile
+
+
+class Gaussian1DSuite:
+    params = [2178, 3860]
+    param_names = ["length"]
+
+    def setup(self, length):
+        self.x = np.linspace(0, length, length)
+
+    def time_gaussian1d(self, length):
+        Gaussian1D(self.x, 0.23, 0.487 * length, 0.06 * length, 0.77)
+
+
+class FitGaussianSuite:
+    params = [[2178, 3860], [False, True]]
+    param_names = ["length", "bounds"]
+
+    def setup(self, length, bounds):
+        self.x, self.profile = make_profile(length)
+        self.guess = [0.2, 0.48 * length, 0.05 * length, 0.8]
+        if bounds:
+            self.bounds = ([0, 0.4 * length, 0.02 * length, 0.5], [0.5, 0.6 * length, 0.1 * length, 1.0])
+        else:
+            self.bounds = (-np.inf, np.inf)
+
+    def time_fit_gaussian(self, length, bounds):
+        fit_gaussian(self.x, self.profile, self.guess, bounds=self.bounds)
+
+    def time_fit_gaussian_caruana(self, length, bounds):
+        fit_gaussian_fast(self.x, self.profile, self.guess, bounds=self.bounds, method="caruana")
+
+    def time_fit_gaussian_moments(self, length, bounds):
+        fit_gaussian_fast(self.x, self.profile, self.guess, bounds=self.bounds, method="moments")
+
+
+class FitGaussianBatchSuite:
+    params = [100]
+    param_names = ["n_profiles"]
+
+    def setup(self, n_profiles):
+        profiles = [make_profile(3860, seed=seed)[1] for seed in range(n_profiles)]
+        self.x = np.linspace(0, 3860, 3860)
+        self.profiles = np.stack(profiles)
+        self.guesses = get_initial_guess_batch(self.x, self.profiles)
+
+    def time_fit_gaussian_batch(self, n_profiles):
+        fit_gaussian_batch(self.x, self.profiles, self.guesses)
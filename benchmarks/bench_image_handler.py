@@ -0,0 +1,62 @@
+from led_autofocus._frame_processor import FrameProcessor
+
+from ._common import SENSOR_SIZES, make_camera, make_grab_result
+
+
+class ProjectionSuite:
+    """Projections only (no fits), from full sensor down to roi-sized frames."""
+    params = [SENSOR_SIZES]
+    param_names = ["sensor"]
+
+    def setup(self, sensor):
+        camera = make_camera(*sensor)
+        self.handler = FrameProcessor(camera, fit_profiles=False)
+        self.handler.store_frame = False
+        self.grab_result = make_grab_result(camera)
+
+    def time_projections(self, sensor):
+        self.handler.OnImageGrabbed(None, self.grab_result)
+
+    def peakmem_projections(self, sensor):
+        self.handler.OnImageGrabbed(None, self.grab_result)
+
+
+class OnImageGrabbedSuite:
+    """Whole synchronous grab callback: projections, fits and measurement, per estimator and tracking mode."""
+    params = [["curve_fit", "caruana", "moments", "moments_2d"], [False, True]]
+    param_names = ["estimator", "roi_tracking"]
+
+    def setup(self, estimator, roi_tracking):
+        camera = make_camera()
+        self.handler = FrameProcessor(camera, fit_profiles=True, estimator=estimator, roi_tracking=roi_tracking,
+                                      polyfit=camera.polyfit)
+        self.handler.store_frame = False
+        self.grab_results = [make_grab_result(camera, z_nm, i + 1) for i, z_nm in enumerate([0, 200, -200, 100])]
+        # warm start, as in a running loop
+        for grab_result in self.grab_results:
+            self.handler.OnImageGrabbed(None, grab_result)
+
+    def time_on_image_grabbed(self, estimator, roi_tracking):
+        for grab_result in self.grab_results:
+            self.handler.OnImageGrabbed(None, grab_result)
+
+    def track_measurement_ok(self, estimator, roi_tracking):
+        self.handler.OnImageGrabbed(None, self.grab_results[0])
+        return int(self.handler.measurement.ok)
+
+
+class PreviewSuite:
+    """Display copy of the frame: the full-frame copy used before, against the binned preview."""
+    params = [[(3860, 2178), (1930, 1089)], [1, 4, 8]]
+    param_names = ["sensor", "binning"]
+
+    def setup(self, sensor, binning):
+        camera = make_camera(*sensor)
+        self.handler = FrameProcessor(camera, fit_profiles=False, preview_binning=binning)
+        self.frame = camera.render(0.0)
+
+    def time_full_frame_copy(self, sensor, binning):
+        self.handler.img[...] = self.frame
+
+    def time_binned_preview(self, sensor, binning):
+        self.handler._bin_preview(self.frame)
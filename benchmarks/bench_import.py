@@ -0,0 +1,14 @@
+class ImportSuite:
+    """Import time of the package and of its core, each in a fresh interpreter."""
+
+    def timeraw_import_package(self):
+        return "import led_autofocus"
+
+    def timeraw_import_core(self):
+        return """
+        from led_autofocus._frame_processor import FrameProcessor
+        from led_autofocus._controller import FocusLockController
+        """
+
+    def timeraw_import_widget(self):
+        return "from led_autofocus import AutofocusWidget"
@@ -0,0 +1,64 @@
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._simulation import SimulatedStage
+from led_autofocus._surface_search import coarse_to_fine_search, profile_distance
+
+from ._common import make_camera
+
+SURFACE_Z_UM = 0.0
+START_OFFSET_UM = 7.3
+RANGE_UM = 10.0
+STEP_UM = 0.25
+FRAME_TIMEOUT_S = 1.0
+# default recall_surface_tolerance of the widget
+TOLERANCE = 1e-4
+
+
+class RecallSurfaceSuite:
+    """Coarse-to-fine recall surface against the simulated camera and stage, scoring each position on a frame
+    acquired after the stage settled, as the widget does."""
+    timeout = 300
+    number = 1
+    repeat = 3
+
+    def setup(self):
+        self.stage = SimulatedStage(z=SURFACE_Z_UM)
+        self.camera = make_camera(960, 540, z_source=self.stage.getZPosition, frame_rate=200.0)
+        self.camera.Open()
+        self.handler = FrameProcessor(self.camera, fit_profiles=True, roi_tracking=True, polyfit=self.camera.polyfit)
+        self.camera.RegisterImageEventHandler(self.handler)
+        self.camera.StartGrabbing()
+
+        # lock at the surface: target profiles and roi of a single fitted frame
+        frame = None
+        while frame is None or not frame[0].ok:
+            frame = self.handler.wait_for_frame(self.handler.frames_grabbed, timeout=FRAME_TIMEOUT_S)
+        measurement, x_projection, y_projection = frame
+        self.measure = profile_distance(self.handler, self.stage.setZPosition, x_projection, y_projection,
+                                        discard_frames=1, frame_timeout_s=FRAME_TIMEOUT_S)
+
+        # the search compares projections in the locked roi, without fitting
+        self.handler.fit_profiles = False
+        self.handler.fixed_roi = measurement.roi
+
+    def teardown(self):
+        self.camera.Close()
+        self.handler.stop()
+
+    def _recall(self):
+        start = SURFACE_Z_UM + START_OFFSET_UM
+        self.stage.setZPosition(start)
+        moves = self.stage.moves
+        surface_z, _, _ = coarse_to_fine_search(self.measure, start, RANGE_UM, STEP_UM,
+                                                tolerance=TOLERANCE)
+        self.stage.setZPosition(surface_z)
+        return self.stage.moves - moves
+
+    def time_recall_surface(self):
+        self._recall()
+
+    def track_recall_surface_moves(self):
+        return self._recall()
+
+    def track_recall_surface_error_um(self):
+        self._recall()
+        return abs(self.stage.getZPosition() - SURFACE_Z_UM)
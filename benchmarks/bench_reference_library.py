@@ -0,0 +1,36 @@
+import numpy as np
+
+from led_autofocus._reference_library import ReferenceLibrary
+from led_autofocus._fit_utilities import fit_gaussian_fast
+
+from ._common import make_camera
+
+
+def _projections(frame):
+    x_sum, y_sum = frame.sum(axis=0, dtype=np.uint32), frame.sum(axis=1, dtype=np.uint32)
+    return (x_sum / x_sum.max()).astype(np.float32), (y_sum / y_sum.max()).astype(np.float32)
+
+
+class ReferenceLibrarySuite:
+    """Fit-free position from a reference library, against the two Gaussian fits it replaces."""
+    params = [(3860, 2178), (960, 540)]
+    param_names = ["sensor_size"]
+
+    def setup(self, sensor_size):
+        width, height = sensor_size
+        camera = make_camera(width, height)
+        z = np.linspace(-2500, 2500, 41)
+        x_profiles, y_profiles = zip(*[_projections(camera.render(z_nm)) for z_nm in z])
+        self.library = ReferenceLibrary.build(z, x_profiles, y_profiles)
+        self.x_projection, self.y_projection = _projections(camera.render(370.0))
+        self.x_coords = np.linspace(0, width, width)
+        self.y_coords = np.linspace(0, height, height)
+        self.guess_x = [0.2, 0.487 * width, 0.06 * width, 0.8]
+        self.guess_y = [0.35, 0.52 * height, 0.1 * height, 0.6]
+
+    def time_library_estimate(self, sensor_size):
+        self.library.estimate(self.x_projection, self.y_projection)
+
+    def time_fits(self, sensor_size):
+        fit_gaussian_fast(self.x_coords, self.x_projection, self.guess_x)
+        fit_gaussian_fast(self.y_coords, self.y_projection, self.guess_y)
@@ -0,0 +1,108 @@
+"""
+End-to-end benchmark of the focus lock on the simulated camera and stage: grab -> projections -> fits -> position ->
+stage move. Reports the per-frame latency from frame delivery to stage command, and how many frames and how long the
+lock takes to recover from a step disturbance of the stage. The second table uses a slow stage, moved either directly
+from the processing thread or through a StageExecutor.
+
+Run with: python benchmarks/closed_loop_benchmark.py
+"""
+import time
+
+import numpy as np
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._controller import FocusLockController
+from led_autofocus._simulation import SimulatedCamera, SimulatedStage
+from led_autofocus._stage_executor import StageExecutor
+
+POLYFIT = [-0.069, -23.2, 44.15]
+STEP_UM = 2.0
+TOLERANCE_UM = 0.05
+TIMEOUT_S = 10.0
+
+
+def run(width, height, frame_rate, pipeline, roi_tracking, settle_time_s=0.002, executor=False):
+    stage = SimulatedStage(z=0.0, settle_time_s=settle_time_s)
+    # spot scaled with the sensor, the default one matches the full 3860x2178 sensor
+    scale = width / 3860
+    camera = SimulatedCamera(stage.getZPosition, polyfit=POLYFIT, width=width, height=height, frame_rate=frame_rate,
+                             centre=(1880 * scale, 1130 * scale), sigma=230 * scale)
+    camera.Open()
+    handler = FrameProcessor(camera, fit_profiles=True, pipeline=pipeline, roi_tracking=roi_tracking,
+                             polyfit=POLYFIT)
+    handler.store_frame = False
+    if executor:
+        stage_executor = StageExecutor(lambda dz: stage.setRelativeXYZPosition(0, 0, dz))
+        stage_executor.start()
+        handler.stage = stage_executor
+        controller = FocusLockController(stage_executor.submit, kp=0.8)
+    else:
+        controller = FocusLockController(lambda movement: stage.setRelativeXYZPosition(0, 0, movement), kp=0.8)
+
+    latencies = []
+    unsettled = []
+
+    def listener(measurement):
+        if not measurement.settled:
+            unsettled.append(measurement.frame_id)
+        if controller.update(measurement) is not None:
+            # the simulated TimeStamp is the host time the frame was delivered, in ns
+            latencies.append((time.perf_counter_ns() - measurement.timestamp) / 1e6)
+
+    handler.add_listener(listener)
+    camera.RegisterImageEventHandler(handler)
+    camera.StartGrabbing()
+
+    start = time.monotonic()
+    while not handler.measurement.ok and time.monotonic() - start < TIMEOUT_S:
+        time.sleep(0.01)
+    controller.lock(handler.measurement.z)
+
+    # step disturbance of the focus (as if the sample moved), then wait for the lock to follow it with the stage. The
+    # focus is moved rather than the stage, so the disturbance does not race with the stage movements of the lock
+    camera.focus_z_um += STEP_UM
+    first_frame = handler.frames_grabbed
+    start = time.monotonic()
+    converged = False
+    while time.monotonic() - start < TIMEOUT_S:
+        if abs(stage.getZPosition() - STEP_UM) < TOLERANCE_UM:
+            converged = True
+            break
+        time.sleep(0.001)
+    recovery_s = time.monotonic() - start
+    recovery_frames = handler.frames_grabbed - first_frame
+
+    camera.Close()
+    handler.stop()
+    if executor:
+        stage_executor.stop()
+    return converged, recovery_s, recovery_frames, np.array(latencies), handler.frames_dropped, len(unsettled)
+
+
+def main():
+    print(f"step {STEP_UM} um, tolerance {TOLERANCE_UM} um")
+    print(f"{'sensor':>10} {'fps':>5} {'pipeline':>8} {'roi':>5} {'converged':>9} {'recovery (s)':>12} "
+          f"{'frames':>6} {'latency p50/p99 (ms)':>20} {'dropped':>7}")
+    # the hardcoded fit bounds only fit the full sensor, smaller sensors need roi tracking
+    configurations = [(3860, 2178, False, False), (3860, 2178, True, False), (3860, 2178, True, True),
+                      (1930, 1089, True, True)]
+    for width, height, pipeline, roi_tracking in configurations:
+        converged, recovery_s, frames, latencies, dropped, _ = run(width, height, 50.0, pipeline, roi_tracking)
+        p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (np.nan, np.nan)
+        print(f"{width}x{height:<5} {50:>5} {str(pipeline):>8} {str(roi_tracking):>5} {str(converged):>9} "
+              f"{recovery_s:>12.3f} {frames:>6} {p50:>10.1f}/{p99:<9.1f} {dropped:>7}")
+
+    settle_time_s = 0.05
+    print(f"\nstage settle time {settle_time_s * 1000:.0f} ms, 1930x1089, pipeline and roi tracking")
+    print(f"{'executor':>8} {'converged':>9} {'recovery (s)':>12} {'frames':>6} {'latency p50/p99 (ms)':>20} "
+          f"{'dropped':>7} {'unsettled':>9}")
+    for executor in (False, True):
+        converged, recovery_s, frames, latencies, dropped, unsettled = run(1930, 1089, 50.0, True, True,
+                                                                           settle_time_s, executor)
+        p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (np.nan, np.nan)
+        print(f"{str(executor):>8} {str(converged):>9} {recovery_s:>12.3f} {frames:>6} {p50:>10.1f}/{p99:<9.1f} "
+              f"{dropped:>7} {unsettled:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Accuracy-vs-speed report for the Gaussian estimators in led_autofocus._fit_utilities.
+
+Synthetic x/y projections matching the full-sensor configuration (3860 x 2178) are generated with a range of noise
+levels, and each estimator is compared against the reference curve_fit result on the same profile.
+
+Run with: python benchmarks/estimator_report.py
+"""
+import time
+
+import numpy as np
+
+from led_autofocus._fit_utilities import Gaussian1D, fit_gaussian, fit_gaussian_fast, ESTIMATORS
+
+PROFILES = {
+    "x": (3860, [0.23, 1880.0, 230.0, 0.77]),
+    "y": (2178, [0.36, 1130.0, 320.0, 0.59]),
+}
+NOISE_LEVELS = [0.002, 0.01, 0.03]
+N_PROFILES = 50
+
+
+def make_profiles(length, params, noise, n, rng):
+    x = np.linspace(0, length, length)
+    profiles = []
+    truths = []
+    for _ in range(n):
+        truth = np.array(params) * (1 + 0.05 * rng.standard_normal(4))
+        profile = Gaussian1D(x, *truth) + rng.normal(0, noise, length)
+        # the projections are normalised to their maximum in ImageHandler
+        scale = np.max(profile)
+        truths.append(truth / [scale, 1, 1, scale])
+        profiles.append(profile / scale)
+    return x, profiles, truths
+
+
+def time_and_fit(x, profiles, guess, method):
+    results = []
+    start = time.perf_counter()
+    for profile in profiles:
+        if method == "reference":
+            results.append(fit_gaussian(x, profile, guess))
+        else:
+            results.append(fit_gaussian_fast(x, profile, guess, method=method))
+    elapsed = (time.perf_counter() - start) / len(profiles)
+    return elapsed, results
+
+
+def main():
+    rng = np.random.default_rng(0)
+    header = f"{'profile':>7} {'noise':>6} {'estimator':>10} {'time (us)':>10} {'speed-up':>8} " \
+             f"{'|dx0| (px)':>10} {'|dsx| (px)':>10} {'vs truth dsx':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, (length, params) in PROFILES.items():
+        for noise in NOISE_LEVELS:
+            x, profiles, truths = make_profiles(length, params, noise, N_PROFILES, rng)
+            guess = list(params)
+            ref_time, reference = time_and_fit(x, profiles, guess, "reference")
+            for method in ESTIMATORS:
+                elapsed, results = time_and_fit(x, profiles, guess, method)
+                d_ref = np.array([r - ref for r, ref in zip(results, reference)])
+                d_truth = np.array([r - t for r, t in zip(results, truths)])
+                print(f"{name:>7} {noise:>6} {method:>10} {elapsed * 1e6:>10.1f} {ref_time / elapsed:>8.1f} "
+                      f"{np.mean(np.abs(d_ref[:, 1])):>10.3f} {np.mean(np.abs(d_ref[:, 2])):>10.3f} "
+                      f"{np.mean(np.abs(d_truth[:, 2])):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Import-time budget of the autofocus core: the package and its NumPy-only modules must import without loading the GUI
+or camera stack (Qt, pyqtgraph, pypylon, pymmcore_plus) or scipy, and within BUDGET_S of the time NumPy itself takes
+to import. Each import is timed in a fresh interpreter, the best of REPEATS runs is kept.
+
+Exits with status 1 if a module is over budget or loads one of the heavy modules, so it can be run as a check.
+tests/test_import_time.py runs the same probe under pytest.
+
+Run with: python benchmarks/import_time_check.py
+"""
+import json
+import subprocess
+import sys
+
+CORE_MODULES = ["led_autofocus", "led_autofocus._frame_processor", "led_autofocus._fit_utilities",
+                "led_autofocus._position", "led_autofocus._controller", "led_autofocus._measurement",
+                "led_autofocus._pipeline", "led_autofocus._simulation", "led_autofocus._replay"]
+HEAVY_MODULES = ["qtpy", "PyQt5", "PyQt6", "PySide2", "PySide6", "pyqtgraph", "pypylon", "pymmcore_plus", "scipy"]
+# import time allowed on top of NumPy's
+BUDGET_S = 0.1
+REPEATS = 5
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import numpy
+numpy_s = time.perf_counter() - start
+start = time.perf_counter()
+import {module}
+module_s = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"numpy_s": numpy_s, "module_s": module_s, "heavy": heavy}}))
+"""
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter.
+    :param module: module name
+    :return: (numpy import time, module import time after numpy, heavy modules loaded)
+    """
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    return result["numpy_s"], result["module_s"], result["heavy"]
+
+
+def main():
+    failed = False
+    print(f"budget {BUDGET_S * 1000:.0f} ms on top of numpy, best of {REPEATS}")
+    print(f"{'module':<32} {'numpy (ms)':>10} {'module (ms)':>11}  heavy modules loaded")
+    for module in CORE_MODULES:
+        runs = [measure(module) for _ in range(REPEATS)]
+        numpy_s = min(run[0] for run in runs)
+        module_s = min(run[1] for run in runs)
+        heavy = runs[0][2]
+        over = module_s > BUDGET_S or heavy
+        failed = failed or over
+        print(f"{module:<32} {numpy_s * 1000:>10.1f} {module_s * 1000:>11.1f}  {', '.join(heavy) or '-'}"
+              f"{'  OVER BUDGET' if over else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
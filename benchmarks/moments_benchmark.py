@@ -0,0 +1,56 @@
+"""
+Position error and processing time of the fits of the projections against the 2D moments estimator, for a spot
+rotated from the sensor axes. The simulated focus sweeps the calibration range, and each frame is processed twice
+(the first time to move the tracking window to it) on the calling thread, as with the synchronous grab callback. The
+moments estimator is run with the default axis angle, and with the axis angle set to the orientation of the spot.
+
+Run with: python benchmarks/moments_benchmark.py
+"""
+import time
+
+import numpy as np
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._simulation import SimulatedCamera
+
+POLYFIT = [-0.069, -23.2, 44.15]
+WIDTH, HEIGHT = 1930, 1089
+Z_NM = np.linspace(-1500, 1500, 16)
+ANGLES_DEG = [0, 10, 20, 30, 45]
+ESTIMATORS = ["curve_fit", "caruana", "moments_2d"]
+
+
+def run(frames, estimator, axis_angle_deg=0.0):
+    handler = FrameProcessor(SimulatedCamera(lambda: 0.0, width=WIDTH, height=HEIGHT), fit_profiles=True,
+                             estimator=estimator, roi_tracking=True, polyfit=POLYFIT,
+                             spot_axis_angle_deg=axis_angle_deg)
+    handler.store_frame = False
+    errors, durations, angles = [], [], []
+    for frame_id, (frame, z) in enumerate(zip(frames, Z_NM)):
+        handler._process_frame(frame, 0, 2 * frame_id + 1)
+        start = time.perf_counter()
+        handler._process_frame(frame, 0, 2 * frame_id + 2)
+        durations.append(time.perf_counter() - start)
+        errors.append(handler.measurement.z - z)
+        angles.append(handler.spot_angle_deg)
+    return np.array(errors), np.array(durations) * 1000, np.array(angles)
+
+
+def main():
+    print(f"{WIDTH}x{HEIGHT}, roi tracking, focus from {Z_NM[0]:.0f} to {Z_NM[-1]:.0f} nm")
+    print(f"{'angle':>5} {'estimator':>10} {'axis':>5} {'rms (nm)':>9} {'max (nm)':>9} {'frame (ms)':>10} "
+          f"{'angle found':>11}")
+    for angle in ANGLES_DEG:
+        camera = SimulatedCamera(lambda: 0.0, polyfit=POLYFIT, width=WIDTH, height=HEIGHT, centre=(940, 565),
+                                 sigma=115, angle=angle)
+        frames = [camera.render(z) for z in Z_NM]
+        runs = [(estimator, 0) for estimator in ESTIMATORS] + [("moments_2d", angle)]
+        for estimator, axis_angle in runs:
+            errors, durations, angles = run(frames, estimator, axis_angle)
+            found = f"{np.median(angles):.1f}" if estimator == "moments_2d" else "-"
+            print(f"{angle:>5} {estimator:>10} {axis_angle:>5} {np.sqrt(np.nanmean(errors ** 2)):>9.1f} "
+                  f"{np.nanmax(np.abs(errors)):>9.1f} {np.median(durations):>10.2f} {found:>11}")
+
+
+if __name__ == "__main__":
+    main()
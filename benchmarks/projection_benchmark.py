@@ -0,0 +1,85 @@
+"""
+Per-frame time and memory allocated by the projection path of FrameProcessor.OnImageGrabbed, before (the original
+copy-and-sum implementation) and after (preallocated buffers and zero-copy grab arrays), at full sensor size.
+
+Run with: python benchmarks/projection_benchmark.py
+"""
+import contextlib
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+from led_autofocus._frame_processor import FrameProcessor
+
+WIDTH = 3860
+HEIGHT = 2178
+N_FRAMES = 50
+
+
+class FakeGrabResult:
+    """Stand-in for a pylon grab result wrapping a frame in memory."""
+
+    def __init__(self, frame, timestamp=0):
+        self._frame = frame
+        self.TimeStamp = timestamp
+
+    def GrabSucceeded(self):
+        return True
+
+    @property
+    def Array(self):
+        # like pylon, the Array property returns a copy of the buffer
+        return self._frame.copy()
+
+    @contextlib.contextmanager
+    def GetArrayZeroCopy(self):
+        yield self._frame
+
+
+def make_camera(width, height):
+    return SimpleNamespace(Width=SimpleNamespace(Value=width), Height=SimpleNamespace(Value=height))
+
+
+def legacy_projection(handler, grab_result):
+    """Projection path of OnImageGrabbed before the buffers were preallocated."""
+    handler.img = grab_result.Array
+    handler.x_projection = np.divide(handler.img.sum(axis=0), np.max(handler.img.sum(axis=0)))
+    handler.y_projection = np.divide(handler.img.sum(axis=1), np.max(handler.img.sum(axis=1)))
+    handler.timestamp = grab_result.TimeStamp
+
+
+def measure(callback, grab_results):
+    # warm up, then time and trace the allocations separately so tracing does not inflate the timings
+    callback(grab_results[0])
+    start = time.perf_counter()
+    for grab_result in grab_results:
+        callback(grab_result)
+    elapsed = (time.perf_counter() - start) / len(grab_results)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    callback(grab_results[0])
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak - baseline, current - baseline
+
+
+def main():
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8) for _ in range(4)]
+    grab_results = [FakeGrabResult(frames[i % len(frames)], i) for i in range(N_FRAMES)]
+    handler = FrameProcessor(make_camera(WIDTH, HEIGHT), fit_profiles=False)
+
+    print(f"{WIDTH}x{HEIGHT} Mono8, {N_FRAMES} frames")
+    print(f"{'path':>8} {'time/frame (ms)':>16} {'peak alloc (MB)':>16} {'retained (MB)':>14}")
+    for name, callback in [("before", lambda grab: legacy_projection(handler, grab)),
+                           ("after", lambda grab: handler.OnImageGrabbed(None, grab))]:
+        elapsed, peak, retained = measure(callback, grab_results)
+        print(f"{name:>8} {elapsed * 1e3:>16.2f} {peak / 1e6:>16.2f} {retained / 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
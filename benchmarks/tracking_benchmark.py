@@ -0,0 +1,73 @@
+"""
+Position noise, outliers and fit time with and without the FitTracker, on a simulated sequence: the focus drifts
+slowly, the frames are noisy (a short exposure) and a few frames are corrupted by a stray bright spot. Frames are
+processed in order on the calling thread, as with the synchronous grab callback.
+
+Run with: python benchmarks/tracking_benchmark.py
+"""
+import time
+
+import numpy as np
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._simulation import SimulatedCamera
+from led_autofocus._tracking import FitTracker
+
+POLYFIT = [-0.069, -23.2, 44.15]
+WIDTH, HEIGHT = 960, 540
+N_FRAMES = 400
+DRIFT_NM_PER_FRAME = 1.0
+OUTLIER_EVERY = 37
+
+
+def make_frames(noise, seed=0):
+    """Frames and true positions (nm) of the sequence."""
+    rng = np.random.default_rng(seed)
+    camera = SimulatedCamera(lambda: 0.0, polyfit=POLYFIT, width=WIDTH, height=HEIGHT, centre=(470, 282), sigma=57,
+                             amplitude=60, noise=noise, seed=seed)
+    z_true = (np.arange(N_FRAMES) - N_FRAMES / 2) * DRIFT_NM_PER_FRAME
+    frames = np.stack([camera.render(z) for z in z_true])
+    for index in range(OUTLIER_EVERY, N_FRAMES, OUTLIER_EVERY):
+        # stray light: a bright spot away from the LED spot
+        x, y = rng.integers(100, WIDTH - 100), rng.integers(50, HEIGHT - 50)
+        frames[index, y - 20:y + 20, x - 20:x + 20] = 255
+    return frames, z_true
+
+
+def run(frames, z_true, estimator, tracker):
+    handler = FrameProcessor(SimulatedCamera(lambda: 0.0, width=WIDTH, height=HEIGHT), fit_profiles=True,
+                             estimator=estimator, roi_tracking=True, polyfit=POLYFIT, tracker=tracker)
+    handler.store_frame = False
+    z = np.full(N_FRAMES, np.nan)
+    durations = []
+    for index, frame in enumerate(frames):
+        start = time.perf_counter()
+        handler._process_frame(frame, index, index + 1)
+        durations.append(time.perf_counter() - start)
+        if handler.measurement.ok:
+            z[index] = handler.measurement.z
+    # the first frames are a full-frame search, the comparison is in steady state
+    error = (z - z_true)[10:]
+    valid = np.isfinite(error)
+    clean = valid & (np.arange(10, N_FRAMES) % OUTLIER_EVERY != 0)
+    return (np.sqrt(np.mean(error[clean] ** 2)), np.sqrt(np.mean(error[valid] ** 2)), np.max(np.abs(error[valid])),
+            np.count_nonzero(~valid), np.median(durations[10:]) * 1000)
+
+
+def main():
+    print(f"{WIDTH}x{HEIGHT}, {N_FRAMES} frames, drift {DRIFT_NM_PER_FRAME} nm/frame, a stray spot every "
+          f"{OUTLIER_EVERY} frames")
+    print(f"{'noise':>5} {'estimator':>9} {'tracker':>7} {'rms clean (nm)':>14} {'rms all (nm)':>12} "
+          f"{'max error (nm)':>14} {'no position':>11} {'frame (ms)':>10}")
+    for noise in (3.0, 10.0):
+        frames, z_true = make_frames(noise)
+        for estimator in ("caruana", "curve_fit"):
+            for tracking in (False, True):
+                tracker = FitTracker() if tracking else None
+                rms_clean, rms, worst, missing, duration = run(frames, z_true, estimator, tracker)
+                print(f"{noise:>5.0f} {estimator:>9} {str(tracking):>7} {rms_clean:>14.1f} {rms:>12.1f} {worst:>14.1f} "
+                      f"{missing:>11} {duration:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
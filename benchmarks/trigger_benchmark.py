@@ -0,0 +1,83 @@
+"""
+Free-run versus software-triggered acquisition on the simulated camera and stage, with the lock following a slow
+drift of the focus. Reports the frames acquired and processed per second, the CPU used by the process (rendering the
+simulated frames stands in for the transfer) and the residual lock error.
+
+Run with: python benchmarks/trigger_benchmark.py
+"""
+import time
+
+import numpy as np
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._controller import FocusLockController
+from led_autofocus._simulation import SimulatedCamera, SimulatedStage
+from led_autofocus._stage_executor import StageExecutor
+from led_autofocus._trigger import SoftwareTrigger
+
+POLYFIT = [-0.069, -23.2, 44.15]
+WIDTH, HEIGHT = 1930, 1089
+FRAME_RATE = 50.0
+DRIFT_UM_PER_S = 0.2
+DURATION_S = 5.0
+
+
+def run(trigger_interval_s=None):
+    stage = SimulatedStage(z=0.0, settle_time_s=0.002)
+    camera = SimulatedCamera(stage.getZPosition, polyfit=POLYFIT, width=WIDTH, height=HEIGHT, frame_rate=FRAME_RATE,
+                             centre=(940, 565), sigma=115, drift_um_per_s=DRIFT_UM_PER_S)
+    camera.Open()
+    handler = FrameProcessor(camera, fit_profiles=True, pipeline=True, roi_tracking=True, polyfit=POLYFIT)
+    handler.store_frame = False
+    stage_executor = StageExecutor(lambda dz: stage.setRelativeXYZPosition(0, 0, dz))
+    stage_executor.start()
+    handler.stage = stage_executor
+    controller = FocusLockController(stage_executor.submit, kp=0.8)
+    handler.add_listener(controller.update)
+
+    trigger = None
+    if trigger_interval_s is not None:
+        camera.TriggerMode.Value = "On"
+        trigger = SoftwareTrigger(camera.ExecuteSoftwareTrigger, trigger_interval_s, stage=stage_executor,
+                                  active=camera.IsGrabbing)
+        handler.add_listener(trigger.frame_processed)
+        trigger.start()
+
+    errors = []
+    handler.add_listener(lambda m: errors.append(m.z - controller.setpoint) if controller.locked and m.ok else None)
+
+    camera.RegisterImageEventHandler(handler)
+    handler.arm()
+    camera.StartGrabbing()
+    handler.wait_until_ready(5.0)
+    controller.lock(0.0)
+
+    first_grabbed, first_processed = handler.frames_grabbed, handler.frames_processed
+    errors.clear()
+    wall, cpu = time.monotonic(), time.process_time()
+    time.sleep(DURATION_S)
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    grabbed, processed = handler.frames_grabbed - first_grabbed, handler.frames_processed - first_processed
+
+    if trigger is not None:
+        trigger.stop()
+    camera.Close()
+    handler.stop()
+    stage_executor.stop()
+    errors = np.array(errors)
+    return grabbed / wall, processed / wall, cpu / wall, np.sqrt(np.mean(errors ** 2)), np.max(np.abs(errors))
+
+
+def main():
+    print(f"{WIDTH}x{HEIGHT} at up to {FRAME_RATE:.0f} fps, focus drift {DRIFT_UM_PER_S} um/s, {DURATION_S:.0f} s "
+          f"locked")
+    print(f"{'mode':<20} {'acquired/s':>10} {'processed/s':>11} {'cpu (cores)':>11} {'rms error (nm)':>14} "
+          f"{'max error (nm)':>14}")
+    for name, interval in [("free run", None), ("trigger 20 ms", 0.02), ("trigger 100 ms", 0.1),
+                           ("trigger 250 ms", 0.25)]:
+        acquired, processed, cores, rms, worst = run(interval)
+        print(f"{name:<20} {acquired:>10.1f} {processed:>11.1f} {cores:>11.2f} {rms:>14.1f} {worst:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
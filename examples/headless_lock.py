@@ -0,0 +1,45 @@
+"""
+Run the focus lock without the widget, e.g. from an acquisition script. The lock is applied on every frame the camera
+delivers, there is no GUI event loop involved.
+"""
+import json
+import time
+from pathlib import Path
+
+from pymmcore_plus import CMMCorePlus
+from pypylon import pylon
+
+import led_autofocus
+from led_autofocus.ImageHandler import ImageHandler
+from led_autofocus._controller import FocusLockController
+
+mmcore = CMMCorePlus.instance()
+mmcore.loadSystemConfiguration()
+
+with open(Path(led_autofocus.__file__).parent / "autofocus_config.json", "r") as f:
+    settings = json.load(f)
+
+camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
+camera.Open()
+camera.ExposureTime.SetValue(settings["exposure_time_ms"] * 1000)
+
+handler = ImageHandler(camera, fit_profiles=True, estimator=settings["estimator"], roi_tracking=True,
+                       polyfit=[settings["p2"], settings["p1"], settings["p0"]])
+controller = FocusLockController(lambda movement: mmcore.setRelativeXYZPosition(0, 0, movement),
+                                 max_movement=settings["max_movement"], kp=0.7, ki=0.05, deadband_um=0.02,
+                                 max_step_um=1.0)
+handler.add_listener(controller.update)
+camera.RegisterImageEventHandler(handler, pylon.RegistrationMode_ReplaceAll, pylon.Cleanup_None)
+camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
+
+# lock on the current position once the first measurement is available
+while not handler.measurement.ok:
+    time.sleep(0.01)
+controller.lock(handler.measurement.z)
+
+# ... run the acquisition here, the lock keeps correcting on every frame ...
+time.sleep(60)
+
+controller.unlock()
+camera.StopGrabbing()
+camera.Close()
@@ -0,0 +1,41 @@
+"""
+Two LED autofocus units on the same microscope, in one process. Each widget has its own config file, which selects
+its camera with camera_serial and the Z drive it locks with focus_device (and can hold its own calibration), and both
+share the same pool of fitting threads. Two units locking the same drive would fight each other.
+"""
+import json
+from pathlib import Path
+
+from pymmcore_plus import CMMCorePlus
+from qtpy.QtWidgets import QApplication
+
+from led_autofocus import AutofocusWidget
+from led_autofocus._settings_widget import DEFAULT_CONFIG_PATH
+
+# camera serial number and Z drive (its label in the Micro-Manager configuration) of each unit
+UNITS = {
+    "autofocus_left.json": {"camera_serial": "40000001", "focus_device": "ZStageLeft"},
+    "autofocus_right.json": {"camera_serial": "40000002", "focus_device": "ZStageRight"},
+}
+
+app = QApplication([])
+
+mmcore = CMMCorePlus.instance()
+mmcore.loadSystemConfiguration()
+
+# copies of autofocus_config.json, created on the first run and kept afterwards with their calibration
+config_directory = Path(__file__).parent
+for name, unit in UNITS.items():
+    path = config_directory / name
+    if not path.exists():
+        with open(DEFAULT_CONFIG_PATH, "r") as f:
+            settings = json.load(f)
+        settings.update(unit)
+        with open(path, "w") as f:
+            json.dump(settings, f)
+
+widgets = [AutofocusWidget(mmc=mmcore, config_path=config_directory / name) for name in UNITS]
+for widget in widgets:
+    widget.show()
+
+app.exec_()
@@ -0,0 +1,36 @@
+"""
+Reprocess a recorded stack offline, with the same projection, fit and position code as the live ImageHandler, e.g.
+to compare estimators or calibrations without the microscope. Multi-page TIFFs need tifffile, .npy stacks and raw
+files are memory-mapped.
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import led_autofocus
+from led_autofocus._replay import open_frames, replay
+
+if __name__ == "__main__":
+    with open(Path(led_autofocus.__file__).parent / "autofocus_config.json", "r") as f:
+        settings = json.load(f)
+
+    # raw files also need the frame shape: open_frames(path, shape=(height, width))
+    frames = open_frames(sys.argv[1])
+    polyfit = [settings["p2"], settings["p1"], settings["p0"]]
+
+    start = time.perf_counter()
+    results = []
+    for chunk in replay(frames, polyfit=polyfit, estimator=settings["estimator"], roi_tracking=True):
+        results.append(chunk)
+        print(f"{sum(len(c) for c in results)}/{len(frames)} frames")
+    results = np.concatenate(results)
+    elapsed = time.perf_counter() - start
+
+    ok = results["status"] == 0
+    print(f"{len(results)} frames in {elapsed:.1f} s ({len(results) / elapsed:.0f} frames/s), "
+          f"{np.count_nonzero(~ok)} failed fits")
+    print(f"z: mean {np.mean(results['z'][ok]):.1f} nm, std {np.std(results['z'][ok]):.1f} nm")
+    np.save(Path(sys.argv[1]).with_suffix(".replay.npy"), results)
@@ -18,5 +18,9 @@ setup(
         'pymmcore_plus',
         'pathlib',
         'scipy'
-    ]
+    ],
+    extras_require={
+        # reading multi-page TIFF recordings in replay mode
+        'replay': ['tifffile']
+    }
 )
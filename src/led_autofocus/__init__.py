@@ -1,5 +1,29 @@
-from ._widget import AutofocusWidget
+import importlib
 
-__all__ = (
-    "AutofocusWidget",
-)
+# public names and the modules defining them. Modules are imported on first access, so that importing the package
+# (or its NumPy-only core: _frame_processor, _fit_utilities, _position, _controller...) does not load Qt, pyqtgraph,
+# pypylon or pymmcore_plus. Only AutofocusWidget needs them.
+_EXPORTS = {
+    "AutofocusWidget": "._widget",
+    "FrameProcessor": "._frame_processor",
+    "FocusMeasurement": "._measurement",
+    "FocusLockController": "._controller",
+    "calculate_position": "._position",
+    "SimulatedCamera": "._simulation",
+    "SimulatedStage": "._simulation",
+}
+
+__all__ = tuple(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    # cached, so __getattr__ is only called on the first access
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,136 @@
+import json
+
+import numpy as np
+
+
+class StreamingPolynomialFit:
+    """Least-squares polynomial fit accumulated one point at a time, in constant memory.
+
+    Only the power sums needed by the normal equations are kept, so the goodness of fit can be computed without the
+    points.
+
+    Parameters
+    ----------
+    degree : int
+        Degree of the polynomial
+    """
+
+    def __init__(self, degree=2):
+        self.degree = degree
+        self.n = 0
+        # sum(x^k) for k = 0..2*degree, sum(x^k * y) for k = 0..degree, sum(y^2)
+        self._x_sums = np.zeros(2 * degree + 1)
+        self._xy_sums = np.zeros(degree + 1)
+        self._y2_sum = 0.0
+        self._powers = np.arange(2 * degree + 1)
+
+    def add(self, x, y):
+        """Add a point to the fit."""
+        x_powers = float(x) ** self._powers
+        self._x_sums += x_powers
+        self._xy_sums += x_powers[:self.degree + 1] * y
+        self._y2_sum += float(y) ** 2
+        self.n += 1
+
+    def fit(self):
+        """
+        Solve the normal equations.
+        :return: coefficients in np.polyval order (highest power first), None if there are not enough points
+        """
+        if self.n <= self.degree:
+            return None
+        indices = np.arange(self.degree + 1)
+        normal_matrix = self._x_sums[indices[:, None] + indices[None, :]]
+        coefficients, _, rank, _ = np.linalg.lstsq(normal_matrix, self._xy_sums, rcond=None)
+        if rank <= self.degree:
+            return None
+        return coefficients[::-1]
+
+    def residual_sum_of_squares(self, coefficients):
+        """Sum of the squared residuals of the points to a polynomial, from the accumulated sums."""
+        c = np.asarray(coefficients)[::-1]
+        indices = np.arange(self.degree + 1)
+        normal_matrix = self._x_sums[indices[:, None] + indices[None, :]]
+        return max(self._y2_sum - 2 * c @ self._xy_sums + c @ normal_matrix @ c, 0.0)
+
+    def r_squared(self, coefficients):
+        """Coefficient of determination of a polynomial over the accumulated points."""
+        total = self._y2_sum - self._xy_sums[0] ** 2 / self.n
+        if total <= 0:
+            return np.nan
+        return 1 - self.residual_sum_of_squares(coefficients) / total
+
+    def rmse(self, coefficients):
+        """Root mean square residual of a polynomial over the accumulated points."""
+        return np.sqrt(self.residual_sum_of_squares(coefficients) / self.n)
+
+
+def run_calibration(mmc, handler, half_range_um, step_um, frames_per_step=1, discard_frames=1, frame_timeout_s=1.0,
+                    focus_device=None):
+    """
+    Calibrate the position polynomial by moving the stage through centre +- half_range_um. The current position is
+    taken as the focus, and every fitted frame adds a point (sx - sy, -offset in nm) to a streaming quadratic fit, so
+    frames and projections are never stored. The camera must be grabbing.
+    :param mmc: CMMCorePlus (or anything with the same z stage methods)
+    :param handler: ImageHandler registered with the grabbing camera
+    :param half_range_um: half width of the sweep in um
+    :param step_um: step between positions in um
+    :param frames_per_step: number of frames fitted at each position
+    :param discard_frames: frames skipped after each move, as they may have been exposed while moving
+    :param frame_timeout_s: maximum time to wait for a frame
+    :param focus_device: label of the Z drive to move, None for the current focus device of mmc
+    :return: dict with p2, p1, p0 and the goodness of fit (calibration_r_squared, calibration_rmse_nm,
+    calibration_points, calibration_failed_fits), None if the fit is not possible
+    """
+    device = focus_device or mmc.getFocusDevice()
+    centre = mmc.getPosition(device)
+    offsets = np.arange(-half_range_um, half_range_um + step_um / 2, step_um)
+    fit = StreamingPolynomialFit(degree=2)
+    failed_fits = 0
+
+    # fit every frame, and derive the position from the fits rather than from the current calibration
+    fit_profiles, reference_library = handler.fit_profiles, handler.reference_library
+    handler.fit_profiles = True
+    handler.reference_library = None
+    try:
+        for offset in offsets:
+            mmc.setPosition(device, centre + offset)
+            mmc.waitForDevice(device)
+            last_frame_id = handler.frames_grabbed + discard_frames
+            for _ in range(frames_per_step):
+                frame = handler.wait_for_frame(last_frame_id, timeout=frame_timeout_s)
+                if frame is None:
+                    raise RuntimeError(f"No frame received within {frame_timeout_s} s of moving to {centre + offset}.")
+                measurement = frame[0]
+                last_frame_id = measurement.frame_id
+                if not measurement.ok:
+                    failed_fits += 1
+                    continue
+                # same convention as calculate_position: position = -polyval(p, sx - sy), in nm
+                fit.add(measurement.fit_x[2] - measurement.fit_y[2], -offset * 1000)
+    finally:
+        mmc.setPosition(device, centre)
+        handler.fit_profiles, handler.reference_library = fit_profiles, reference_library
+
+    coefficients = fit.fit()
+    if coefficients is None:
+        return None
+    p2, p1, p0 = (float(c) for c in coefficients)
+    return {"p2": p2, "p1": p1, "p0": p0,
+            "calibration_r_squared": float(fit.r_squared(coefficients)),
+            "calibration_rmse_nm": float(fit.rmse(coefficients)),
+            "calibration_points": fit.n,
+            "calibration_failed_fits": failed_fits}
+
+
+def write_calibration(config_path, calibration):
+    """
+    Write a calibration returned by run_calibration into the config file, keeping the other settings.
+    :param config_path: path of autofocus_config.json
+    :param calibration: dict returned by run_calibration
+    """
+    with open(config_path, "r") as f:
+        settings = json.load(f)
+    settings.update(calibration)
+    with open(config_path, "w") as f:
+        json.dump(settings, f)
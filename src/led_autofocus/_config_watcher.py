@@ -0,0 +1,50 @@
+import json
+import os
+from pathlib import Path
+
+
+class ConfigWatcher:
+    """Watches a .json config file, and only re-reads it when it changed on disk.
+
+    poll() is a stat of the file, cheap enough to be called from a Qt timer. The file is re-read when its modification
+    time or size changed. A file that can not be parsed (e.g. caught half written) is reported and read again on its
+    next change.
+
+    Parameters
+    ----------
+    path : str or Path
+        Config file to watch
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._signature = self._stat()
+
+    def read(self):
+        """Read the config file, and take it as the current version. :return: settings dict"""
+        self._signature = self._stat()
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def poll(self):
+        """
+        Check the config file for changes.
+        :return: the new settings if the file changed since it was last read, None otherwise
+        """
+        signature = self._stat()
+        if signature == self._signature:
+            return None
+        self._signature = signature
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read the settings from {self.path}: {e}")
+            return None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,163 @@
+import threading
+
+import numpy as np
+
+from ._measurement import FocusMeasurement
+from ._position import calculate_position
+
+
+class FocusLockController:
+    """Qt-free focus lock, driven by the focus measurements of every frame.
+
+    The controller is registered as a measurement listener of an ImageHandler (or fed measurements by hand) and moves
+    the stage through `move_stage` so the measured position stays at the setpoint. Measurements flagged as not
+    settled (exposed while the stage moved) update the position but are not corrected. The correction is a discrete
+    PID on the position error, applied once per frame. With the default gains (kp=1, ki=kd=0) the correction is the
+    full error, as in the original widget loop.
+
+    Parameters
+    ----------
+    move_stage : callable
+        Called as move_stage(movement_um) with the relative z movement to apply, in um. May return the stage position
+        read back after the movement, in um
+    polyfit : list or None
+        Calibration polynomial [p2, p1, p0]. If None, the position derived by the ImageHandler is used
+    max_movement : float
+        Safety limit in um: if the error is larger than this the lock trips and no movement is made
+    kp, ki, kd : float
+        Proportional, integral and derivative gains, per frame
+    deadband_um : float
+        Errors smaller than this (in um) are not corrected
+    max_step_um : float or None
+        Rate limit, the largest movement made in a single update (in um). None for no limit
+    telemetry : TelemetryWriter or None
+        If set, every new frame is recorded with the movement it caused and the last stage position read back
+
+    Attributes
+    ----------
+    state : str
+        One of FocusLockController.IDLE, LOCKED, TRIPPED
+    setpoint : float
+        Locked position, in the units of the calibration (nm)
+    current_z : float
+        Last measured position
+    last_movement : float
+        Last movement sent to the stage, in um
+    stage_z_um : float
+        Last stage position returned by move_stage, NaN if unknown
+    """
+
+    IDLE = "idle"
+    LOCKED = "locked"
+    TRIPPED = "tripped"
+
+    def __init__(self, move_stage, polyfit=None, max_movement=10.0, kp=1.0, ki=0.0, kd=0.0, deadband_um=0.0,
+                 max_step_um=None, telemetry=None):
+        self.move_stage = move_stage
+        self.polyfit = polyfit
+        self.max_movement = max_movement
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.deadband_um = deadband_um
+        self.max_step_um = max_step_um
+        self.telemetry = telemetry
+
+        self.state = FocusLockController.IDLE
+        self.setpoint = np.nan
+        self.current_z = np.nan
+        self.last_movement = 0.0
+        self.stage_z_um = np.nan
+        self.last_frame_id = -1
+
+        self._integral = 0.0
+        self._previous_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def locked(self):
+        return self.state == FocusLockController.LOCKED
+
+    def position(self, measurement):
+        """
+        Position of a measurement, through the controller calibration if set.
+        :param measurement: FocusMeasurement
+        :return: position, NaN if the measurement has no valid fit
+        """
+        if not measurement.ok:
+            return np.nan
+        if self.polyfit is None:
+            return measurement.z
+        return calculate_position(measurement.fit_x, measurement.fit_y, self.polyfit)
+
+    def lock(self, setpoint):
+        """Engage the lock at a given position."""
+        with self._lock:
+            self.setpoint = setpoint
+            self._integral = 0.0
+            self._previous_error = None
+            self.state = FocusLockController.LOCKED
+
+    def unlock(self):
+        """Disengage the lock."""
+        with self._lock:
+            self.state = FocusLockController.IDLE
+
+    def update(self, measurement: FocusMeasurement):
+        """
+        Consume the measurement of a new frame and correct the stage position if the lock is engaged.
+        :param measurement: FocusMeasurement of the frame
+        :return: movement sent to the stage in um, or None if no movement was made
+        """
+        with self._lock:
+            if measurement.frame_id <= self.last_frame_id:
+                # already seen this frame
+                return None
+            self.last_frame_id = measurement.frame_id
+            movement = self._update(measurement)
+
+        if movement is not None:
+            stage_z_um = self.move_stage(movement)
+            if stage_z_um is not None:
+                self.stage_z_um = stage_z_um
+        if self.telemetry is not None:
+            self.telemetry.record(measurement, np.nan if movement is None else movement, self.stage_z_um)
+        return movement
+
+    def _update(self, measurement):
+        z = self.position(measurement)
+        if np.isnan(z):
+            return None
+        self.current_z = z
+
+        if self.state != FocusLockController.LOCKED or not measurement.settled:
+            return None
+
+        movement = self._correction(z)
+        if movement is not None:
+            self.last_movement = movement
+        return movement
+
+    def _correction(self, z):
+        # movement is in um, positions are in nm
+        error = (self.setpoint - z) * 0.001
+
+        if np.abs(error) > self.max_movement:
+            print("Movement too big. No movement.")
+            self.state = FocusLockController.TRIPPED
+            return None
+
+        if np.abs(error) <= self.deadband_um:
+            self._previous_error = error
+            return None
+
+        self._integral += error
+        derivative = 0.0 if self._previous_error is None else error - self._previous_error
+        self._previous_error = error
+        movement = self.kp * error + self.ki * self._integral + self.kd * derivative
+
+        if self.max_step_um is not None:
+            movement = float(np.clip(movement, -self.max_step_um, self.max_step_um))
+        if movement == 0:
+            return None
+        return movement
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.optimize import curve_fit
 
 
 def Gaussian1D(x: np.ndarray, i0: float, x0: float, sx: float, amp: float) -> np.ndarray:
@@ -17,6 +16,26 @@ def Gaussian1D(x: np.ndarray, i0: float, x0: float, sx: float, amp: float) -> np
     return eq
 
 
+def gaussian_1d_into(out: np.ndarray, x: np.ndarray, i0: float, x0: float, sx: float, amp: float) -> np.ndarray:
+    """
+    Same as Gaussian1D, but evaluated in place into a preallocated array.
+    :param out: array the Gaussian is written into, same shape as x
+    :param x: array of x values to be passed into the function
+    :param i0: constant offset
+    :param x0: peak position
+    :param sx: standard deviation
+    :param amp: amplitude
+    :return: out
+    """
+    np.subtract(x, float(x0), out=out, casting="same_kind")
+    np.square(out, out=out)
+    np.multiply(out, -1 / (2 * sx**2), out=out, casting="same_kind")
+    np.exp(out, out=out)
+    np.multiply(out, amp, out=out, casting="same_kind")
+    np.add(out, i0, out=out, casting="same_kind")
+    return out
+
+
 def fit_gaussian(x: np.ndarray, profile: np.ndarray, init_guess: list, bounds=(-np.inf, np.inf)) -> np.ndarray or None:
     """
     Fit a Gaussian to a profile
@@ -25,6 +44,9 @@ def fit_gaussian(x: np.ndarray, profile: np.ndarray, init_guess: list, bounds=(-
     :param init_guess: initial guess, [i0, x0, sx, amp]
     :return: final guess, [i0, x0, sx, amp] or None if the fit failed
     """
+    # imported on first use, scipy is only needed for this fallback and takes longer to import than the rest of the
+    # autofocus core
+    from scipy.optimize import curve_fit
     # popt, pcov = curve_fit(Gaussian1D, x, profile, p0=init_guess, bounds=bounds)
     popt, pcov, infodic, mesg, ier = curve_fit(Gaussian1D, x, profile, p0=init_guess, bounds=bounds, full_output=True)
 
@@ -48,6 +70,337 @@ def get_initial_guess(profile: np.ndarray) -> list:
     return [i0, x0, sx, amp]
 
 
+ESTIMATORS = ("curve_fit", "caruana", "moments")
+
+
+def estimate_gaussian_caruana(x: np.ndarray, profile: np.ndarray, threshold: float = 0.2) -> np.ndarray or None:
+    """
+    Closed-form Gaussian estimate from a weighted parabola fit to the log of the profile (Caruana's algorithm,
+    with the y^2 weighting from Guo to reduce the bias introduced by noise in the tails).
+    The offset is taken from the edges of the profile and only samples above `threshold` of the peak are used.
+    :param x: x-coordinate of the profile
+    :param profile: y-coordinate of the profile
+    :param threshold: fraction of the peak height (above the offset) below which samples are ignored
+    :return: estimate, [i0, x0, sx, amp] or None if the estimate is not a valid Gaussian
+    """
+    i0 = _estimate_offset(profile)
+    y = profile - i0
+    peak = np.max(y)
+    if not peak > 0:
+        return None
+
+    mask = y > threshold * peak
+    if np.count_nonzero(mask) < 3:
+        return None
+
+    xs = x[mask]
+    ys = y[mask]
+    # centre the coordinates on the peak to keep the normal equations well conditioned
+    xc = xs[np.argmax(ys)]
+    u = xs - xc
+    w = ys ** 2
+    log_y = np.log(ys)
+
+    # weighted least squares for log(y) = a + b*u + c*u^2
+    s0 = np.sum(w)
+    s1 = np.sum(w * u)
+    s2 = np.sum(w * u ** 2)
+    s3 = np.sum(w * u ** 3)
+    s4 = np.sum(w * u ** 4)
+    t0 = np.sum(w * log_y)
+    t1 = np.sum(w * u * log_y)
+    t2 = np.sum(w * u ** 2 * log_y)
+    try:
+        a, b, c = np.linalg.solve([[s0, s1, s2], [s1, s2, s3], [s2, s3, s4]], [t0, t1, t2])
+    except np.linalg.LinAlgError:
+        return None
+
+    if not c < 0:
+        return None
+
+    x0 = xc - b / (2 * c)
+    sx = np.sqrt(-1 / (2 * c))
+    amp = np.exp(a - b ** 2 / (4 * c))
+    return np.array([i0, x0, sx, amp])
+
+
+def estimate_gaussian_moments(x: np.ndarray, profile: np.ndarray, threshold: float = 0.2) -> np.ndarray or None:
+    """
+    Moment-based Gaussian estimate: the peak position and width are the first and second moments of the
+    offset-subtracted profile. Samples below `threshold` of the peak are ignored, so the width is estimated from the
+    core of the peak and corrected for the truncation of the tails.
+    :param x: x-coordinate of the profile
+    :param profile: y-coordinate of the profile
+    :param threshold: fraction of the peak height (above the offset) below which samples are ignored
+    :return: estimate, [i0, x0, sx, amp] or None if the estimate is not a valid Gaussian
+    """
+    i0 = _estimate_offset(profile)
+    y = profile - i0
+    peak = np.max(y)
+    if not peak > 0:
+        return None
+
+    # subtract the threshold level, so the truncated peak is still a (shifted) Gaussian cap
+    w = y - threshold * peak
+    mask = w > 0
+    if np.count_nonzero(mask) < 3:
+        return None
+
+    xs = x[mask]
+    w = w[mask]
+    total = np.sum(w)
+    x0 = np.sum(w * xs) / total
+    variance = np.sum(w * (xs - x0) ** 2) / total
+
+    # the variance of the cap only depends on the threshold, so it can be rescaled to the width of the Gaussian
+    sx = np.sqrt(variance / _moment_truncation_factor(threshold))
+    amp = peak
+    return np.array([i0, x0, sx, amp])
+
+
+def _estimate_offset(profile: np.ndarray) -> float:
+    """
+    Estimate the constant offset of a profile as the mean of its first and last 5% of samples.
+    :param profile: profile to estimate the offset of
+    :return: offset
+    """
+    n_edge = max(profile.shape[0] // 20, 1)
+    return (np.sum(profile[:n_edge]) + np.sum(profile[-n_edge:])) / (2 * n_edge)
+
+
+def _moment_truncation_factor(threshold: float) -> float:
+    """
+    Ratio between the variance of the cap (exp(-u^2/2) - t, for exp(-u^2/2) > t) and the variance of the full
+    unit Gaussian.
+    :param threshold: truncation level t, as a fraction of the peak
+    :return: variance ratio
+    """
+    if threshold <= 0:
+        return 1.0
+    u = np.linspace(-1, 1, 2001) * np.sqrt(-2 * np.log(threshold))
+    cap = np.exp(-u ** 2 / 2) - threshold
+    return float(np.sum(cap * u ** 2) / np.sum(cap))
+
+
+def check_gaussian_estimate(x: np.ndarray, profile: np.ndarray, estimate: np.ndarray or None, bounds=(-np.inf, np.inf),
+                            max_residual: float = 0.05) -> bool:
+    """
+    Quality check for a Gaussian estimate. The estimate is rejected if it is not finite, falls outside the bounds or
+    the profile, or if the rms residual of the model around the peak is above `max_residual` of the amplitude.
+    :param x: x-coordinate of the profile
+    :param profile: y-coordinate of the profile
+    :param estimate: estimate to check, [i0, x0, sx, amp]
+    :param bounds: (lower, upper) bounds on the parameters, as for fit_gaussian
+    :param max_residual: maximum rms residual, relative to the amplitude
+    :return: True if the estimate passes the check
+    """
+    if estimate is None or not np.all(np.isfinite(estimate)):
+        return False
+
+    i0, x0, sx, amp = estimate
+    if sx <= 0 or amp <= 0 or not x[0] <= x0 <= x[-1]:
+        return False
+
+    lower, upper = bounds
+    if np.any(estimate < lower) or np.any(estimate > upper):
+        return False
+
+    # only look at the residuals within 3 sigma of the peak, where the estimate is informative
+    mask = np.abs(x - x0) < 3 * sx
+    if np.count_nonzero(mask) < 3:
+        return False
+    residual = profile[mask] - Gaussian1D(x[mask], i0, x0, sx, amp)
+    return np.sqrt(np.mean(residual ** 2)) < max_residual * amp
+
+
+def fit_gaussian_fast(x: np.ndarray, profile: np.ndarray, init_guess: list, bounds=(-np.inf, np.inf),
+                      method: str = "caruana", max_residual: float = 0.05) -> np.ndarray or None:
+    """
+    Estimate a Gaussian with a closed-form estimator, falling back to fit_gaussian (curve_fit) only if the estimate
+    fails the quality check.
+    :param x: x-coordinate of the profile
+    :param profile: y-coordinate of the profile
+    :param init_guess: initial guess, [i0, x0, sx, amp], only used by the fallback
+    :param bounds: (lower, upper) bounds on the parameters
+    :param method: one of ESTIMATORS
+    :param max_residual: maximum rms residual, relative to the amplitude, for the estimate to be accepted
+    :return: final guess, [i0, x0, sx, amp] or None if the fit failed
+    """
+    if method == "caruana":
+        estimate = estimate_gaussian_caruana(x, profile)
+    elif method == "moments":
+        estimate = estimate_gaussian_moments(x, profile)
+    elif method == "curve_fit":
+        estimate = None
+    else:
+        raise ValueError(f"Unknown estimator '{method}', must be one of {ESTIMATORS}")
+
+    if estimate is not None and check_gaussian_estimate(x, profile, estimate, bounds, max_residual):
+        return estimate
+
+    if init_guess is None or np.any(np.asarray(init_guess) < bounds[0]) or np.any(np.asarray(init_guess) > bounds[1]):
+        # curve_fit needs a feasible starting point
+        init_guess = estimate if check_gaussian_estimate(x, profile, estimate, bounds, np.inf) \
+            else np.clip(get_initial_guess(profile), *bounds)
+    return fit_gaussian(x, profile, init_guess, bounds=bounds)
+
+
+def get_initial_guess_batch(x: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    """
+    Vectorised initial guess for a stack of profiles. The width is estimated from the number of samples above half
+    maximum.
+    :param x: x-coordinate of the profiles, shape (L,)
+    :param profiles: stack of profiles, shape (N, L)
+    :return: initial guesses, shape (N, 4), each row [i0, x0, sx, amp]
+    """
+    i0 = np.min(profiles, axis=1)
+    peak = np.max(profiles, axis=1)
+    amp = peak - i0
+    x0 = x[np.argmax(profiles, axis=1)]
+    spacing = (x[-1] - x[0]) / (x.shape[0] - 1)
+    above_half = np.count_nonzero(profiles > (i0 + amp / 2)[:, None], axis=1)
+    sx = np.maximum(above_half, 1) * spacing / (2 * np.sqrt(2 * np.log(2)))
+    return np.stack([i0, x0, sx, amp], axis=1)
+
+
+def fit_gaussian_batch(x: np.ndarray, profiles: np.ndarray, init_guess: np.ndarray = None, bounds=(-np.inf, np.inf),
+                       max_iterations: int = 200, ftol: float = 1e-8, xtol: float = 1e-8, gtol: float = 1e-8,
+                       chunk_size: int = 256) -> (np.ndarray, np.ndarray):
+    """
+    Fit a Gaussian to each row of a stack of profiles, with a Levenberg-Marquardt loop vectorised over the rows.
+    Parameters are clipped to the (per-row) bounds after every step. Rows stop iterating independently as soon as
+    they converge.
+    The status codes follow the `ier` convention of fit_gaussian (MINPACK): 1 - relative reduction of the cost below
+    ftol, 2 - relative step below xtol, 3 - both 1 and 2, 4 - gradient below gtol, 5 - max_iterations reached,
+    6 - the fit diverged (non-finite cost). Codes greater than 4 are failures.
+    :param x: x-coordinate of the profiles, shape (L,)
+    :param profiles: stack of profiles, shape (N, L)
+    :param init_guess: initial guess, shape (4,) or (N, 4). If None, it is computed with get_initial_guess_batch
+    :param bounds: (lower, upper) bounds, each a scalar, shape (4,) or shape (N, 4)
+    :param max_iterations: maximum number of iterations for each row
+    :param ftol: tolerance on the relative reduction of the cost
+    :param xtol: tolerance on the relative step
+    :param gtol: tolerance on the largest gradient component, relative to the cost
+    :param chunk_size: number of rows fitted together, to limit the memory used by the jacobians
+    :return: (params, ier) - final guesses of shape (N, 4) and status codes of shape (N,)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=np.float64))
+    n_profiles = profiles.shape[0]
+
+    if init_guess is None:
+        init_guess = get_initial_guess_batch(x, profiles)
+    lower = np.broadcast_to(np.asarray(bounds[0], dtype=np.float64), (n_profiles, 4))
+    upper = np.broadcast_to(np.asarray(bounds[1], dtype=np.float64), (n_profiles, 4))
+    params = np.clip(np.broadcast_to(np.asarray(init_guess, dtype=np.float64), (n_profiles, 4)), lower, upper)
+
+    ier = np.zeros(n_profiles, dtype=np.int8)
+    for start in range(0, n_profiles, chunk_size):
+        rows = slice(start, start + chunk_size)
+        params[rows], ier[rows] = _levenberg_marquardt(x, profiles[rows], params[rows], lower[rows], upper[rows],
+                                                       max_iterations, ftol, xtol, gtol)
+    return params, ier
+
+
+def _gaussian_residuals_batch(x: np.ndarray, profiles: np.ndarray, params: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Residuals of Gaussian1D for a stack of profiles.
+    :param x: x-coordinate of the profiles, shape (L,)
+    :param profiles: stack of profiles, shape (N, L)
+    :param params: parameters, shape (N, 4)
+    :return: (residuals, exponential) both of shape (N, L). The exponential term is kept for the jacobian.
+    """
+    i0, x0, sx, amp = (params[:, i, None] for i in range(4))
+    exponential = np.exp(-(x[None, :] - x0) ** 2 / (2 * sx ** 2))
+    return i0 + amp * exponential - profiles, exponential
+
+
+def _gaussian_normal_equations_batch(x: np.ndarray, params: np.ndarray, residuals: np.ndarray,
+                                     exponential: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Gauss-Newton normal equations (J^T J and J^T r) of Gaussian1D for a stack of profiles.
+    :param x: x-coordinate of the profiles, shape (L,)
+    :param params: parameters, shape (N, 4)
+    :param residuals: residuals, shape (N, L)
+    :param exponential: exponential term of the model, shape (N, L)
+    :return: (jtj, gradient) of shapes (N, 4, 4) and (N, 4)
+    """
+    _, x0, sx, amp = (params[:, i, None] for i in range(4))
+    dx = x[None, :] - x0
+    jacobian = np.empty((params.shape[0], 4, x.shape[0]))
+    jacobian[:, 0] = 1
+    np.multiply(exponential, amp * dx / sx ** 2, out=jacobian[:, 1])
+    np.multiply(jacobian[:, 1], dx / sx, out=jacobian[:, 2])
+    jacobian[:, 3] = exponential
+    jtj = jacobian @ jacobian.transpose(0, 2, 1)
+    gradient = (jacobian @ residuals[:, :, None])[:, :, 0]
+    return jtj, gradient
+
+
+def _levenberg_marquardt(x, profiles, params, lower, upper, max_iterations, ftol, xtol, gtol):
+    """
+    Vectorised Levenberg-Marquardt loop used by fit_gaussian_batch, see there for the parameters.
+    """
+    params = params.copy()
+    ier = np.zeros(params.shape[0], dtype=np.int8)
+    damping = np.full(params.shape[0], 1e-3)
+    active = np.arange(params.shape[0])
+    tiny = np.finfo(float).tiny
+
+    residuals, exponential = _gaussian_residuals_batch(x, profiles, params)
+    cost = np.einsum("nl,nl->n", residuals, residuals)
+
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+
+        current = params[active]
+        current_cost = cost[active]
+        jtj, gradient = _gaussian_normal_equations_batch(x, current, residuals, exponential)
+
+        # gradient test, before taking the step
+        small_gradient = np.max(np.abs(gradient), axis=1) <= gtol * np.maximum(current_cost, tiny)
+
+        diagonal = np.maximum(np.diagonal(jtj, axis1=1, axis2=2), 1e-12)
+        system = jtj + (damping[active, None] * diagonal)[:, :, None] * np.eye(4)
+        try:
+            step = -np.linalg.solve(system, gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = -gradient / diagonal
+
+        trial = np.clip(current + step, lower[active], upper[active])
+        trial_residuals, trial_exponential = _gaussian_residuals_batch(x, profiles[active], trial)
+        trial_cost = np.einsum("nl,nl->n", trial_residuals, trial_residuals)
+
+        accepted = trial_cost < current_cost
+        reduction = (current_cost - trial_cost) / np.maximum(current_cost, tiny)
+        small_reduction = accepted & (reduction <= ftol)
+        small_step = np.all(np.abs(trial - current) <= xtol * (xtol + np.abs(current)), axis=1)
+
+        params[active[accepted]] = trial[accepted]
+        cost[active[accepted]] = trial_cost[accepted]
+        residuals[accepted] = trial_residuals[accepted]
+        exponential[accepted] = trial_exponential[accepted]
+        damping[active] = np.where(accepted, damping[active] / 10, damping[active] * 10)
+
+        status = np.zeros(active.size, dtype=np.int8)
+        status[small_gradient] = 4
+        status[small_step] = 2
+        status[small_reduction] = 1
+        status[small_reduction & small_step] = 3
+        status[~np.isfinite(cost[active])] = 6
+        ier[active] = status
+
+        # only keep iterating on the rows which have not converged yet
+        if np.any(status):
+            keep = status == 0
+            active = active[keep]
+            residuals = residuals[keep]
+            exponential = exponential[keep]
+
+    ier[active] = 5
+    return params, ier
+
 if __name__ == "__main__":
     # Test the Gaussian fitting
     x = np.linspace(0, 100, 100)
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed-size history of (time, value) samples, keeping the most recent `capacity` samples.
+
+    Every sample is written twice, at i and i + capacity, in buffers of twice the capacity. The samples currently held
+    are then always a contiguous slice, so they can be plotted without copying or reordering.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of samples held
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(int(capacity), 1)
+        self._time = np.zeros(2 * self.capacity, dtype=np.float64)
+        self._data = np.zeros(2 * self.capacity, dtype=np.float64)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, time, value):
+        """Add a sample, replacing the oldest one when the buffer is full."""
+        i = self._next
+        self._time[i] = self._time[i + self.capacity] = time
+        self._data[i] = self._data[i + self.capacity] = value
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def view(self):
+        """
+        The samples held, oldest first.
+        :return: (times, values), read-only views of the buffers
+        """
+        start = self._next + self.capacity - self._count
+        times = self._time[start:start + self._count]
+        values = self._data[start:start + self._count]
+        times.flags.writeable = False
+        values.flags.writeable = False
+        return times, values
+
+    def decimated(self, max_points):
+        """
+        The samples held, reduced to at most max_points by keeping the minimum and maximum of consecutive bins, so
+        spikes stay visible. No reduction (and no copy) when there are fewer samples than max_points.
+        :param max_points: maximum number of points returned
+        :return: (times, values)
+        """
+        times, values = self.view()
+        if max_points is None or self._count <= max_points:
+            return times, values
+
+        bin_size = int(np.ceil(2 * self._count / max_points))
+        n_bins = self._count // bin_size
+        # the oldest samples that do not fill a bin are dropped, rather than the newest
+        start = self._count - n_bins * bin_size
+        bins = values[start:].reshape(n_bins, bin_size)
+        bin_times = times[start:].reshape(n_bins, bin_size)
+        rows = np.arange(n_bins)
+        i_min = np.argmin(bins, axis=1)
+        i_max = np.argmax(bins, axis=1)
+        # keep the two extremes of each bin in time order
+        first = np.minimum(i_min, i_max)
+        second = np.maximum(i_min, i_max)
+        decimated_times = np.stack([bin_times[rows, first], bin_times[rows, second]], axis=1).ravel()
+        decimated_values = np.stack([bins[rows, first], bins[rows, second]], axis=1).ravel()
+        return decimated_times, decimated_values
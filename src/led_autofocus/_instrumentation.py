@@ -0,0 +1,128 @@
+import math
+import time
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """Histogram of durations with fixed, logarithmically spaced buckets, so recording is O(1) and needs no
+    allocation, whatever the number of samples. Percentiles are resolved to the upper edge of their bucket.
+
+    Parameters
+    ----------
+    lowest_ns : int
+        Upper edge of the first bucket, shorter durations are counted in it
+    highest_ns : int
+        Lower edge of the last bucket, longer durations are counted in it
+    buckets_per_decade : int
+        Resolution of the histogram, 20 buckets per decade is about 12% per bucket
+    """
+
+    def __init__(self, lowest_ns=1_000, highest_ns=10_000_000_000, buckets_per_decade=20):
+        self.lowest_ns = lowest_ns
+        self.buckets_per_decade = buckets_per_decade
+        n_buckets = int(math.ceil(math.log10(highest_ns / lowest_ns) * buckets_per_decade)) + 2
+        self.counts = np.zeros(n_buckets, dtype=np.int64)
+        # upper edge of every bucket, the last one is open ended
+        self.edges_ns = lowest_ns * 10 ** (np.arange(n_buckets) / buckets_per_decade)
+        self.edges_ns[-1] = np.inf
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, duration_ns):
+        if duration_ns <= self.lowest_ns:
+            index = 0
+        else:
+            index = min(int(math.ceil(math.log10(duration_ns / self.lowest_ns) * self.buckets_per_decade)),
+                        self.counts.shape[0] - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def percentile(self, q):
+        """
+        Duration below which a fraction q of the samples fall.
+        :param q: fraction, between 0 and 1
+        :return: upper edge of the bucket of the percentile in ns (the maximum for the last bucket), NaN if empty
+        """
+        if self.count == 0:
+            return np.nan
+        index = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        index = min(index, self.counts.shape[0] - 1)
+        return min(self.edges_ns[index], self.max_ns)
+
+    def summary(self):
+        """Count, mean, p50, p99 and max of the durations, in ms."""
+        if self.count == 0:
+            return {"count": 0, "mean_ms": np.nan, "p50_ms": np.nan, "p99_ms": np.nan, "max_ms": np.nan}
+        return {"count": self.count, "mean_ms": self.total_ns / self.count / 1e6,
+                "p50_ms": self.percentile(0.5) / 1e6, "p99_ms": self.percentile(0.99) / 1e6,
+                "max_ms": self.max_ns / 1e6}
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+
+class Instrumentation:
+    """Latency histograms of the stages of the autofocus loop, shared by the ImageHandler, the controller's stage
+    callback and the widget.
+
+    Durations are measured with time.perf_counter_ns. Callers check `enabled` before taking timestamps, so the cost
+    when disabled is an attribute lookup. It can be switched on and off at any time.
+
+    Stages
+    ------
+    frame_interval : time between two grab callbacks
+    queue : grab callback to the start of processing (pipeline hand-over)
+    projection : projections of the frame
+    fit : Gaussian fits (or reference library lookup)
+    position : position from the fits
+    listeners : measurement listeners, including the controller and the stage movement
+    frame : grab callback to the end of processing, the latency of a measurement
+    stage_move : stage command issued to returned
+    gui_tick : duration of a widget update
+    gui_interval : time between two widget updates
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether durations are recorded
+    """
+
+    STAGES = ("frame_interval", "queue", "projection", "fit", "position", "listeners", "frame", "stage_move",
+              "gui_tick", "gui_interval")
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {stage: LatencyHistogram() for stage in Instrumentation.STAGES}
+
+    @staticmethod
+    def now():
+        return time.perf_counter_ns()
+
+    def record(self, stage, start_ns, end_ns=None):
+        """Record the duration of a stage, from start_ns to end_ns (now if None)."""
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        self.histograms[stage].add(end_ns - start_ns)
+
+    def summary(self):
+        """Count, mean, p50, p99 and max (in ms) of every stage with samples."""
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items() if histogram.count}
+
+    def report(self):
+        """Summary as a table, one line per stage."""
+        lines = [f"{'stage':<15}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:<15}{s['count']:>8}{s['p50_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}")
+        return "\n".join(lines)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class FocusMeasurement:
+    """Immutable record of the focus measurement made on a single frame.
+
+    ImageHandler publishes a new record for every processed frame by replacing its `measurement` attribute. A single
+    attribute assignment is atomic, so readers always get all the fields from the same frame without any locking.
+
+    Parameters
+    ----------
+    frame_id : int
+        Sequential id of the frame, counted from the creation of the handler
+    timestamp : int
+        Camera timestamp of the frame
+    fit_x : numpy.ndarray or None
+        Gaussian fit of the x projection, [i0, x0, sx, amp], None if not fitted or the fit failed
+    fit_y : numpy.ndarray or None
+        Gaussian fit of the y projection, [i0, y0, sy, amp], None if not fitted or the fit failed
+    status : int
+        One of FocusMeasurement.OK, NOT_FITTED, FIT_FAILED, REJECTED (fitted, but rejected as an outlier by a
+        FitTracker)
+    z : float
+        Focus position derived from the fits, NaN if not available
+    roi : tuple
+        (x_lo, x_hi, y_lo, y_hi) region of interest the projections were computed in
+    settled : bool
+        False if the stage moved (or had a movement pending) during the exposure of the frame
+    """
+
+    OK = 0
+    NOT_FITTED = 1
+    FIT_FAILED = 2
+    REJECTED = 3
+
+    __slots__ = ("frame_id", "timestamp", "fit_x", "fit_y", "status", "z", "roi", "settled")
+
+    def __init__(self, frame_id, timestamp, fit_x=None, fit_y=None, status=NOT_FITTED, z=np.nan, roi=None,
+                 settled=True):
+        object.__setattr__(self, "frame_id", frame_id)
+        object.__setattr__(self, "timestamp", timestamp)
+        object.__setattr__(self, "fit_x", _read_only(fit_x))
+        object.__setattr__(self, "fit_y", _read_only(fit_y))
+        object.__setattr__(self, "status", status)
+        object.__setattr__(self, "z", z)
+        object.__setattr__(self, "roi", roi)
+        object.__setattr__(self, "settled", settled)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FocusMeasurement is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FocusMeasurement is immutable")
+
+    @property
+    def ok(self):
+        return self.status == FocusMeasurement.OK
+
+    def __repr__(self):
+        return f"FocusMeasurement(frame_id={self.frame_id}, timestamp={self.timestamp}, status={self.status}, " \
+               f"z={self.z}, fit_x={self.fit_x}, fit_y={self.fit_y}, settled={self.settled})"
+
+
+def _read_only(vector):
+    if vector is None:
+        return None
+    vector = np.array(vector, dtype=np.float64)
+    vector.setflags(write=False)
+    return vector
@@ -0,0 +1,126 @@
+import numpy as np
+
+# width, in pixels, of the border of the frame (or roi) the background level is estimated from
+BACKGROUND_BORDER = 4
+
+
+def image_moments(window: np.ndarray, x_coords: np.ndarray, y_coords: np.ndarray, x_sum: np.ndarray = None,
+                  y_sum: np.ndarray = None, border: int = BACKGROUND_BORDER):
+    """
+    Background-subtracted zeroth, first and second moments of a Mono8 frame or region of interest, including the
+    cross term. The moments along x and y only need the column and row sums (the projections), the cross term is the
+    only full pass over the pixels. The background is the mean level of a border of the window, and is subtracted
+    from the moments in closed form rather than from the pixels.
+    :param window: Mono8 frame or region of interest
+    :param x_coords: x-coordinate of the columns of the window, evenly spaced
+    :param y_coords: y-coordinate of the rows of the window, evenly spaced
+    :param x_sum: column sums of the window (uint32), computed if None
+    :param y_sum: row sums of the window (uint32), computed if None
+    :param border: width of the border the background is estimated from, in pixels
+    :return: (background, total, x0, y0, covariance) with covariance the 2x2 matrix [[sxx, sxy], [sxy, syy]], in
+    squared coordinate units. None if there is no signal above the background
+    """
+    height, width = window.shape
+    if x_sum is None:
+        x_sum = np.sum(window, axis=0, dtype=np.uint32)
+    if y_sum is None:
+        y_sum = np.sum(window, axis=1, dtype=np.uint32)
+
+    # the border strips overlap in the corners, which are background as well
+    b = max(1, min(border, width // 4, height // 4))
+    edge = (np.sum(x_sum[:b], dtype=np.uint64) + np.sum(x_sum[-b:], dtype=np.uint64) +
+            np.sum(y_sum[:b], dtype=np.uint64) + np.sum(y_sum[-b:], dtype=np.uint64))
+    background = float(edge) / (2 * b * (width + height))
+
+    # moments in pixel indices of the window, converted to coordinates at the end. The cross term is the row sums
+    # weighted by the column index, in integers: a uint32 sum holds 255 * width^2 / 2 up to a width of 5800 pixels
+    index_dtype = np.uint32 if 255 * width * (width - 1) // 2 < 2 ** 32 else np.uint64
+    row_x = np.einsum("ij,j->i", window, np.arange(width, dtype=index_dtype))
+    k = np.arange(width, dtype=np.float64)
+    l = np.arange(height, dtype=np.float64)
+    m00 = float(np.sum(x_sum, dtype=np.uint64))
+    m10 = np.dot(x_sum, k)
+    m20 = np.dot(x_sum, k * k)
+    m01 = np.dot(y_sum, l)
+    m02 = np.dot(y_sum, l * l)
+    m11 = np.dot(row_x, l)
+
+    # subtract the moments of a constant background over the window
+    sum_k, sum_kk = width * (width - 1) / 2, (width - 1) * width * (2 * width - 1) / 6
+    sum_l, sum_ll = height * (height - 1) / 2, (height - 1) * height * (2 * height - 1) / 6
+    total = m00 - background * width * height
+    if not total > 0:
+        return None
+    kc = (m10 - background * height * sum_k) / total
+    lc = (m01 - background * width * sum_l) / total
+    vkk = (m20 - background * height * sum_kk) / total - kc * kc
+    vll = (m02 - background * width * sum_ll) / total - lc * lc
+    vkl = (m11 - background * sum_k * sum_l) / total - kc * lc
+
+    dx = (x_coords[-1] - x_coords[0]) / (width - 1) if width > 1 else 1.0
+    dy = (y_coords[-1] - y_coords[0]) / (height - 1) if height > 1 else 1.0
+    covariance = np.array([[dx * dx * vkk, dx * dy * vkl], [dx * dy * vkl, dy * dy * vll]])
+    return background, total, x_coords[0] + dx * kc, y_coords[0] + dy * lc, covariance
+
+
+def principal_axes(covariance: np.ndarray):
+    """
+    Widths and orientation of a spot from the covariance of its intensity.
+    :param covariance: 2x2 matrix [[sxx, sxy], [sxy, syy]]
+    :return: (s_major, s_minor, angle), the standard deviations along the principal axes and the angle of the major
+    axis from the x axis in radians, in [-pi/2, pi/2]. None if the covariance is not positive definite
+    """
+    sxx, sxy, syy = covariance[0, 0], covariance[0, 1], covariance[1, 1]
+    mean = (sxx + syy) / 2
+    spread = np.hypot((sxx - syy) / 2, sxy)
+    if not mean - spread > 0:
+        return None
+    angle = 0.5 * np.arctan2(2 * sxy, sxx - syy)
+    return np.sqrt(mean + spread), np.sqrt(mean - spread), angle
+
+
+def estimate_spot_moments(window: np.ndarray, x_coords: np.ndarray, y_coords: np.ndarray, x_sum: np.ndarray = None,
+                          y_sum: np.ndarray = None, axis_angle: float = 0.0):
+    """
+    Astigmatic spot estimate from the 2D moments of the frame, in place of Gaussian fits of the two projections. The
+    widths are taken along the principal axes of the spot, so the width difference does not depend on the spot being
+    aligned with the sensor. The principal axis closest to axis_angle is reported as the x width: with the default
+    axis_angle, for a spot aligned with the sensor the result matches the fits of the projections, and the width
+    difference can be used with the same calibration polynomial. The sign of the difference is only defined for
+    spots within 45 degrees of axis_angle, set it to the orientation of the astigmatism for spots rotated further.
+    :param window: Mono8 frame or region of interest
+    :param x_coords: x-coordinate of the columns of the window, evenly spaced
+    :param y_coords: y-coordinate of the rows of the window, evenly spaced
+    :param x_sum: column sums of the window (uint32), computed if None
+    :param y_sum: row sums of the window (uint32), computed if None
+    :param axis_angle: orientation of the x axis of the astigmatism, in radians from the x axis of the sensor
+    :return: (fit_x, fit_y, angle) with fit_x [i0, x0, sx, amp] and fit_y [i0, y0, sy, amp] in the units of the
+    projections normalised to a maximum of 1, and angle the orientation of the x axis of the spot in radians, within
+    pi/4 of axis_angle. None if there is no spot
+    """
+    if x_sum is None:
+        x_sum = np.sum(window, axis=0, dtype=np.uint32)
+    if y_sum is None:
+        y_sum = np.sum(window, axis=1, dtype=np.uint32)
+    moments = image_moments(window, x_coords, y_coords, x_sum, y_sum)
+    if moments is None:
+        return None
+    background, total, x0, y0, covariance = moments
+    axes = principal_axes(covariance)
+    if axes is None:
+        return None
+    s_major, s_minor, angle = axes
+    # angle of the major axis from the x axis of the astigmatism, in [-pi/2, pi/2)
+    offset = (angle - axis_angle + np.pi / 2) % np.pi - np.pi / 2
+    if abs(offset) <= np.pi / 4:
+        sx, sy = s_major, s_minor
+        angle = axis_angle + offset
+    else:
+        sx, sy = s_minor, s_major
+        angle = axis_angle + offset - np.copysign(np.pi / 2, offset)
+
+    # offset and amplitude of the normalised projections, so the estimate can be drawn over them like a fit
+    height, width = window.shape
+    i0_x = min(background * height / max(x_sum.max(), 1), 1.0)
+    i0_y = min(background * width / max(y_sum.max(), 1), 1.0)
+    return np.array([i0_x, x0, sx, 1 - i0_x]), np.array([i0_y, y0, sy, 1 - i0_y]), angle
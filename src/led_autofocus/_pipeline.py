@@ -0,0 +1,308 @@
+import threading
+import traceback
+
+import numpy as np
+
+
+class LatestFrameSlot:
+    """Single-slot, latest-frame-wins hand-over of frames from the pylon grab thread to a worker thread.
+
+    Frames are copied into one of three preallocated buffers: one being written by the grab thread, one pending and
+    one being processed by the worker. If a new frame arrives while the previous one is still pending, the pending
+    frame is dropped and replaced.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the frames
+    dtype : numpy.dtype
+        Data type of the frames
+
+    Attributes
+    ----------
+    frames_received : int
+        Number of frames put into the slot
+    frames_dropped : int
+        Number of frames superseded by a newer frame before the worker took them
+    """
+
+    def __init__(self, shape, dtype=np.uint8):
+        self._buffers = [np.zeros(shape, dtype=dtype) for _ in range(3)]
+        self._free = [0, 1, 2]
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        # called after every put, e.g. to wake up a FittingPool
+        self.on_put = None
+
+        self.frames_received = 0
+        self.frames_dropped = 0
+
+    @property
+    def queue_depth(self):
+        """Number of frames waiting for the worker (0 or 1)."""
+        return 0 if self._pending is None else 1
+
+    def put(self, frame, timestamp, frame_id, arrival_ns=0):
+        """Copy a frame into the slot, replacing the pending frame if there is one. Never blocks on the worker.
+        arrival_ns is the host time the frame was received, passed through to the worker."""
+        with self._condition:
+            index = self._free.pop()
+        # copy outside the lock, so the worker can take the pending frame in the meantime
+        np.copyto(self._buffers[index], frame)
+        with self._condition:
+            if self._pending is not None:
+                self._free.append(self._pending[0])
+                self.frames_dropped += 1
+            self._pending = (index, timestamp, frame_id, arrival_ns)
+            self.frames_received += 1
+            self._condition.notify()
+        if self.on_put is not None:
+            self.on_put()
+
+    def take(self, timeout=None):
+        """
+        Wait for a pending frame and take it.
+        :param timeout: maximum time to wait in seconds, None to wait forever
+        :return: (index, frame, timestamp, frame_id, arrival_ns), or None on timeout or if the slot was closed. The
+        buffer must be handed back with release(index) once processed.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending is not None or self._closed, timeout):
+                return None
+            if self._pending is None:
+                return None
+            index, timestamp, frame_id, arrival_ns = self._pending
+            self._pending = None
+        return index, self._buffers[index], timestamp, frame_id, arrival_ns
+
+    def release(self, index):
+        """Hand a buffer taken with take() back to the slot."""
+        with self._condition:
+            self._free.append(index)
+
+    def resize(self, shape):
+        """Re-allocate the buffers for frames of a new shape, dropping the pending frame. Only call while no frame is
+        being put or processed, e.g. with the camera stopped and the worker closed."""
+        with self._condition:
+            dtype = self._buffers[0].dtype
+            self._buffers = [np.zeros(shape, dtype=dtype) for _ in range(3)]
+            self._free = [0, 1, 2]
+            self._pending = None
+
+    def open(self):
+        """Re-open the slot after close()."""
+        with self._condition:
+            self._closed = False
+
+    def close(self):
+        """Wake up any worker waiting on the slot."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class FrameWorker:
+    """Worker thread processing the frames handed over through a LatestFrameSlot.
+
+    Parameters
+    ----------
+    slot : LatestFrameSlot
+        Slot the frames are taken from
+    process : callable
+        Called as process(frame, timestamp, frame_id, arrival_ns) for every frame taken from the slot
+
+    Attributes
+    ----------
+    frames_processed : int
+        Number of frames processed by the worker
+    """
+
+    def __init__(self, slot, process):
+        self.slot = slot
+        self.process = process
+        self.frames_processed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.slot.open()
+        self._thread = threading.Thread(target=self._run, name="led-autofocus-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self.slot.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self.slot.take(timeout=0.1)
+            if item is None:
+                continue
+            index, frame, timestamp, frame_id, arrival_ns = item
+            try:
+                self.process(frame, timestamp, frame_id, arrival_ns)
+                self.frames_processed += 1
+            except Exception:
+                # same as in the grab callback, errors in a background thread are only reported by printing them
+                traceback.print_exc()
+            finally:
+                self.slot.release(index)
+
+
+class FittingPool:
+    """Bounded pool of worker threads processing the frames of several ImageHandlers.
+
+    Each handler keeps its own latest-frame slot, so a slow handler only ever has one frame waiting. Workers serve the
+    handlers with a pending frame in round-robin order, and a handler is processed by one worker at a time (its
+    buffers and fit state are not shared), so every camera gets its turn and the CPU used is bounded by the number
+    of workers, whatever the number of cameras.
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker threads
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._clients = []
+        self._next = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stop = False
+
+    def worker(self, slot, process):
+        """
+        Worker for one handler, with the same interface as FrameWorker.
+        :param slot: LatestFrameSlot of the handler
+        :param process: called as process(frame, timestamp, frame_id, arrival_ns)
+        :return: _PoolWorker
+        """
+        return _PoolWorker(self, slot, process)
+
+    def shutdown(self, timeout=1.0):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _register(self, client):
+        with self._condition:
+            if client not in self._clients:
+                self._clients.append(client)
+            client.slot.on_put = self._wake
+            self._stop = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="led-autofocus-pool", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _unregister(self, client):
+        with self._condition:
+            if client in self._clients:
+                self._clients.remove(client)
+            client.slot.on_put = None
+            # let a worker currently processing this client finish before returning
+            self._condition.wait_for(lambda: not client.busy, timeout=1.0)
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def _next_client(self):
+        # round robin over the clients with a pending frame that no other worker is processing
+        n = len(self._clients)
+        for i in range(n):
+            client = self._clients[(self._next + i) % n]
+            if not client.busy and client.slot.queue_depth:
+                self._next = (self._next + i + 1) % n
+                return client
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                client = None
+                while client is None:
+                    if self._stop:
+                        return
+                    client = self._next_client()
+                    if client is None:
+                        self._condition.wait(0.1)
+                client.busy = True
+            try:
+                client.process_pending()
+            finally:
+                with self._condition:
+                    client.busy = False
+                    self._condition.notify_all()
+
+
+class _PoolWorker:
+    """FrameWorker interface to a FittingPool, for one handler."""
+
+    def __init__(self, pool, slot, process):
+        self.pool = pool
+        self.slot = slot
+        self.process = process
+        self.frames_processed = 0
+        self.busy = False
+        self._registered = False
+
+    def start(self):
+        self.slot.open()
+        self.pool._register(self)
+        self._registered = True
+
+    def stop(self, timeout=1.0):
+        self.pool._unregister(self)
+        self._registered = False
+        self.slot.close()
+
+    def is_alive(self):
+        return self._registered
+
+    def process_pending(self):
+        item = self.slot.take(timeout=0)
+        if item is None:
+            return
+        index, frame, timestamp, frame_id, arrival_ns = item
+        try:
+            self.process(frame, timestamp, frame_id, arrival_ns)
+            self.frames_processed += 1
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.slot.release(index)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_fitting_pool(workers=2):
+    """
+    Process-wide FittingPool, created on the first call. Later calls return the same pool, and can only grow it.
+    :param workers: number of worker threads
+    :return: FittingPool
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = FittingPool(workers)
+        else:
+            _shared_pool.workers = max(_shared_pool.workers, workers)
+        return _shared_pool
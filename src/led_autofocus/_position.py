@@ -0,0 +1,14 @@
+import numpy as np
+
+
+def calculate_position(guessx, guessy, polyfit) -> float:
+    """
+    Focus position from the x and y Gaussian fits, through the calibration polynomial of the width difference.
+    :param guessx: fit of the x projection, [i0, x0, sx, amp]
+    :param guessy: fit of the y projection, [i0, y0, sy, amp]
+    :param polyfit: calibration polynomial coefficients, [p2, p1, p0]
+    :return: position, NaN if either fit is missing
+    """
+    if guessx is None or guessy is None:
+        return np.nan
+    return -np.polyval(polyfit, guessx[2] - guessy[2])
@@ -0,0 +1,178 @@
+import numpy as np
+
+# sources of the position of a measurement: the calibration polynomial applied to the fitted widths, or a
+# ReferenceLibrary
+POSITION_ESTIMATORS = ("polynomial", "library")
+
+# largest distance of a frame to the nearest reference, in multiples of the largest distance between neighbouring
+# references, for its position to be trusted
+MAX_DISTANCE_FACTOR = 1.0
+
+
+class ReferenceLibrary:
+    """Library of reference x/y projections recorded at known z offsets, used to estimate the focus position of a
+    frame without any fitting.
+
+    Each pair of projections is downsampled to a fixed number of bins and projected onto the first principal
+    components of the references. The position of a new frame is interpolated along the references closest to it in
+    that space.
+
+    Parameters
+    ----------
+    z : numpy.ndarray
+        Positions of the references, sorted, in nm
+    coordinates : numpy.ndarray
+        Principal component coordinates of the references, shape (M, n_components)
+    components : numpy.ndarray
+        Principal components, shape (n_components, 2 * n_bins)
+    mean : numpy.ndarray
+        Mean feature vector of the references, shape (2 * n_bins,)
+    n_bins : int
+        Number of bins each projection is downsampled to
+    roi : tuple or None
+        (x_lo, x_hi, y_lo, y_hi) region of interest the projections were computed in, None for the full frame
+    max_distance : float
+        Largest distance in component space to the nearest reference for which the estimated position is trusted.
+        Frames further away (outside the range of the library, or without a spot) are not given a position
+    """
+
+    def __init__(self, z, coordinates, components, mean, n_bins, roi=None, max_distance=np.inf):
+        self.z = np.asarray(z, dtype=np.float64)
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.components = np.asarray(components, dtype=np.float64)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.n_bins = int(n_bins)
+        self.roi = None if roi is None else tuple(int(v) for v in roi)
+        self.max_distance = float(max_distance)
+
+    @classmethod
+    def build(cls, z, x_profiles, y_profiles, n_bins=64, n_components=8, roi=None,
+              max_distance_factor=MAX_DISTANCE_FACTOR):
+        """
+        Build a library from reference projections.
+        :param z: positions of the references, in nm
+        :param x_profiles: x projections, shape (M, W)
+        :param y_profiles: y projections, shape (M, H)
+        :param n_bins: number of bins each projection is downsampled to, at most its length
+        :param n_components: number of principal components kept
+        :param roi: region of interest the projections were computed in, None for the full frame
+        :param max_distance_factor: max_distance of the library, in multiples of the largest distance between
+        neighbouring references
+        :return: ReferenceLibrary
+        """
+        z = np.asarray(z, dtype=np.float64)
+        order = np.argsort(z)
+        features = np.stack([_features(x, y, n_bins) for x, y in zip(x_profiles, y_profiles)])[order]
+
+        mean = features.mean(axis=0)
+        _, _, vt = np.linalg.svd(features - mean, full_matrices=False)
+        components = vt[:min(n_components, vt.shape[0])]
+        coordinates = (features - mean) @ components.T
+        # a frame between two references is at most half their distance from the nearest one, the rest of
+        # max_distance is a margin for the noise of the frames
+        spacing = np.linalg.norm(np.diff(coordinates, axis=0), axis=1)
+        max_distance = max_distance_factor * spacing.max() if spacing.size else np.inf
+        return cls(z[order], coordinates, components, mean, n_bins, roi, max_distance)
+
+    def embed(self, x_projection, y_projection):
+        """Principal component coordinates of a pair of projections."""
+        return (_features(x_projection, y_projection, self.n_bins) - self.mean) @ self.components.T
+
+    def estimate(self, x_projection, y_projection):
+        """
+        Estimate the position of a pair of projections. The nearest reference and its closest neighbour along z
+        define a segment, and the position is interpolated linearly along it.
+        :param x_projection: x projection, computed in the library roi
+        :param y_projection: y projection, computed in the library roi
+        :return: (z in nm, distance to the nearest reference in component space). z is clamped to the range of the
+        library, compare the distance with max_distance to know whether it can be trusted
+        """
+        point = self.embed(x_projection, y_projection)
+        distances = np.sum((self.coordinates - point) ** 2, axis=1)
+        nearest = int(np.argmin(distances))
+
+        neighbours = [i for i in (nearest - 1, nearest + 1) if 0 <= i < self.z.shape[0]]
+        if not neighbours:
+            return self.z[nearest], np.sqrt(distances[nearest])
+        neighbour = min(neighbours, key=lambda i: distances[i])
+
+        segment = self.coordinates[neighbour] - self.coordinates[nearest]
+        length = np.dot(segment, segment)
+        t = 0.0 if length == 0 else np.clip(np.dot(point - self.coordinates[nearest], segment) / length, 0, 1)
+        z = self.z[nearest] + t * (self.z[neighbour] - self.z[nearest])
+        return z, np.sqrt(distances[nearest])
+
+    def save(self, path):
+        """Save the library to a compressed .npz file."""
+        np.savez_compressed(path, z=self.z, coordinates=self.coordinates, components=self.components, mean=self.mean,
+                            n_bins=self.n_bins, roi=np.array(self.roi if self.roi is not None else []),
+                            max_distance=self.max_distance)
+
+    @classmethod
+    def load(cls, path):
+        """Load a library saved with save()."""
+        with np.load(path) as data:
+            roi = tuple(data["roi"]) if data["roi"].size else None
+            # libraries saved before max_distance was recorded trust every estimate
+            max_distance = float(data["max_distance"]) if "max_distance" in data else np.inf
+            return cls(data["z"], data["coordinates"], data["components"], data["mean"], int(data["n_bins"]), roi,
+                       max_distance)
+
+
+def acquire_reference_library(mmc, handler, half_range_um, step_um, n_bins=64, n_components=8, discard_frames=1,
+                              frame_timeout_s=1.0, max_distance_factor=MAX_DISTANCE_FACTOR, focus_device=None):
+    """
+    Record a reference library by moving the stage through centre +- half_range_um, with one fresh frame per
+    position. The current position is the reference (z = 0), the camera must be grabbing.
+    :param mmc: CMMCorePlus (or anything with the same z stage methods)
+    :param handler: ImageHandler registered with the grabbing camera
+    :param half_range_um: half width of the sweep in um
+    :param step_um: step between references in um
+    :param n_bins: number of bins each projection is downsampled to
+    :param n_components: number of principal components kept
+    :param discard_frames: frames skipped after each move, as they may have been exposed while moving
+    :param frame_timeout_s: maximum time to wait for a frame
+    :param max_distance_factor: max_distance of the library, in multiples of the largest distance between neighbouring
+    references
+    :param focus_device: label of the Z drive to move, None for the current focus device of mmc
+    :return: ReferenceLibrary
+    """
+    device = focus_device or mmc.getFocusDevice()
+    centre = mmc.getPosition(device)
+    offsets = np.arange(-half_range_um, half_range_um + step_um / 2, step_um)
+    x_profiles, y_profiles = [], []
+    fit_profiles, fixed_roi = handler.fit_profiles, handler.fixed_roi
+    handler.fit_profiles = False
+    handler.fixed_roi = handler.full_roi
+    try:
+        for offset in offsets:
+            mmc.setPosition(device, centre + offset)
+            mmc.waitForDevice(device)
+            frame = handler.wait_for_frame(handler.frames_grabbed + discard_frames, timeout=frame_timeout_s)
+            if frame is None:
+                raise RuntimeError(f"No frame received within {frame_timeout_s} s of moving to {centre + offset}.")
+            x_profiles.append(frame[1])
+            y_profiles.append(frame[2])
+    finally:
+        mmc.setPosition(device, centre)
+        handler.fit_profiles, handler.fixed_roi = fit_profiles, fixed_roi
+
+    # positions in nm, like the positions derived from the calibration polynomial
+    return ReferenceLibrary.build(offsets * 1000, x_profiles, y_profiles, n_bins, n_components, roi=None,
+                                  max_distance_factor=max_distance_factor)
+
+
+def _features(x_projection, y_projection, n_bins):
+    """Feature vector of a pair of projections: both downsampled to n_bins and rescaled to a maximum of 1."""
+    return np.concatenate([_downsample(x_projection, n_bins), _downsample(y_projection, n_bins)])
+
+
+def _downsample(profile, n_bins):
+    profile = np.asarray(profile, dtype=np.float64)
+    # a profile shorter than n_bins (e.g. in a small roi) is kept at its own resolution: more bins than pixels would
+    # give empty bins, and a division by zero
+    n_bins = min(n_bins, profile.shape[0])
+    edges = np.linspace(0, profile.shape[0], n_bins + 1).astype(int)
+    binned = np.add.reduceat(profile, edges[:-1]) / np.diff(edges)
+    peak = np.max(binned)
+    return binned / peak if peak > 0 else binned
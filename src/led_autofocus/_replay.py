@@ -0,0 +1,191 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from ._simulation import _Parameter
+
+# one row per replayed frame
+REPLAY_DTYPE = np.dtype([
+    ("frame_id", np.int64),
+    ("timestamp", np.int64),
+    ("status", np.int8),
+    ("fit_x", np.float64, (4,)),
+    ("fit_y", np.float64, (4,)),
+    ("z", np.float64),
+    ("roi", np.int64, (4,)),
+])
+
+
+class TiffFrames:
+    """Frames of a multi-page TIFF, read one page at a time (needs tifffile). The file is opened lazily, so the
+    object can be sent to worker processes."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._tiff = None
+
+    def _file(self):
+        if self._tiff is None:
+            try:
+                import tifffile
+            except ImportError:
+                raise ImportError("Reading TIFF stacks needs tifffile: pip install tifffile")
+            self._tiff = tifffile.TiffFile(self.path)
+        return self._tiff
+
+    def __len__(self):
+        return len(self._file().pages)
+
+    def __getitem__(self, index):
+        return self._file().pages[index].asarray()
+
+    def __getstate__(self):
+        return {"path": self.path, "_tiff": None}
+
+
+class RawFrames:
+    """Frames of a memory-mapped stack: a .npy file of shape (n_frames, height, width), or a headerless raw file
+    for which the frame shape must be given.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the stack
+    shape : tuple or None
+        (height, width) of the frames of a raw file, ignored for .npy files
+    dtype : numpy.dtype
+        Data type of a raw file
+    offset : int
+        Bytes to skip at the start of a raw file
+    """
+
+    def __init__(self, path, shape=None, dtype=np.uint8, offset=0):
+        self.path = str(path)
+        self.shape = shape
+        self.dtype = dtype
+        self.offset = offset
+        if Path(self.path).suffix != ".npy" and shape is None:
+            raise ValueError("The frame shape is needed to read a raw stack")
+        self._frames = None
+
+    def _stack(self):
+        if self._frames is None:
+            if Path(self.path).suffix == ".npy":
+                self._frames = np.load(self.path, mmap_mode="r")
+            else:
+                self._frames = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset).reshape(
+                    -1, *self.shape)
+        return self._frames
+
+    def __len__(self):
+        return self._stack().shape[0]
+
+    def __getitem__(self, index):
+        return self._stack()[index]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_frames"] = None
+        return state
+
+
+def open_frames(path, shape=None, dtype=np.uint8):
+    """
+    Open a recorded stack with the reader matching its extension.
+    :param path: .tif/.tiff, .npy, or raw file
+    :param shape: (height, width) of the frames of a raw file
+    :param dtype: data type of a raw file
+    :return: TiffFrames or RawFrames
+    """
+    if Path(path).suffix.lower() in (".tif", ".tiff"):
+        return TiffFrames(path)
+    return RawFrames(path, shape, dtype)
+
+
+def replay(frames, polyfit=None, estimator="caruana", roi_tracking=True, roi_sigmas=4.0, chunk_size=500,
+           warmup_frames=2, max_workers=None):
+    """
+    Process a recorded stack through FrameProcessor, as if the frames came from the camera, and yield the per-frame
+    results in order.
+
+    Frames are split into chunks of consecutive frames processed in parallel by a pool of processes, each chunk by a
+    fresh handler. With roi tracking a handler depends on the previous frames, so each chunk first processes the
+    warmup_frames preceding it, whose results are discarded.
+    :param frames: TiffFrames, RawFrames, or any picklable sequence of Mono8 frames
+    :param polyfit: calibration polynomial [p2, p1, p0] used for z, None for no position
+    :param estimator: estimator used by the handler, see SPOT_ESTIMATORS
+    :param roi_tracking: whether the handler tracks the spot
+    :param roi_sigmas: size of the tracking window
+    :param chunk_size: number of frames per chunk
+    :param warmup_frames: frames processed before each chunk to warm up the handler
+    :param max_workers: number of processes, None for one per cpu, 0 to process in this process
+    :return: generator of REPLAY_DTYPE arrays, one per chunk
+    """
+    options = dict(polyfit=polyfit, estimator=estimator, roi_tracking=roi_tracking, roi_sigmas=roi_sigmas,
+                   warmup_frames=warmup_frames)
+    chunks = [(start, min(start + chunk_size, len(frames))) for start in range(0, len(frames), chunk_size)]
+
+    if max_workers == 0:
+        for start, stop in chunks:
+            yield _replay_chunk(frames, start, stop, options)
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # keep a bounded number of chunks in flight, so results do not pile up in memory
+        in_flight = 2 * max_workers
+        futures = [executor.submit(_replay_chunk, frames, start, stop, options) for start, stop in chunks[:in_flight]]
+        for i in range(len(chunks)):
+            if i + in_flight < len(chunks):
+                futures.append(executor.submit(_replay_chunk, frames, *chunks[i + in_flight], options))
+            yield futures[i].result()
+            futures[i] = None
+
+
+def replay_all(frames, **kwargs):
+    """Replay a whole stack, see replay(). :return: REPLAY_DTYPE array with one row per frame"""
+    results = list(replay(frames, **kwargs))
+    if not results:
+        return np.zeros(0, dtype=REPLAY_DTYPE)
+    return np.concatenate(results)
+
+
+class _ReplayCamera:
+    """The camera attributes FrameProcessor reads at creation."""
+
+    def __init__(self, height, width):
+        self.Height = _Parameter(height)
+        self.Width = _Parameter(width)
+
+
+def _replay_chunk(frames, start, stop, options):
+    # the pylon-free engine, so the worker processes only import NumPy
+    from ._frame_processor import FrameProcessor
+
+    height, width = frames[start].shape
+    handler = FrameProcessor(_ReplayCamera(height, width), fit_profiles=True, estimator=options["estimator"],
+                             roi_tracking=options["roi_tracking"], roi_sigmas=options["roi_sigmas"],
+                             polyfit=options["polyfit"])
+    handler.store_frame = False
+
+    results = np.zeros(stop - start, dtype=REPLAY_DTYPE)
+    results["fit_x"] = results["fit_y"] = results["z"] = np.nan
+    for index in range(max(start - options["warmup_frames"], 0), stop):
+        # frame ids count from 1 like the grab counter of the handler, the timestamp is the frame index
+        handler._process_frame(np.asarray(frames[index]), index, index + 1)
+        if index < start:
+            continue
+        measurement = handler.measurement
+        row = results[index - start]
+        row["frame_id"] = measurement.frame_id
+        row["timestamp"] = measurement.timestamp
+        row["status"] = measurement.status
+        if measurement.fit_x is not None:
+            row["fit_x"] = measurement.fit_x
+        if measurement.fit_y is not None:
+            row["fit_y"] = measurement.fit_y
+        row["z"] = measurement.z
+        row["roi"] = measurement.roi
+    return results
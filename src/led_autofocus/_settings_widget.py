@@ -1,16 +1,25 @@
 from qtpy.QtWidgets import (QApplication, QWidget, QVBoxLayout, QPushButton,
-                            QLabel, QLineEdit, QHBoxLayout, QCheckBox)
+                            QLabel, QLineEdit, QHBoxLayout, QCheckBox, QComboBox)
 import json
 from pathlib import Path
+from ._frame_processor import SPOT_ESTIMATORS
+from ._reference_library import POSITION_ESTIMATORS
+from ._trigger import ACQUISITION_MODES
+
+# settings used when a widget is not given its own config file
+DEFAULT_CONFIG_PATH = Path(__file__).parent / "autofocus_config.json"
+
 
 class SettingsPanel(QWidget):
     """A widget for setting the parameters of the LED autofocus algorithm. Parameters get saved to a .json which is
-    then read by the autofocus widget when during initialisation.
+    watched by the autofocus widget, changes are applied to the running autofocus.
 
     Parameters
     ----------
     current_settings : dict
         A dictionary containing the current settings of the autofocus algorithm. If None, the default settings are used.
+    config_path : str or Path
+        The .json file the settings are read from and saved to. If None, the package default config is used.
 
     Methods
     -------
@@ -18,7 +27,7 @@ class SettingsPanel(QWidget):
         Updates the settings in the .json file with the values in the input fields
     """
 
-    def __init__(self, current_settings=None):
+    def __init__(self, current_settings=None, config_path=None):
         super().__init__()
         # Set window title
         self.setWindowTitle("LED Autofocus Settings")
@@ -28,28 +37,57 @@ class SettingsPanel(QWidget):
 
         # get path to the function
 
-        self.config_path = Path(__file__).parent / "autofocus_config.json"
+        self.config_path = Path(config_path) if config_path is not None else DEFAULT_CONFIG_PATH
         with open(self.config_path, "r") as f:
             current_settings = json.load(f)
+        self.current_settings = current_settings
 
         # Create input values
         self.test_mode = QCheckBox("Test mode?")
         self.test_mode.setToolTip("If checked, example frames are loaded from the 'test-data' folder.")
 
         self.test_mode.setChecked(current_settings["test_mode"])
+        self.camera_serial = InputLine("Camera serial", str(current_settings.get("camera_serial", "")))
+        self.camera_serial.setToolTip("Serial number of the camera, empty for the first camera found.")
+        self.focus_device = InputLine("Focus device", str(current_settings.get("focus_device", "")))
+        self.focus_device.setToolTip("Label of the Z drive the lock moves, empty for the current focus device.")
         self.exposure_time = InputLine("Exposure time (ms)", current_settings["exposure_time_ms"])
         self.gain = InputLine("Gain", current_settings["gain"])
         self.width = InputLine("Width", current_settings["width"])
         self.height = InputLine("Height", current_settings["height"])
         self.offset_x = InputLine("Offset X", current_settings["offset_x"])
         self.offset_y = InputLine("Offset Y", current_settings["offset_y"])
+        self.acquisition_mode = ComboLine("Acquisition mode", ACQUISITION_MODES,
+                                          current_settings.get("acquisition_mode", "free_run"))
+        self.acquisition_mode.setToolTip("'software_trigger' only acquires and fits a frame when the focus lock needs "
+                                         "a measurement, every trigger interval.")
+        self.trigger_interval = InputLine("Trigger interval (s)", current_settings.get("trigger_interval_s", 0.1))
         self.max_movement = InputLine("Max movement (um)", current_settings["max_movement"])
         self.update_interval = InputLine("Update interval (s)", current_settings["update_interval_s"])
+        self.history_window = InputLine("History window (s)", current_settings.get("history_window_s", 60.0))
         self.p2 = InputLine("p2", current_settings["p2"])
         self.p1 = InputLine("p1", current_settings["p1"])
         self.p0 = InputLine("p0", current_settings["p0"])
+        self.calibration_range = InputLine("Calibration range (um)", current_settings.get("calibration_range_um", 5.0))
+        self.calibration_step = InputLine("Calibration step (um)", current_settings.get("calibration_step_um", 0.1))
         self.recall_surface_range = InputLine("Recall surface range (um)", current_settings["recall_surface_range_um"])
         self.recall_surface_step = InputLine("Recall surface step (um)", current_settings["recall_surface_step_um"])
+        self.estimator = ComboLine("Gaussian estimator", SPOT_ESTIMATORS, current_settings.get("estimator", "caruana"))
+        self.estimator.setToolTip("Closed-form estimators fall back to curve_fit only when the estimate is poor. "
+                                  "'moments_2d' uses the widths along the axes of the spot from its 2D moments, "
+                                  "for spots rotated from the sensor axes.")
+        self.spot_axis_angle = InputLine("Spot axis angle (deg)", current_settings.get("spot_axis_angle_deg", 0.0))
+        self.spot_axis_angle.setToolTip("With 'moments_2d', orientation of the astigmatism from the sensor x axis. "
+                                        "Only needs setting for spots rotated by more than 45 degrees.")
+        self.position_estimator = ComboLine("Position estimator", POSITION_ESTIMATORS,
+                                           current_settings.get("position_estimator", "polynomial"))
+        self.position_estimator.setToolTip("'library' interpolates the position between recorded reference "
+                                           "projections, without fitting.")
+        self.tracking_filter = QCheckBox("Tracking filter")
+        self.tracking_filter.setToolTip("Kalman filter over the fitted centres and widths: predicts the next fit, "
+                                        "rejects outliers and smooths the position, at the cost of a slower response "
+                                        "to large focus steps.")
+        self.tracking_filter.setChecked(current_settings.get("tracking_filter", False))
 
         # Title labels
         self.camera_settings_label = QLabel("Camera settings")
@@ -66,18 +104,29 @@ class SettingsPanel(QWidget):
 
         self.layout.addWidget(self.test_mode)
         self.layout.addWidget(self.camera_settings_label)
+        self.layout.addWidget(self.camera_serial)
+        self.layout.addWidget(self.focus_device)
         self.layout.addWidget(self.exposure_time)
         self.layout.addWidget(self.gain)
         self.layout.addWidget(self.width)
         self.layout.addWidget(self.height)
         self.layout.addWidget(self.offset_x)
         self.layout.addWidget(self.offset_y)
+        self.layout.addWidget(self.acquisition_mode)
+        self.layout.addWidget(self.trigger_interval)
         self.layout.addWidget(self.calibration_settings_label)
         self.layout.addWidget(self.calibration_settings_hint)
         self.layout.addWidget(self.p2)
         self.layout.addWidget(self.p1)
         self.layout.addWidget(self.p0)
+        self.layout.addWidget(self.calibration_range)
+        self.layout.addWidget(self.calibration_step)
+        self.layout.addWidget(self.estimator)
+        self.layout.addWidget(self.spot_axis_angle)
+        self.layout.addWidget(self.position_estimator)
+        self.layout.addWidget(self.tracking_filter)
         self.layout.addWidget(self.update_interval)
+        self.layout.addWidget(self.history_window)
         self.layout.addWidget(self.max_movement)
         self.layout.addWidget(self.recall_surface_label)
         self.layout.addWidget(self.recall_surface_range)
@@ -87,22 +136,35 @@ class SettingsPanel(QWidget):
         self.update_settings_button.clicked.connect(self.update_settings)
 
     def update_settings(self):
-        settings = {
+        # start from the current settings, so keys that are not exposed in the panel are preserved
+        settings = dict(self.current_settings)
+        settings.update({
             "test_mode": self.test_mode.isChecked(),
+            "camera_serial": self.camera_serial.input.text().strip(),
+            "focus_device": self.focus_device.input.text().strip(),
             "exposure_time_ms": int(self.exposure_time.get_value()),
             "gain": int(self.gain.get_value()),
             "width": int(self.width.get_value()),
             "height": int(self.height.get_value()),
             "offset_x": int(self.offset_x.get_value()),
             "offset_y": int(self.offset_y.get_value()),
+            "acquisition_mode": self.acquisition_mode.get_value(),
+            "trigger_interval_s": self.trigger_interval.get_value(),
             "p2": self.p2.get_value(),
             "p1": self.p1.get_value(),
             "p0": self.p0.get_value(),
+            "calibration_range_um": self.calibration_range.get_value(),
+            "calibration_step_um": self.calibration_step.get_value(),
             "max_movement": self.max_movement.get_value(),
             "recall_surface_range_um": self.recall_surface_range.get_value(),
             "recall_surface_step_um": self.recall_surface_step.get_value(),
-            "update_interval_s": self.update_interval.get_value()
-        }
+            "update_interval_s": self.update_interval.get_value(),
+            "history_window_s": self.history_window.get_value(),
+            "estimator": self.estimator.get_value(),
+            "spot_axis_angle_deg": self.spot_axis_angle.get_value(),
+            "position_estimator": self.position_estimator.get_value(),
+            "tracking_filter": self.tracking_filter.isChecked()
+        })
 
         with open(self.config_path, "w") as f:
             json.dump(settings, f)
@@ -150,3 +212,41 @@ class InputLine(QWidget):
     def get_value(self):
         return float(self.input.text())
 
+
+class ComboLine(QWidget):
+    """Convenience class for creating a label and drop-down menu in a single widget
+
+    Parameters
+    ----------
+    labelname : str
+        The name of the label
+    options : list
+        The options of the drop-down menu
+    initial_value : str
+        The initially selected option
+
+    Methods
+    -------
+    get_value()
+        Returns the selected option
+    """
+    def __init__(self, labelname="Input", options=(), initial_value=""):
+        super().__init__()
+
+        self.label = QLabel(labelname)
+        self.input = QComboBox()
+        self.input.addItems(list(options))
+        self.input.setCurrentText(initial_value)
+        self.input.setMinimumSize(100, 25)
+        self.input.setMaximumSize(100, 25)
+
+        self.layout = QHBoxLayout()
+        self.setLayout(self.layout)
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.input)
+
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.setContentsMargins(0, 0, 0, 0)
+
+    def get_value(self):
+        return self.input.currentText()
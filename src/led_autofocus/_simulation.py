@@ -0,0 +1,321 @@
+import contextlib
+import threading
+import time
+import traceback
+
+import numpy as np
+
+
+class SimulatedStage:
+    """Stand-in for the part of CMMCorePlus used by the autofocus: a single Z stage with an optional settle time.
+
+    Parameters
+    ----------
+    z : float
+        Initial position in um
+    settle_time_s : float
+        Time each movement takes, movements block for this long like a real drive would
+    """
+
+    def __init__(self, z=0.0, settle_time_s=0.0):
+        self._z = float(z)
+        self.settle_time_s = settle_time_s
+        self.moves = 0
+        self._lock = threading.Lock()
+
+    def getZPosition(self):
+        with self._lock:
+            return self._z
+
+    def setZPosition(self, z):
+        self._move_to(float(z))
+
+    def setRelativeXYZPosition(self, dx, dy, dz):
+        with self._lock:
+            target = self._z + dz
+        self._move_to(target)
+
+    def getPosition(self, label):
+        self._check_device(label)
+        return self.getZPosition()
+
+    def setPosition(self, label, z):
+        self._check_device(label)
+        self.setZPosition(z)
+
+    def setRelativePosition(self, label, dz):
+        self._check_device(label)
+        self.setRelativeXYZPosition(0, 0, dz)
+
+    def getFocusDevice(self):
+        return "SimulatedZ"
+
+    def waitForDevice(self, label):
+        pass
+
+    def waitForSystem(self):
+        pass
+
+    def _check_device(self, label):
+        if label != self.getFocusDevice():
+            raise RuntimeError(f"No device with label \"{label}\"")
+
+    def _move_to(self, z):
+        if self.settle_time_s > 0:
+            time.sleep(self.settle_time_s)
+        with self._lock:
+            self._z = z
+            self.moves += 1
+
+
+class _Parameter:
+    """Minimal GenICam-like parameter, with the Value attribute and the SetValue/GetValue methods."""
+
+    def __init__(self, value):
+        self.Value = value
+
+    def SetValue(self, value):
+        self.Value = value
+
+    def GetValue(self):
+        return self.Value
+
+
+class SimulatedGrabResult:
+    """Stand-in for a pylon grab result. TimeStamp is the host time of the frame in ns."""
+
+    def __init__(self, frame, timestamp, image_number):
+        self._frame = frame
+        self.TimeStamp = timestamp
+        self.ImageNumber = image_number
+
+    def GrabSucceeded(self):
+        return True
+
+    @property
+    def Array(self):
+        return self._frame.copy()
+
+    @contextlib.contextmanager
+    def GetArrayZeroCopy(self):
+        yield self._frame
+
+    def Release(self):
+        pass
+
+
+class SimulatedCamera:
+    """Simulated LED autofocus camera, with the subset of the pylon InstantCamera interface used by the autofocus.
+
+    Frames show an astigmatic Gaussian spot whose width difference (sx - sy) follows the calibration polynomial as a
+    function of the focus position: the position computed from the spot with the same polynomial is
+    (z - focus_z_um + drift) * 1000, in nm, with z the position reported by `z_source`.
+
+    Parameters
+    ----------
+    z_source : callable
+        Returns the current stage position in um, e.g. SimulatedStage.getZPosition or CMMCorePlus.getZPosition
+    polyfit : list
+        Calibration polynomial [p2, p1, p0]
+    width, height : int
+        Sensor size
+    frame_rate : float
+        Frames per second delivered while grabbing in free run
+    focus_z_um : float
+        Stage position of the focus
+    drift_um_per_s : float
+        Drift of the focus position while grabbing, in um/s
+    sigma : float
+        Mean width of the spot in pixels, the x and y widths are sigma +- (sx - sy)/2
+    angle : float
+        Rotation of the axes of the spot from the sensor axes, in degrees. The x width is along the rotated x axis
+    centre : tuple
+        (x, y) position of the spot in pixels
+    background, amplitude : float
+        Background level and peak height of the spot, in counts. With the default geometry, the spot fits within the
+        default (hardcoded) fit bounds of ImageHandler
+    noise : float
+        Standard deviation of the additive Gaussian noise, in counts
+    seed : int
+        Seed of the noise generator
+    """
+
+    def __init__(self, z_source, polyfit=(-0.069, -23.2, 44.15), width=3860, height=2178, frame_rate=50.0,
+                 focus_z_um=0.0, drift_um_per_s=0.0, sigma=230.0, centre=(1880.0, 1130.0), background=15.0,
+                 amplitude=150.0, noise=3.0, seed=0, angle=0.0):
+        self.z_source = z_source
+        self.polyfit = list(polyfit)
+        self.frame_rate = frame_rate
+        self.focus_z_um = focus_z_um
+        self.drift_um_per_s = drift_um_per_s
+        self.sigma = sigma
+        self.angle = angle
+        self.centre = centre
+        self.background = background
+        self.amplitude = amplitude
+        self.noise = noise
+
+        # camera parameters, as used by the widget
+        self.Width = _Parameter(width)
+        self.Height = _Parameter(height)
+        self.OffsetX = _Parameter(0)
+        self.OffsetY = _Parameter(0)
+        self.PixelFormat = _Parameter("Mono8")
+        self.Gain = _Parameter(0)
+        self.ExposureTime = _Parameter(1e6 / frame_rate)
+        # with TriggerMode "On", a frame is only delivered for each ExecuteSoftwareTrigger, as soon as it is rendered
+        self.TriggerSelector = _Parameter("FrameStart")
+        self.TriggerMode = _Parameter("Off")
+        self.TriggerSource = _Parameter("Software")
+
+        self._rng = np.random.default_rng(seed)
+        self._noise_bank = None
+        self._handler = None
+        self._open = False
+        self._grabbing = threading.Event()
+        self._trigger = threading.Event()
+        self._thread = None
+        self._frames = 0
+        self._start_time = 0.0
+
+    # --- pylon-like interface ---
+
+    def Open(self):
+        self._open = True
+
+    def Close(self):
+        self.StopGrabbing()
+        self._open = False
+
+    def IsOpen(self):
+        return self._open
+
+    def RegisterImageEventHandler(self, handler, registration_mode=None, cleanup=None):
+        if self._handler is not None and hasattr(self._handler, "OnImageEventHandlerDeregistered"):
+            self._handler.OnImageEventHandlerDeregistered(self)
+        self._handler = handler
+        if hasattr(handler, "OnImageEventHandlerRegistered"):
+            handler.OnImageEventHandlerRegistered(self)
+
+    def StartGrabbing(self, *args):
+        if self.IsGrabbing():
+            return
+        self._trigger.clear()
+        self._grabbing.set()
+        self._start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._grab_loop, name="simulated-camera", daemon=True)
+        self._thread.start()
+
+    def StopGrabbing(self):
+        self._grabbing.clear()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def IsGrabbing(self):
+        return self._grabbing.is_set()
+
+    def WaitForFrameTriggerReady(self, timeout_ms, timeout_handling=None):
+        return self.IsGrabbing()
+
+    def ExecuteSoftwareTrigger(self):
+        self._trigger.set()
+
+    # --- simulation ---
+
+    def width_difference(self, z_nm):
+        """
+        Width difference sx - sy for which the calibration polynomial gives the position z_nm. Of the two solutions,
+        the one closest to zero is used. Beyond the vertex of the polynomial the vertex is used.
+        :param z_nm: focus position in nm
+        :return: sx - sy in pixels
+        """
+        p2, p1, p0 = self.polyfit
+        # -(p2*d^2 + p1*d + p0) = z
+        if p2 == 0:
+            return -(p0 + z_nm) / p1
+        discriminant = p1 ** 2 - 4 * p2 * (p0 + z_nm)
+        if discriminant < 0:
+            return -p1 / (2 * p2)
+        roots = (-p1 + np.array([-1, 1]) * np.sqrt(discriminant)) / (2 * p2)
+        return roots[np.argmin(np.abs(roots))]
+
+    def focus_position(self, elapsed_s=0.0):
+        """Focus position in nm, as seen by the camera, at the current stage position."""
+        return (self.z_source() - self.focus_z_um + self.drift_um_per_s * elapsed_s) * 1000
+
+    def render(self, z_nm):
+        """
+        Render a Mono8 frame of the spot at a focus position.
+        :param z_nm: focus position in nm
+        :return: frame of shape (Height, Width)
+        """
+        width, height = self.Width.Value, self.Height.Value
+        centre_x, centre_y = self.centre
+        difference = self.width_difference(z_nm)
+        sx = max(self.sigma + difference / 2, 1.0)
+        sy = max(self.sigma - difference / 2, 1.0)
+
+        # same coordinates as the ImageHandler fits
+        x = np.linspace(0, width, width, dtype=np.float32)
+        y = np.linspace(0, height, height, dtype=np.float32)
+        if self.angle == 0:
+            gx = np.exp(-(x - centre_x) ** 2 / (2 * sx ** 2))
+            gy = np.exp(-(y - centre_y) ** 2 / (2 * sy ** 2))
+            frame = np.outer(gy * self.amplitude, gx)
+        else:
+            # the rotated spot is not separable, evaluate its quadratic form on the whole frame
+            cos, sin = np.cos(np.radians(self.angle)), np.sin(np.radians(self.angle))
+            a = cos ** 2 / (2 * sx ** 2) + sin ** 2 / (2 * sy ** 2)
+            b = cos * sin * (1 / (2 * sx ** 2) - 1 / (2 * sy ** 2))
+            c = sin ** 2 / (2 * sx ** 2) + cos ** 2 / (2 * sy ** 2)
+            dx = x - centre_x
+            dy = (y - centre_y)[:, None]
+            frame = a * dx ** 2 + 2 * b * dx * dy + c * dy ** 2
+            np.exp(-frame, out=frame)
+            frame *= self.amplitude
+        frame += self.background
+        if self.noise > 0:
+            frame += self._next_noise()
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+    def grab_one(self):
+        """Render a frame at the current stage position and wrap it in a grab result."""
+        self._frames += 1
+        frame = self.render(self.focus_position(time.monotonic() - self._start_time))
+        return SimulatedGrabResult(frame, time.perf_counter_ns(), self._frames)
+
+    def _next_noise(self):
+        # generating full-frame noise is slower than rendering the spot, so cycle through a small bank of noise frames
+        shape = (self.Height.Value, self.Width.Value)
+        if self._noise_bank is None or self._noise_bank[0].shape != shape:
+            self._noise_bank = [self._rng.normal(0, self.noise, shape).astype(np.float32) for _ in range(4)]
+        return self._noise_bank[self._rng.integers(len(self._noise_bank))]
+
+    def _grab_loop(self):
+        period = 1.0 / self.frame_rate
+        next_frame = time.monotonic()
+        while self._grabbing.is_set():
+            if self.TriggerMode.Value == "On":
+                # wait for a trigger, checking now and then whether grabbing was stopped
+                if self._trigger.wait(0.05):
+                    self._trigger.clear()
+                    self._deliver()
+                next_frame = time.monotonic()
+                continue
+            next_frame += period
+            self._deliver()
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # can't keep up with the frame rate, like a camera limited by the readout
+                next_frame = time.monotonic()
+
+    def _deliver(self):
+        try:
+            grab_result = self.grab_one()
+            if self._handler is not None:
+                self._handler.OnImageGrabbed(self, grab_result)
+        except Exception:
+            traceback.print_exc()
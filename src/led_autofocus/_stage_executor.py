@@ -0,0 +1,156 @@
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from ._instrumentation import LatencyHistogram
+
+
+class StageExecutor:
+    """Worker thread sending relative z movements to the stage, so callers never wait for the drive.
+
+    Movements submitted while the stage is busy are added up into a single net movement, sent once the current one
+    completes. After each movement the executor waits for the device and an optional settle time, and remembers when
+    the stage was last still, so frames exposed while it was moving can be told apart (see is_still_since).
+
+    Parameters
+    ----------
+    move_relative : callable
+        Called as move_relative(dz_um) from the worker thread, e.g. lambda dz: mmc.setRelativePosition(device, dz)
+    wait_for_device : callable or None
+        Called after each movement, blocks until the stage reports it is done
+    read_position : callable or None
+        Returns the stage position in um, read back after each movement
+    settle_time_s : float
+        Extra time the stage is considered moving after the device reports it is done
+    instrumentation : Instrumentation or None
+        If set and enabled, the duration of every command is recorded as the stage_move stage
+
+    Attributes
+    ----------
+    position_um : float
+        Stage position read back after the last movement, NaN if unknown
+    moves : int
+        Number of movements sent to the stage
+    coalesced : int
+        Number of submitted movements merged into another one
+    failures : int
+        Number of movements that raised an exception
+    last_error : Exception or None
+        Exception raised by the last failed movement
+    latency : LatencyHistogram
+        Time from the (first) submission of a movement to the stage being settled
+    """
+
+    def __init__(self, move_relative, wait_for_device=None, read_position=None, settle_time_s=0.0,
+                 instrumentation=None):
+        self.move_relative = move_relative
+        self.wait_for_device = wait_for_device
+        self.read_position = read_position
+        self.settle_time_s = settle_time_s
+        self.instrumentation = instrumentation
+
+        self.position_um = np.nan
+        self.moves = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.last_error = None
+        self.latency = LatencyHistogram()
+
+        self._pending = 0.0
+        self._pending_since_ns = None
+        self._busy = False
+        self._still_since_ns = time.perf_counter_ns()
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    @property
+    def busy(self):
+        """True while a movement is pending, running or settling."""
+        with self._condition:
+            return self._busy or self._pending_since_ns is not None
+
+    def is_still_since(self, t_ns):
+        """
+        Whether the stage has been still since t_ns (a time.perf_counter_ns() value), e.g. the start of the exposure of
+        a frame. False while a movement is pending, as any frame taken before it completes is outdated.
+        """
+        with self._condition:
+            if self._busy or self._pending_since_ns is not None:
+                return False
+            return t_ns >= self._still_since_ns
+
+    def submit(self, movement_um):
+        """Queue a relative movement, merged with the pending one if there is one. Never blocks on the stage."""
+        with self._condition:
+            if self._pending_since_ns is None:
+                self._pending_since_ns = time.perf_counter_ns()
+            else:
+                self.coalesced += 1
+            self._pending += movement_um
+            self._condition.notify()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="led-autofocus-stage", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the worker once the current movement is done. Pending movements are discarded."""
+        with self._condition:
+            self._stop = True
+            self._pending = 0.0
+            self._pending_since_ns = None
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wait_until_still(self, timeout=None):
+        """Wait for the pending and running movements to complete. :return: False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._busy and self._pending_since_ns is None, timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending_since_ns is not None or self._stop)
+                if self._stop:
+                    return
+                movement, submitted_ns = self._pending, self._pending_since_ns
+                self._pending, self._pending_since_ns = 0.0, None
+                self._busy = True
+            try:
+                self._move(movement, submitted_ns)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._still_since_ns = time.perf_counter_ns()
+                    self._condition.notify_all()
+
+    def _move(self, movement, submitted_ns):
+        start_ns = time.perf_counter_ns()
+        try:
+            if movement != 0:
+                self.move_relative(movement)
+                self.moves += 1
+            if self.wait_for_device is not None:
+                self.wait_for_device()
+            if self.settle_time_s > 0:
+                time.sleep(self.settle_time_s)
+            if self.read_position is not None:
+                self.position_um = self.read_position()
+        except Exception as e:
+            # reported, not hidden: counted, kept for the caller and printed like other background thread errors
+            self.failures += 1
+            self.last_error = e
+            traceback.print_exc()
+            return
+        end_ns = time.perf_counter_ns()
+        self.latency.add(end_ns - submitted_ns)
+        if self.instrumentation is not None and self.instrumentation.enabled:
+            self.instrumentation.record("stage_move", start_ns, end_ns)
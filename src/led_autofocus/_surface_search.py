@@ -0,0 +1,103 @@
+import numpy as np
+
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+
+class SearchStopped(Exception):
+    """Raised internally to stop the search as soon as a position is within tolerance."""
+
+
+def coarse_to_fine_search(measure, centre, half_range, step, coarse_points=9, tolerance=None):
+    """
+    Find the position minimising measure(z) within centre +- half_range, with a coarse scan followed by a
+    golden-section search in the bracket around the best coarse position, until the bracket is smaller than step.
+    Every position is measured at most once.
+    :param measure: callable, measure(z) returns the value to minimise at position z (e.g. after moving the stage)
+    :param centre: centre of the search range
+    :param half_range: half width of the search range
+    :param step: final resolution of the search
+    :param coarse_points: number of positions in the coarse scan
+    :param tolerance: if set, the search stops as soon as a value below tolerance is measured
+    :return: (best position, best value, dict of all the measured positions and values)
+    """
+    evaluations = {}
+
+    def evaluate(z):
+        z = float(z)
+        if z not in evaluations:
+            evaluations[z] = measure(z)
+            if tolerance is not None and evaluations[z] < tolerance:
+                raise SearchStopped()
+        return evaluations[z]
+
+    try:
+        coarse = np.linspace(centre - half_range, centre + half_range, max(int(coarse_points), 3))
+        # scan from the centre outwards, the surface is most likely close to where the search starts
+        for z in coarse[np.argsort(np.abs(coarse - centre), kind="stable")]:
+            evaluate(z)
+
+        values = [evaluations[float(z)] for z in coarse]
+        best = int(np.argmin(values))
+        lo = coarse[max(best - 1, 0)]
+        hi = coarse[min(best + 1, coarse.shape[0] - 1)]
+        golden_section_search(evaluate, lo, hi, step)
+    except SearchStopped:
+        pass
+
+    best_z = min(evaluations, key=evaluations.get)
+    return best_z, evaluations[best_z], evaluations
+
+
+def profile_distance(processor, move, target_x, target_y, discard_frames=1, frame_timeout_s=1.0):
+    """
+    Measure for coarse_to_fine_search scoring a position by the distance of its projections to target projections,
+    e.g. those of the locked frame. Each position is scored on a single frame acquired after the stage got there.
+    :param processor: FrameProcessor of the grabbing camera, computing the projections in the roi of the targets
+    :param move: callable, move(z) moves the stage to z and returns once it got there
+    :param target_x: target x projection
+    :param target_y: target y projection
+    :param discard_frames: frames skipped after each move, as they may have been exposed while moving
+    :param frame_timeout_s: maximum time to wait for a frame
+    :return: callable, measure(z) returns the mean squared difference of both projections to the targets, all
+    normalised by the maximum of the targets
+    """
+    normalisation_x = np.max(target_x)
+    normalisation_y = np.max(target_y)
+    target_x = target_x / normalisation_x
+    target_y = target_y / normalisation_y
+
+    def measure(z):
+        move(z)
+        # wait for a frame acquired after the stage settled
+        frame = processor.wait_for_frame(processor.frames_grabbed + discard_frames, timeout=frame_timeout_s)
+        if frame is None:
+            raise RuntimeError(f"No frame received within {frame_timeout_s} s of moving to {z}.")
+        _, x_projection, y_projection = frame
+
+        difference_x = target_x - x_projection / normalisation_x
+        difference_y = target_y - y_projection / normalisation_y
+        return np.mean(np.power(difference_x, 2)) + np.mean(np.power(difference_y, 2))
+
+    return measure
+
+
+def golden_section_search(evaluate, lo, hi, step):
+    """
+    Golden-section search for the minimum of a unimodal function on [lo, hi], until the bracket is smaller than step.
+    :param evaluate: callable, evaluate(z) returns the value at z
+    :param lo: lower end of the bracket
+    :param hi: upper end of the bracket
+    :param step: resolution at which the search stops
+    :return: position of the smallest value found
+    """
+    a, b = lo, hi
+    c = b - GOLDEN_RATIO * (b - a)
+    d = a + GOLDEN_RATIO * (b - a)
+    while b - a > step:
+        if evaluate(c) < evaluate(d):
+            b, d = d, c
+            c = b - GOLDEN_RATIO * (b - a)
+        else:
+            a, c = c, d
+            d = a + GOLDEN_RATIO * (b - a)
+    return (a + b) / 2
@@ -0,0 +1,171 @@
+import itertools
+import os
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+# one record per processed frame. frame_id starts at 1, so records with frame_id 0 were never written
+TELEMETRY_DTYPE = np.dtype([
+    ("frame_id", np.int64),
+    ("timestamp", np.int64),       # camera TimeStamp of the frame
+    ("host_time", np.float64),     # time.time() when the record was written
+    ("status", np.int8),           # FocusMeasurement status
+    ("settled", np.bool_),         # False if the stage moved during the exposure
+    ("fit_x", np.float64, (4,)),   # [i0, x0, sx, amp], NaN when not fitted
+    ("fit_y", np.float64, (4,)),
+    ("z", np.float64),             # measured position, nm
+    ("movement_um", np.float64),   # movement sent to the stage for this frame, NaN for none
+    ("stage_z_um", np.float64),    # stage position read back after the last movement, NaN if unknown
+])
+
+_NO_FIT = np.full(4, np.nan)
+# numbers the writers of this process, so writers started in the same second never share a session
+_session_counter = itertools.count()
+
+
+class TelemetryWriter:
+    """Append-only per-frame log, written to preallocated memory-mapped .npy files.
+
+    Each file holds records_per_file records. Once a file is half full the next one is created on a helper thread, so
+    a record is only ever a copy into memory-mapped pages and never waits for the disk. If the next file is not
+    ready when the current one is full, records are dropped (and counted) rather than blocking the caller.
+
+    Files are named <prefix>-<session>-<index>.npy, with session the start time of the writer followed by the process id
+    and a counter, so that writers started in the same second (e.g. several instances writing to the same directory)
+    never overwrite each other's files.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory the files are written to, created if needed
+    records_per_file : int
+        Number of records per file, at least 2
+    prefix : str
+        Prefix of the file names
+
+    Attributes
+    ----------
+    records_written : int
+        Number of records written
+    records_dropped : int
+        Number of records dropped while waiting for the next file
+    """
+
+    def __init__(self, directory, records_per_file=2 ** 20, prefix="telemetry"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if int(records_per_file) < 2:
+            raise ValueError("records_per_file must be at least 2")
+        self.records_per_file = int(records_per_file)
+        self.prefix = prefix
+        self.session = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_session_counter):04d}"
+
+        self.records_written = 0
+        self.records_dropped = 0
+
+        self._file_index = 0
+        self._records = self._create_file(0)
+        self._position = 0
+        self._next_records = None
+        self._preparing = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Path of the file currently written."""
+        return self._file_path(self._file_index)
+
+    def record(self, measurement, movement_um=np.nan, stage_z_um=np.nan):
+        """
+        Append the record of a frame.
+        :param measurement: FocusMeasurement of the frame
+        :param movement_um: movement sent to the stage for this frame, in um
+        :param stage_z_um: stage position read back, in um
+        """
+        with self._lock:
+            if self._records is None:
+                return
+            if self._position == self.records_per_file and not self._roll_over():
+                self.records_dropped += 1
+                return
+            self._records[self._position] = (
+                measurement.frame_id, measurement.timestamp, time.time(), measurement.status, measurement.settled,
+                _NO_FIT if measurement.fit_x is None else measurement.fit_x,
+                _NO_FIT if measurement.fit_y is None else measurement.fit_y,
+                measurement.z, movement_um, stage_z_um)
+            self._position += 1
+            self.records_written += 1
+
+            if self._position == self.records_per_file // 2 and self._preparing is None:
+                self._preparing = threading.Thread(target=self._prepare_next_file, name="led-autofocus-telemetry",
+                                                   daemon=True)
+                self._preparing.start()
+
+    def close(self):
+        """Flush the current file and stop writing. An unused prepared file is removed."""
+        with self._lock:
+            if self._records is None:
+                return
+            self._records.flush()
+            self._records = None
+            preparing = self._preparing
+        if preparing is not None:
+            preparing.join()
+            next_path = self._file_path(self._file_index + 1)
+            self._next_records = None
+            next_path.unlink(missing_ok=True)
+
+    def _roll_over(self):
+        if self._next_records is None:
+            return False
+        previous = self._records
+        self._records, self._next_records = self._next_records, None
+        self._file_index += 1
+        self._position = 0
+        self._preparing = None
+        # writing the pages of the full file back can take a while, keep it off the caller thread
+        threading.Thread(target=previous.flush, name="led-autofocus-telemetry", daemon=True).start()
+        return True
+
+    def _prepare_next_file(self):
+        try:
+            records = self._create_file(self._file_index + 1)
+            with self._lock:
+                self._next_records = records
+        except Exception:
+            traceback.print_exc()
+
+    def _create_file(self, index):
+        return np.lib.format.open_memmap(self._file_path(index), mode="w+", dtype=TELEMETRY_DTYPE,
+                                         shape=(self.records_per_file,))
+
+    def _file_path(self, index):
+        return self.directory / f"{self.prefix}-{self.session}-{index:04d}.npy"
+
+
+def read_telemetry(directory, session=None, prefix="telemetry"):
+    """
+    Load the records of a session.
+    :param directory: directory the telemetry was written to
+    :param session: session to load (the part of the file names after the prefix), None for the most recent
+    :param prefix: prefix of the file names
+    :return: structured array with TELEMETRY_DTYPE fields, e.g. records["z"], in the order they were written
+    """
+    paths = sorted(Path(directory).glob(f"{prefix}-*.npy"))
+    if session is None:
+        if not paths:
+            return np.zeros(0, dtype=TELEMETRY_DTYPE)
+        # names end with -<session>-<index>.npy and the session is a sortable timestamp
+        session = paths[-1].stem[len(prefix) + 1:].rsplit("-", 1)[0]
+    paths = [path for path in paths if path.stem[len(prefix) + 1:].rsplit("-", 1)[0] == session]
+
+    chunks = []
+    for path in paths:
+        records = np.load(path, mmap_mode="r")
+        chunks.append(np.array(records[records["frame_id"] > 0]))
+    if not chunks:
+        return np.zeros(0, dtype=TELEMETRY_DTYPE)
+    return np.concatenate(chunks)
@@ -0,0 +1,154 @@
+import numpy as np
+
+# chi-squared with 4 degrees of freedom exceeded with a probability of 0.001
+DEFAULT_GATE = 18.47
+
+
+class FitTracker:
+    """Kalman filter over the spot parameters (x0, sx, y0, sy) of consecutive frames.
+
+    Each parameter follows an independent constant-velocity model, with time counted in frames (frame ids), so
+    dropped frames widen the prediction. Before a frame is fitted, the filter predicts its parameters, used as the
+    initial guesses and to set bounds tighter than the generic ones. After the fit, the innovation of the four
+    parameters is gated: fits further than the gate (a chi-squared value) from the prediction are rejected as outliers
+    and leave the filter unchanged. After max_misses consecutive rejected or failed fits the spot is considered lost,
+    and the filter starts again from the next fit.
+
+    Parameters
+    ----------
+    process_noise_px : float
+        Standard deviation of the random change of velocity of each parameter, in pixels per frame
+    measurement_noise_px : float
+        Standard deviation of the fitted parameters, in pixels
+    gate : float
+        Largest accepted normalised squared innovation, summed over the four parameters
+    bound_sigmas : float
+        Half-width of the fit bounds, in standard deviations of the predicted innovation
+    max_misses : int
+        Number of consecutive rejected or failed fits after which the filter is reset
+
+    Attributes
+    ----------
+    accepted : int
+        Number of fits accepted
+    rejected : int
+        Number of fits rejected as outliers
+    resets : int
+        Number of times the filter was reset after losing the spot
+    """
+
+    def __init__(self, process_noise_px=1.0, measurement_noise_px=0.5, gate=DEFAULT_GATE, bound_sigmas=6.0,
+                 max_misses=3):
+        self.process_noise = process_noise_px ** 2
+        self.measurement_noise = measurement_noise_px ** 2
+        self.gate = gate
+        self.bound_sigmas = bound_sigmas
+        self.max_misses = max_misses
+
+        self.accepted = 0
+        self.rejected = 0
+        self.resets = 0
+        self.reset()
+
+    @property
+    def initialised(self):
+        return self._frame_id is not None
+
+    def reset(self):
+        """Forget the state, the next accepted fit starts the filter again."""
+        self._frame_id = None
+        self._misses = 0
+        # state and covariance of the four filters, [x0, sx, y0, sy]
+        self._position = np.zeros(4)
+        self._velocity = np.zeros(4)
+        self._p00 = np.zeros(4)
+        self._p01 = np.zeros(4)
+        self._p11 = np.zeros(4)
+        # offsets and amplitudes of the last accepted fits, not filtered
+        self._fit_x = None
+        self._fit_y = None
+
+    def predict(self, frame_id):
+        """
+        Predict the parameters of a frame, and the fit guesses and bounds that follow.
+        :param frame_id: id of the frame about to be fitted
+        :return: (guess_x, bounds_x, guess_y, bounds_y), or None if the filter is not initialised
+        """
+        if self._frame_id is None:
+            return None
+        dt = max(frame_id - self._frame_id, 0)
+        self._frame_id = frame_id
+        q = self.process_noise
+        self._position += self._velocity * dt
+        self._p00 += dt * 2 * self._p01 + dt ** 2 * self._p11 + q * dt ** 3 / 3
+        self._p01 += dt * self._p11 + q * dt ** 2 / 2
+        self._p11 += q * dt
+
+        half_width = self.bound_sigmas * np.sqrt(self._p00 + self.measurement_noise)
+        x0, sx, y0, sy = self._position
+        guess_x = [self._fit_x[0], x0, sx, self._fit_x[3]]
+        guess_y = [self._fit_y[0], y0, sy, self._fit_y[3]]
+        return (guess_x, _bounds(x0, sx, half_width[0], half_width[1]),
+                guess_y, _bounds(y0, sy, half_width[2], half_width[3]))
+
+    def update(self, frame_id, fit_x, fit_y):
+        """
+        Correct the prediction with the fits of the frame.
+        :param frame_id: id of the frame, as passed to predict
+        :param fit_x: fit of the x projection, [i0, x0, sx, amp], None if the fit failed
+        :param fit_y: fit of the y projection, [i0, y0, sy, amp], None if the fit failed
+        :return: filtered fits (fit_x, fit_y) with the filtered centres and widths, or None if the fits were rejected
+        or failed
+        """
+        if fit_x is None or fit_y is None:
+            self._miss()
+            return None
+        measured = np.array([fit_x[1], abs(fit_x[2]), fit_y[1], abs(fit_y[2])])
+
+        if self._frame_id is None:
+            # first fit, or after losing the spot: start from it, with an unknown velocity
+            self._frame_id = frame_id
+            self._position = measured
+            self._velocity = np.zeros(4)
+            self._p00 = np.full(4, self.measurement_noise)
+            self._p01 = np.zeros(4)
+            self._p11 = np.full(4, self.process_noise)
+        else:
+            innovation = measured - self._position
+            variance = self._p00 + self.measurement_noise
+            if np.sum(innovation ** 2 / variance) > self.gate:
+                self.rejected += 1
+                self._miss()
+                return None
+            gain_position = self._p00 / variance
+            gain_velocity = self._p01 / variance
+            self._position = self._position + gain_position * innovation
+            self._velocity = self._velocity + gain_velocity * innovation
+            p01 = self._p01
+            self._p11 = self._p11 - gain_velocity * p01
+            self._p01 = (1 - gain_position) * p01
+            self._p00 = (1 - gain_position) * self._p00
+
+        self._misses = 0
+        self.accepted += 1
+        self._fit_x, self._fit_y = fit_x, fit_y
+        x0, sx, y0, sy = self._position
+        return [fit_x[0], x0, sx, fit_x[3]], [fit_y[0], y0, sy, fit_y[3]]
+
+    def shift(self, dx, dy):
+        """Move the tracked centres into the coordinates of a frame whose origin moved by (dx, dy) pixels."""
+        self._position[0] -= dx
+        self._position[2] -= dy
+
+    def _miss(self):
+        self._misses += 1
+        if self._frame_id is not None and self._misses >= self.max_misses:
+            self.resets += 1
+            self.reset()
+
+
+def _bounds(centre, sigma, centre_half_width, sigma_half_width):
+    # never looser than bounds_from_guess: the width can at most halve or double
+    sigma = abs(sigma)
+    return ([0, centre - centre_half_width, max(sigma - sigma_half_width, sigma / 2), 0],
+            [1, centre + centre_half_width, min(sigma + sigma_half_width, 2 * sigma), 1.5])
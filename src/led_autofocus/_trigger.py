@@ -0,0 +1,94 @@
+import threading
+import time
+import traceback
+
+# how frames are acquired: the camera running at its own frame rate, or triggered by SoftwareTrigger
+ACQUISITION_MODES = ("free_run", "software_trigger")
+
+
+class SoftwareTrigger:
+    """Worker thread requesting frames from a camera in software trigger mode, one at a time, when the control loop
+    needs a measurement.
+
+    A frame is triggered once the previous one has been processed, the stage is still and at least interval_s after
+    the previous trigger. The exposure, the transfer and the fits then run at the control rate, rather than at the
+    maximum frame rate of the camera with most results never used.
+
+    Parameters
+    ----------
+    execute : callable
+        Triggers one frame, e.g. camera.ExecuteSoftwareTrigger
+    interval_s : float
+        Shortest time between two triggers, the cadence of the control loop
+    stage : StageExecutor or None
+        If set, frames are only triggered once it is still, so every frame is exposed after the stage settled
+    active : callable or None
+        Returns whether frames can be triggered, e.g. camera.IsGrabbing. Triggers are paused while it returns False
+    timeout_s : float
+        A frame not processed within this time of its trigger is counted as lost, and the next one triggered
+
+    Attributes
+    ----------
+    triggers : int
+        Number of frames triggered
+    lost : int
+        Number of triggered frames not processed within timeout_s
+    """
+
+    def __init__(self, execute, interval_s, stage=None, active=None, timeout_s=1.0):
+        self.execute = execute
+        self.interval_s = interval_s
+        self.stage = stage
+        self.active = active
+        self.timeout_s = timeout_s
+
+        self.triggers = 0
+        self.lost = 0
+
+        self._processed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def frame_processed(self, measurement=None):
+        """Measurement listener, to register with the handler after the controller so a correction it makes is
+        submitted to the stage before the next frame is triggered."""
+        self._processed.set()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="led-autofocus-trigger", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        # wake up a wait for a frame
+        self._processed.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        last_trigger = -float("inf")
+        while not self._stop.is_set():
+            if self.active is not None and not self.active():
+                self._stop.wait(self.interval_s)
+                continue
+            delay = last_trigger + self.interval_s - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            if self.stage is not None:
+                self.stage.wait_until_still(self.timeout_s)
+
+            self._processed.clear()
+            last_trigger = time.monotonic()
+            try:
+                self.execute()
+                self.triggers += 1
+            except Exception:
+                # e.g. grabbing stopped between the check and the trigger, reported like other worker errors
+                traceback.print_exc()
+                continue
+            if not self._processed.wait(self.timeout_s):
+                self.lost += 1
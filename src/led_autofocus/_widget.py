@@ -1,25 +1,59 @@
 import time
 
-from qtpy.QtWidgets import (QWidget, QPushButton, QHBoxLayout, QGridLayout, QSizePolicy)
+from qtpy.QtWidgets import (QWidget, QPushButton, QHBoxLayout, QGridLayout, QSizePolicy, QLabel)
 import pyqtgraph as pg
 from pypylon import pylon
 from pyqtgraph.Qt import QtCore
 import numpy as np
-import json
 from qtpy.QtCore import Qt
 from pymmcore_plus import CMMCorePlus
 from .ImageHandler import ImageHandler
 from pathlib import Path
-from ._settings_widget import SettingsPanel
+from ._settings_widget import SettingsPanel, DEFAULT_CONFIG_PATH
+from ._position import calculate_position
+from ._controller import FocusLockController
+from ._simulation import SimulatedCamera
+from ._surface_search import coarse_to_fine_search, profile_distance
+from ._reference_library import MAX_DISTANCE_FACTOR, ReferenceLibrary, acquire_reference_library
+from ._calibration import run_calibration, write_calibration
+from ._history import RingBuffer
+from ._telemetry import TelemetryWriter
+from ._instrumentation import Instrumentation
+from ._stage_executor import StageExecutor
+from ._pipeline import shared_fitting_pool
+from ._config_watcher import ConfigWatcher
+from ._trigger import SoftwareTrigger
+from ._tracking import FitTracker
 import logging
 import os
 
+# settings applied by re-sizing the handler buffers, with the camera stopped for a moment
+GEOMETRY_SETTINGS = {"width", "height", "offset_x", "offset_y"}
+# settings that only take effect when the plugin is initialised again
+RESTART_SETTINGS = {"test_mode", "simulated", "camera_serial", "pipeline", "fitting_pool_workers", "telemetry_enabled",
+                    "telemetry_directory", "telemetry_records_per_file", "config_poll_interval_s",
+                    "acquisition_mode", "focus_device"}
+
 
 class AutofocusWidget(QWidget):
-    def __init__(self, mmc: CMMCorePlus = CMMCorePlus.instance()):
+    """LED autofocus widget, driving one camera.
+
+    Several widgets can run in the same process, each with its own config file (selecting its camera by serial
+    number with camera_serial) and sharing a pool of fitting threads.
+
+    Parameters
+    ----------
+    mmc : CMMCorePlus or None
+        Core of the microscope, CMMCorePlus.instance() if None
+    config_path : str or Path or None
+        Config file of this autofocus, the package default config if None
+    """
+
+    def __init__(self, mmc: CMMCorePlus = None, config_path=None):
         super().__init__()
         # PYMMCORE
-        self.mmc = mmc
+        self.mmc = mmc if mmc is not None else CMMCorePlus.instance()
+        self.config_path = Path(config_path) if config_path is not None else DEFAULT_CONFIG_PATH
 
         # WINDOW SETTINGS
         self.setMaximumHeight(550)
@@ -39,13 +73,21 @@ class AutofocusWidget(QWidget):
         self.recall_focus_button = QPushButton("Recall Focus")
         self.recall_focus_button.setCheckable(True)
         self.show_camera_feed_button = QPushButton("Show camera feed")
+        self.show_latency_button = QPushButton("Show latency")
         self.close_camera = QPushButton("Close camera")
         self.recall_surface_btn = QPushButton("Recall Surface")
+        self.record_references_button = QPushButton("Record references")
+        self.calibrate_button = QPushButton("Calibrate")
 
         # Lock and monitor buttons need to be checkable
         self.lock_button.setCheckable(True)
         self.monitor_button.setCheckable(True)
         self.show_camera_feed_button.setCheckable(True)
+        self.show_latency_button.setCheckable(True)
+
+        # latency histograms of the autofocus loop, shown when instrumentation is on
+        self.latency_label = QLabel()
+        self.latency_label.setStyleSheet("font-family: monospace;")
 
         # Plot widget for focus position
         self.plot_canvas = pg.PlotWidget(background=None)
@@ -70,6 +112,8 @@ class AutofocusWidget(QWidget):
         button_group.addWidget(self.camera_settings_button)
         button_group.addWidget(self.initialise_button)
         button_group.addWidget(self.close_camera)
+        button_group.addWidget(self.record_references_button)
+        button_group.addWidget(self.calibrate_button)
         self.layout.addLayout(button_group, 0, 0, 1, 2)
 
         self.button_group = QHBoxLayout()
@@ -77,7 +121,8 @@ class AutofocusWidget(QWidget):
         self.button_group.addWidget(self.lock_button)
         self.button_group.addWidget(self.recall_focus_button)
         self.button_group.addWidget(self.recall_surface_btn)
-        self.layout.addWidget(self.show_camera_feed_button, 6, 0, 1, 2)
+        self.layout.addWidget(self.show_camera_feed_button, 6, 0, 1, 1)
+        self.layout.addWidget(self.show_latency_button, 6, 1, 1, 1)
         self.layout.addLayout(self.button_group, 1, 0, 1, 2)
         self.layout.addWidget(self.plot_canvas, 2, 0, 4, 2)
 
@@ -86,26 +131,37 @@ class AutofocusWidget(QWidget):
         self.grid_layout.addWidget(self.x_canvas, 0, 1, 1, 1)
         self.grid_layout.addWidget(self.y_canvas, 1, 1, 1, 1)
         self.layout.addLayout(self.grid_layout, 7, 0, 2, 2)
+        self.layout.addWidget(self.latency_label, 9, 0, 1, 2)
 
         self.setLayout(self.layout)
 
         # TIMER
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self._update_plots_and_position)
+        # the config file is watched once initialised, changes are applied without re-opening the camera
+        self.config_timer = QtCore.QTimer()
+        self.config_timer.timeout.connect(self._check_config)
+        self.config_watcher = None
+        # polls the handler for its first fitted frame, see _when_ready
+        self.ready_timer = QtCore.QTimer()
+        self.ready_timer.timeout.connect(self._check_ready)
+        self._ready_callbacks = None
 
         # PLOT
         self.monitor_curve = self.plot_canvas.plot(pen='b')
         self.locked_position = 0
-        self.locked_position_curve = self.plot_canvas.plot(pen=pg.mkPen('r', style=Qt.DashLine))
+        # the setpoint is a constant, drawn as a horizontal line rather than as a curve
+        self.locked_position_line = pg.InfiniteLine(angle=0, pen=pg.mkPen('r', style=Qt.DashLine))
+        self.locked_position_line.hide()
+        self.plot_canvas.addItem(self.locked_position_line)
 
         self.x_plot = self.x_canvas.plot(pen='r')
         self.x_fit_plot = self.x_canvas.plot(pen=pg.mkPen('b', style=Qt.DashLine))
         self.y_plot = self.y_canvas.plot(pen='r')
         self.y_fit_plot = self.y_canvas.plot(pen=pg.mkPen('b', style=Qt.DashLine))
 
-        # DATA STORAGE FOR MONITORING
-        self.data = []
-        self.time = []
+        # DATA STORAGE FOR MONITORING, sized from the settings on initialisation
+        self.history = RingBuffer(1)
         self.ptr = 0
 
         # CONNECT ACTIONS
@@ -114,15 +170,26 @@ class AutofocusWidget(QWidget):
         self.monitor_button.clicked.connect(self._on_monitor_button_clicked)
         self.lock_button.clicked.connect(self._on_lock_button_clicked)
         self.show_camera_feed_button.clicked.connect(self._on_show_camera_feed_button_clicked)
+        self.show_latency_button.clicked.connect(self._on_show_latency_button_clicked)
         self.close_camera.clicked.connect(self._on_close_camera_button_clicked)
         self.recall_surface_btn.clicked.connect(self._recall_surface)
+        self.record_references_button.clicked.connect(self._record_reference_library)
+        self.calibrate_button.clicked.connect(self._calibrate)
 
         # Variable storage
         self.locked_position_profile_x = None
         self.locked_position_profile_y = None
+        self.locked_position_roi = None
         self.CameraHandler = None
-
-        # hide the video feed by default
+        self.telemetry = None
+        self.stage_executor = None
+        self.software_trigger = None
+        self._reported_stage_failures = 0
+        self.instrumentation = Instrumentation()
+        self._last_tick_ns = 0
+
+        # hide the video feed and latencies by default
+        self.latency_label.hide()
         self.video_view.hide()
         self.x_canvas.hide()
         self.y_canvas.hide()
@@ -130,6 +197,11 @@ class AutofocusWidget(QWidget):
     def _on_close_camera_button_clicked(self):
         if hasattr(self, "camera"):
             self.camera.Close()
+            self.config_timer.stop()
+            self._cancel_when_ready()
+            self._stop_software_trigger()
+            self._close_telemetry()
+            self._stop_stage_executor()
             print("Camera closed!")
         else:
             print("No camera to close!")
@@ -139,7 +211,7 @@ class AutofocusWidget(QWidget):
         Initialise and open the settings panel.
         :return:
         """
-        self.settings_panel = SettingsPanel()
+        self.settings_panel = SettingsPanel(config_path=self.config_path)
         self.settings_panel.show()
 
     def _on_initialise_button_clicked(self):
@@ -149,19 +221,38 @@ class AutofocusWidget(QWidget):
         # Check if the camera is already initialised
         if hasattr(self, "camera"):
             self.camera.Close()
+        self.config_timer.stop()
+        self._cancel_when_ready()
+        self._stop_software_trigger()
+        self._close_telemetry()
+        self._stop_stage_executor()
 
         # LOAD SETTINGS
-        config_path = Path(__file__).parent / "autofocus_config.json"
-        with open(config_path, "r") as f:
-            self.settings = json.load(f)
-
-        if self.settings["test_mode"]:
-            os.environ["PYLON_CAMEMU"] = "1"
+        self.config_watcher = ConfigWatcher(self.config_path)
+        self.settings = self.config_watcher.read()
+        self.reference_library_path = self.config_path.parent / self.settings.get("reference_library_path",
+                                                                                  "reference_library.npz")
+        serial = self.settings.get("camera_serial", "")
+        # Z drive of this autofocus unit, several units on one microscope each lock their own drive
+        self.focus_device = self.settings.get("focus_device") or self.mmc.getFocusDevice()
+        self.setWindowTitle(f"Autofocus App ({serial})" if serial else "Autofocus App")
+
+        if self.settings.get("simulated", False):
+            # synthetic LED spot following the z position of the microscope, no camera needed
+            self.camera = SimulatedCamera(lambda: self.mmc.getPosition(self.focus_device),
+                                          polyfit=[self.settings["p2"], self.settings["p1"], self.settings["p0"]],
+                                          width=self.settings["width"], height=self.settings["height"],
+                                          frame_rate=1000 / self.settings["exposure_time_ms"],
+                                          focus_z_um=self.mmc.getPosition(self.focus_device))
+            self.camera.Open()
+        else:
+            if self.settings["test_mode"]:
+                os.environ["PYLON_CAMEMU"] = "1"
 
-        self.camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
-        self.camera.Open()
+            self.camera = pylon.InstantCamera(self._create_device(serial))
+            self.camera.Open()
 
-        if self.settings["test_mode"]:
+        if self.settings["test_mode"] and not self.settings.get("simulated", False):
             self.camera.TestImageSelector.Value = "Off"
             # Enable custom test images
             self.camera.ImageFileMode.Value = "On"
@@ -177,14 +268,17 @@ class AutofocusWidget(QWidget):
             self.camera.ImageFilename.Value = str(Path(__file__).parent / 'test-data')
 
         # Set camera parameters
-        self.camera.Width.Value = self.settings["width"]
-        self.camera.Height.Value = self.settings["height"]
-        self.camera.OffsetX.Value = self.settings["offset_x"]
-        self.camera.OffsetY.Value = self.settings["offset_y"]
+        self._set_camera_geometry()
         self.camera.PixelFormat.SetValue('Mono8')
         self.camera.Gain.SetValue(self.settings["gain"])
         self.exposure_time_ms = self.settings["exposure_time_ms"]
         self.camera.ExposureTime.SetValue(self.exposure_time_ms * 1000)
+        # free run, or one frame per software trigger
+        triggered = self.settings.get("acquisition_mode", "free_run") == "software_trigger"
+        self.camera.TriggerSelector.Value = "FrameStart"
+        self.camera.TriggerMode.Value = "On" if triggered else "Off"
+        if triggered:
+            self.camera.TriggerSource.Value = "Software"
         print("Camera initialised!")
         self.video_view.resize(int(self.camera.Width.Value/4), int(self.camera.Height.Value/4))
         self.video_view.setAspectLocked(True)
@@ -193,8 +287,57 @@ class AutofocusWidget(QWidget):
         self.max_movement = self.settings["max_movement"]
         self.update_interval = self.settings["update_interval_s"]
 
+        # monitoring history, the oldest points are dropped once it covers history_window_s
+        self.history = RingBuffer(np.ceil(self.settings.get("history_window_s", 60.0) / self.update_interval))
+
         # instantiate callback handler
-        self.CameraHandler = ImageHandler(self.camera)
+        self.CameraHandler = ImageHandler(self.camera, estimator=self.settings.get("estimator", "caruana"),
+                                          pipeline=self.settings.get("pipeline", True),
+                                          roi_tracking=self.settings.get("roi_tracking", True),
+                                          roi_sigmas=self.settings.get("roi_sigmas", 4.0),
+                                          polyfit=[self.settings["p2"], self.settings["p1"], self.settings["p0"]],
+                                          reference_library=self._load_reference_library(),
+                                          preview_binning=self.settings.get("preview_binning", 4),
+                                          pool=shared_fitting_pool(self.settings.get("fitting_pool_workers", 2)),
+                                          tracker=self._create_tracker(),
+                                          spot_axis_angle_deg=self.settings.get("spot_axis_angle_deg", 0.0))
+        # only a binned preview of the frame is displayed, and only computed while the feed is shown
+        self.CameraHandler.store_frame = False
+        self.CameraHandler.store_preview = self.show_camera_feed_button.isChecked()
+        # the handler, the stage callback and the GUI updates share the same histograms
+        self.instrumentation = self.CameraHandler.instrumentation
+        self.instrumentation.enabled = (self.settings.get("instrumentation_enabled", False)
+                                        or self.show_latency_button.isChecked())
+
+        # the lock runs on every processed frame, the widget only observes it
+        # corrections are sent to the stage by a worker thread, frames exposed while it moves are flagged
+        device = self.focus_device
+        self.stage_executor = StageExecutor(lambda dz: self.mmc.setRelativePosition(device, dz),
+                                            wait_for_device=lambda: self.mmc.waitForDevice(device),
+                                            read_position=lambda: self.mmc.getPosition(device),
+                                            settle_time_s=self.settings.get("stage_settle_time_s", 0.0),
+                                            instrumentation=self.instrumentation)
+        self.stage_executor.start()
+        self._reported_stage_failures = 0
+        self.CameraHandler.stage = self.stage_executor
+
+        self.controller = FocusLockController(self._move_stage, max_movement=self.max_movement,
+                                              kp=self.settings.get("lock_kp", 1.0),
+                                              ki=self.settings.get("lock_ki", 0.0),
+                                              kd=self.settings.get("lock_kd", 0.0),
+                                              deadband_um=self.settings.get("lock_deadband_um", 0.0),
+                                              max_step_um=self.settings.get("lock_max_step_um", None),
+                                              telemetry=self._open_telemetry())
+        self.CameraHandler.add_listener(self.controller.update)
+        if triggered:
+            # frames are requested when the loop needs a measurement: once the previous one is processed (and its
+            # correction submitted), the stage is still and trigger_interval_s elapsed
+            self.software_trigger = SoftwareTrigger(self._execute_software_trigger,
+                                                    self.settings.get("trigger_interval_s", 0.1),
+                                                    stage=self.stage_executor, active=self.camera.IsGrabbing,
+                                                    timeout_s=max(1.0, 10 * self.exposure_time_ms / 1000))
+            self.CameraHandler.add_listener(self.software_trigger.frame_processed)
+            self.software_trigger.start()
         # register with the pylon loop
         self.camera.RegisterImageEventHandler(self.CameraHandler, pylon.RegistrationMode_ReplaceAll, pylon.Cleanup_None)
 
@@ -202,31 +345,171 @@ class AutofocusWidget(QWidget):
         self.CameraHandler.guessx = None
         self.CameraHandler.guessy = None
 
+        self.config_timer.start(int(self.settings.get("config_poll_interval_s", 1.0) * 1000))
+
+    def _set_camera_geometry(self):
+        """Set the sensor size and offsets from the settings. Offsets are cleared first, so a larger size always
+        fits."""
+        self.camera.OffsetX.Value = 0
+        self.camera.OffsetY.Value = 0
+        self.camera.Width.Value = self.settings["width"]
+        self.camera.Height.Value = self.settings["height"]
+        self.camera.OffsetX.Value = self.settings["offset_x"]
+        self.camera.OffsetY.Value = self.settings["offset_y"]
+
+    def _check_config(self):
+        settings = self.config_watcher.poll()
+        if settings is not None and self.CameraHandler is not None:
+            self._apply_settings(settings)
+
+    def _apply_settings(self, settings):
+        """
+        Apply the settings changed in the config file to the running autofocus, without closing the camera or
+        re-creating the handler. Camera parameters are pushed on the next frame boundary, the handler buffers are only
+        re-sized when the geometry changes, and the lock and fit guesses are kept unless the change invalidates them.
+        :param settings: settings read from the config file
+        """
+        if self.settings["test_mode"] and not self.settings.get("simulated", False):
+            # the geometry is set by the test images
+            settings.update({key: self.settings[key] for key in GEOMETRY_SETTINGS})
+        changed = {key for key in settings.keys() | self.settings.keys()
+                   if settings.get(key) != self.settings.get(key)}
+        if not changed:
+            return
+        processing = {key: settings[key] for key in ("estimator", "roi_tracking", "roi_sigmas", "preview_binning",
+                                                     "spot_axis_angle_deg")
+                      if key in changed}
+        try:
+            # nothing is applied unless the handler accepts all the new values
+            self.CameraHandler.validate_settings(**processing)
+        except ValueError as e:
+            print(f"Settings from {self.config_path} not applied: {e}")
+            return
+        self.settings = settings
+
+        restart = changed & RESTART_SETTINGS
+        if restart:
+            print(f"Settings {sorted(restart)} take effect when the plugin is initialised again.")
+        changed -= restart
+
+        if changed & {"exposure_time_ms", "gain"}:
+            self.exposure_time_ms = settings["exposure_time_ms"]
+            self._reconfigure_handler(camera={"Gain": settings["gain"], "ExposureTime": self.exposure_time_ms * 1000})
+
+        if changed & GEOMETRY_SETTINGS:
+            self._apply_geometry()
+
+        if changed & {"position_estimator", "reference_library_path"}:
+            if self.lock_button.isChecked():
+                # the setpoint was measured with the previous estimator
+                self._release_lock("Position estimator changed, lock released.")
+            self.reference_library_path = self.config_path.parent / settings.get("reference_library_path",
+                                                                                 "reference_library.npz")
+            self._reconfigure_handler(reference_library=self._load_reference_library())
+
+        if changed & {"p2", "p1", "p0"}:
+            polyfit = [settings["p2"], settings["p1"], settings["p0"]]
+            callback = None
+            if (self.lock_button.isChecked() and self.CameraHandler.reference_library is None
+                    and getattr(self, "locked_position_guess_x", None) is not None):
+                # same locked spot, expressed with the new calibration. Moved on the processing thread, together with
+                # the polynomial, so no frame is corrected against a setpoint in the other calibration
+                self.locked_position = calculate_position(self.locked_position_guess_x, self.locked_position_guess_y,
+                                                          polyfit)
+                setpoint = self.locked_position
+
+                def callback():
+                    self.controller.setpoint = setpoint
+            self._reconfigure_handler(callback=callback, polyfit=polyfit)
+
+        if any(key.startswith("tracking_") for key in changed):
+            processing["tracker"] = self._create_tracker()
+        if processing:
+            self._reconfigure_handler(**processing)
+
+        # the controller and the stage executor read their parameters on every update, a new value is used from the
+        # next frame
+        self.max_movement = settings["max_movement"]
+        self.controller.max_movement = self.max_movement
+        self.controller.kp = settings.get("lock_kp", 1.0)
+        self.controller.ki = settings.get("lock_ki", 0.0)
+        self.controller.kd = settings.get("lock_kd", 0.0)
+        self.controller.deadband_um = settings.get("lock_deadband_um", 0.0)
+        self.controller.max_step_um = settings.get("lock_max_step_um", None)
+        self.stage_executor.settle_time_s = settings.get("stage_settle_time_s", 0.0)
+        if self.software_trigger is not None:
+            self.software_trigger.interval_s = settings.get("trigger_interval_s", 0.1)
+        self.instrumentation.enabled = (settings.get("instrumentation_enabled", False)
+                                        or self.show_latency_button.isChecked())
+
+        if changed & {"update_interval_s", "history_window_s"}:
+            self.update_interval = settings["update_interval_s"]
+            if self.timer.isActive():
+                self.timer.setInterval(int(self.update_interval * 1000))
+            # keep the most recent samples that fit in the new window
+            history = RingBuffer(np.ceil(settings.get("history_window_s", 60.0) / self.update_interval))
+            for t, z in zip(*(samples[-history.capacity:] for samples in self.history.view())):
+                history.append(t, z)
+            self.history = history
+
+        if changed:
+            print(f"Settings applied: {', '.join(sorted(changed))}")
+
+    def _apply_geometry(self):
+        """Set the sensor size and offsets of the running camera. Grabbing is stopped while they change, the handler
+        keeps its buffers if the size is the same and moves its fit guesses with the offsets."""
+        was_grabbing = self.camera.IsGrabbing()
+        if was_grabbing:
+            self.camera.StopGrabbing()
+        try:
+            offset_x, offset_y = self.camera.OffsetX.Value, self.camera.OffsetY.Value
+            self._set_camera_geometry()
+            shift = (self.camera.OffsetX.Value - offset_x, self.camera.OffsetY.Value - offset_y)
+            width, height = self.camera.Width.Value, self.camera.Height.Value
+            self.CameraHandler.resize(width, height, shift)
+        finally:
+            if was_grabbing:
+                self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
+        self.video_view.resize(int(width / 4), int(height / 4))
+
+        # the locked profiles stay comparable if their roi is still inside the frame
+        if self.locked_position_roi is not None:
+            x_lo, x_hi, y_lo, y_hi = self.locked_position_roi
+            x_lo, x_hi, y_lo, y_hi = x_lo - shift[0], x_hi - shift[0], y_lo - shift[1], y_hi - shift[1]
+            if x_lo >= 0 and y_lo >= 0 and x_hi <= width and y_hi <= height:
+                self.locked_position_roi = (x_lo, x_hi, y_lo, y_hi)
+            else:
+                self.locked_position_roi = None
+                print("The locked profiles are outside the new frame, lock again before recalling the surface.")
+        if self.CameraHandler.reference_library is not None:
+            print("The reference library was recorded with the previous geometry, record it again if the spot moved.")
+
+    def _reconfigure_handler(self, camera=None, callback=None, **settings):
+        """Change the handler settings on its next frame, or straight away if the camera is not grabbing."""
+        self.CameraHandler.reconfigure(camera, callback, **settings)
+        if not self.camera.IsGrabbing():
+            self.CameraHandler.apply_pending_changes()
+
+    def _release_lock(self, message):
+        self.lock_button.setChecked(False)
+        self.controller.unlock()
+        self.lock_button.setStyleSheet("font: italic;")
+        self.lock_button.setText("Definitely focus?")
+        print(message)
+
     def _on_lock_button_clicked(self):
         if self.lock_button.isChecked():
-            # make sure camera starts grabbing
+            # make sure camera starts grabbing and fitting, then lock on the first fitted frame grabbed from now on
+            self.CameraHandler.fit_profiles = True
+            request = self.CameraHandler.arm()
             if not self.camera.IsGrabbing():
-                self.CameraHandler.fit_profiles = True
                 self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
-                time_to_wait = 5*float(self.exposure_time_ms)/1000
-                print(f'Free-run acquisition started! Waiting for {time_to_wait} seconds.')
-                time.sleep(time_to_wait) # give the camera time to acquire the first image
-
-            if self.recall_focus_button.isChecked():
-                # pass because we don't need to recalculate the lock position.
-                pass
-            else:
-                # calculate the lock position
-                self.locked_position = self._calculate_position(self.CameraHandler.guessx, self.CameraHandler.guessy)
-                self.locked_position_profile_x = self.CameraHandler.x_projection
-                self.locked_position_profile_y = self.CameraHandler.y_projection
-
-                self.locked_position_guess_x = self.CameraHandler.guessx
-                self.locked_position_guess_y = self.CameraHandler.guessy
-
-            self.lock_button.setText("Definitely focused!")
-            self.lock_button.setStyleSheet("font: italic bold; color: white; background-color: green;")
+                print('Free-run acquisition started! Waiting for the first fitted frame.')
+            self._when_ready(request, self._engage_lock,
+                             lambda: self._release_lock("No valid focus measurement. Could not lock."))
         elif not self.lock_button.isChecked():
+            self._cancel_when_ready()
+            self.controller.unlock()
             self.lock_button.setStyleSheet("font: italic;")
             self.lock_button.setText("Definitely focus?")
             if self.camera.IsGrabbing() and not self.monitor_button.isChecked() and not self.show_camera_feed_button.isChecked():
@@ -235,6 +518,60 @@ class AutofocusWidget(QWidget):
                 print('Free-run acquisition stopped!')
         pass
 
+    def _engage_lock(self, frame):
+        """
+        Lock on the measurement of a fitted frame, or on the recalled position.
+        :param frame: (measurement, x_projection, y_projection) of the frame, served by the processing thread. The
+        projections are copies of the buffers it reuses for every frame
+        """
+        if not self.lock_button.isChecked():
+            return
+        if self.recall_focus_button.isChecked():
+            # pass because we don't need to recalculate the lock position.
+            pass
+        else:
+            measurement, self.locked_position_profile_x, self.locked_position_profile_y = frame
+            self.locked_position = measurement.z
+            # roi the locked profiles were computed in, recall surface compares profiles in the same roi
+            self.locked_position_roi = measurement.roi
+
+            self.locked_position_guess_x = measurement.fit_x
+            self.locked_position_guess_y = measurement.fit_y
+
+        self.controller.lock(self.locked_position)
+        self.lock_button.setText("Definitely focused!")
+        self.lock_button.setStyleSheet("font: italic bold; color: white; background-color: green;")
+
+    def _when_ready(self, request, callback, on_timeout):
+        """
+        Call callback(frame) with the fitted frame serving a request returned by the handler's arm(), or on_timeout if
+        there is none within ready_timeout_s. The request is polled from a Qt timer, so the GUI is never blocked while
+        waiting.
+        """
+        self._cancel_when_ready()
+        if request.done.is_set():
+            callback(request.result)
+            return
+        timeout_s = max(self.settings.get("ready_timeout_s", 5.0), 10 * self.exposure_time_ms / 1000)
+        self._ready_callbacks = (request, callback, on_timeout, time.monotonic() + timeout_s)
+        self.ready_timer.start(10)
+
+    def _cancel_when_ready(self):
+        self.ready_timer.stop()
+        self._ready_callbacks = None
+
+    def _check_ready(self):
+        if self._ready_callbacks is None:
+            self.ready_timer.stop()
+            return
+        request, callback, on_timeout, deadline = self._ready_callbacks
+        if request.done.is_set():
+            self._cancel_when_ready()
+            callback(request.result)
+        elif time.monotonic() > deadline:
+            self._cancel_when_ready()
+            on_timeout()
+
     def _on_monitor_button_clicked(self):
         if self.monitor_button.isChecked():
             self.CameraHandler.fit_profiles = True
@@ -243,16 +580,15 @@ class AutofocusWidget(QWidget):
             if self.camera.IsGrabbing():
                 pass
             else:
+                self.CameraHandler.arm()
                 self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
-                time_to_wait = 5*float(self.exposure_time_ms)/1000
-                print(f'Free-run acquisition started! Waiting for {time_to_wait} seconds.')
-                time.sleep(time_to_wait) # give the camera time to acquire the first image
+                print('Free-run acquisition started!')
+            # the plot only takes valid measurements, so the timer can run before the first frame is fitted
             if not self.timer.isActive():
                 self.timer.start(int(self.update_interval*1000))
 
             # Clear the graph whenever monitor is restarted
-            self.data = []
-            self.time = []
+            self.history.clear()
         if not self.monitor_button.isChecked() and not self.lock_button.isChecked() and not self.show_camera_feed_button.isChecked():
             self.camera.StopGrabbing()
             print('Free-run acquisition stopped!')
@@ -262,6 +598,7 @@ class AutofocusWidget(QWidget):
     def _on_show_camera_feed_button_clicked(self):
         # start acquisition and timer if not already started
         if self.show_camera_feed_button.isChecked():
+            self.CameraHandler.store_preview = True
             self.adjustSize()
             self.resize(self.max_size[0], self.max_size[1])
             self.video_view.show()
@@ -273,6 +610,7 @@ class AutofocusWidget(QWidget):
             if not self.timer.isActive():
                 self.timer.start(int(self.update_interval*1000))
         else:
+            self.CameraHandler.store_preview = False
             self.video_view.hide()
             self.x_canvas.hide()
             self.y_canvas.hide()
@@ -281,40 +619,75 @@ class AutofocusWidget(QWidget):
 
         pass
 
+    def _on_show_latency_button_clicked(self):
+        # instrumentation is switched on with the display, and only off if not enabled in the settings
+        if self.show_latency_button.isChecked():
+            self.instrumentation.reset()
+            self.instrumentation.enabled = True
+            self._last_tick_ns = 0
+            self.latency_label.show()
+            if self.CameraHandler is not None and not self.timer.isActive():
+                self.timer.start(int(self.update_interval * 1000))
+        else:
+            self.instrumentation.enabled = self.CameraHandler is not None and self.settings.get(
+                "instrumentation_enabled", False)
+            self.latency_label.hide()
+
     def _update_plots_and_position(self):
+        timing = self.instrumentation.enabled
+        if timing:
+            tick_ns = Instrumentation.now()
+            if self._last_tick_ns:
+                self.instrumentation.record("gui_interval", self._last_tick_ns, tick_ns)
+            self._last_tick_ns = tick_ns
+
         # update plots
         if self.show_camera_feed_button.isChecked():
-            self.video_canvas.setImage(self.CameraHandler.img)
-            self.x_plot.setData(self.CameraHandler.x_projection)
-            self.y_plot.setData(self.CameraHandler.y_projection)
+            # fixed levels, so pyqtgraph does not scan the image for its range on every update
+            self.video_canvas.setImage(self.CameraHandler.preview, autoLevels=False, levels=(0, 255))
+            # projections are plotted against pixel coordinates, so the roi lines up with the full frame. Curves are
+            # decimated to at most preview_curve_points points (strided views, no copy)
+            points = self.settings.get("preview_curve_points", 500)
+            x_coords, x_projection = self.CameraHandler.x_coords, self.CameraHandler.x_projection
+            y_coords, y_projection = self.CameraHandler.y_coords, self.CameraHandler.y_projection
+            x_step = max(x_coords.shape[0] // points, 1)
+            y_step = max(y_coords.shape[0] // points, 1)
+            if x_coords.shape == x_projection.shape and y_coords.shape == y_projection.shape:
+                self.x_plot.setData(x_coords[::x_step], x_projection[::x_step])
+                self.y_plot.setData(y_coords[::y_step], y_projection[::y_step])
             if self.lock_button.isChecked() or self.monitor_button.isChecked():
-                self.x_fit_plot.setData(
-                    self.CameraHandler.x_fit)
-                self.y_fit_plot.setData(self.CameraHandler.y_fit)
+                x_fit, y_fit = self.CameraHandler.x_fit, self.CameraHandler.y_fit
+                if x_coords.shape == x_fit.shape and y_coords.shape == y_fit.shape:
+                    self.x_fit_plot.setData(x_coords[::x_step], x_fit[::x_step])
+                    self.y_fit_plot.setData(y_coords[::y_step], y_fit[::y_step])
             else:
                 self.x_fit_plot.clear()
                 self.y_fit_plot.clear()
 
         if self.monitor_button.isChecked():
-            self.monitor_curve.setData(self.time, self.data)
+            self.monitor_curve.setData(*self.history.decimated(self.settings.get("history_max_points", 2000)))
             if self.lock_button.isChecked():
-                self.locked_position_curve.setData(self.time, [(x * 0 + self.locked_position) for x in self.data])
+                self.locked_position_line.setPos(self.locked_position)
+            self.locked_position_line.setVisible(self.lock_button.isChecked())
 
-        # calculate the position
-        if self.lock_button.isChecked() or self.monitor_button.isChecked():
-            self.current_z = self._calculate_position(self.CameraHandler.guessx, self.CameraHandler.guessy)
+        # calculate the position, x and y fits come from the same frame since they are read from a single snapshot
+        measurement = self.CameraHandler.measurement
+        if (self.lock_button.isChecked() or self.monitor_button.isChecked()) and measurement.ok:
+            self.current_z = measurement.z
 
             # and append it to the data
-            self.data.append(self.current_z)
-            self.time.append(self.ptr * self.settings["update_interval_s"])
+            self.history.append(self.ptr * self.settings["update_interval_s"], self.current_z)
 
-        # update position
-        if self.lock_button.isChecked():
-            # calculate required movement
-            self.required_movement = (self.locked_position - self.current_z) * 0.001  # movement is in um
+        # stage failures happen on the stage worker thread, report them here
+        if self.stage_executor is not None and self.stage_executor.failures != self._reported_stage_failures:
+            self._reported_stage_failures = self.stage_executor.failures
+            print(f"Stage movement failed ({self._reported_stage_failures} failures so far): "
+                  f"{self.stage_executor.last_error!r}")
+            self.lock_button.setToolTip(f"Last stage error: {self.stage_executor.last_error!r}")
 
-            if np.abs(self.required_movement) > self.max_movement:
-                print("Movement too big. No movement.")
+        # the stage is moved by the controller on every frame, here we only reflect its state
+        if self.lock_button.isChecked():
+            if self.controller.state == FocusLockController.TRIPPED:
                 # Disengage the lock button
                 self.lock_button.setChecked(False)
                 self.lock_button.setStyleSheet("font: italic bold; color: white; background-color: red;")
@@ -322,110 +695,233 @@ class AutofocusWidget(QWidget):
 
                 # TODO: here need to add what to do if autofocus fails. Possibly find surface and attempt to lock again?
             else:
-                self.last_movement = self.required_movement
-                if np.abs(self.required_movement)*1000 > 0:
-                    try:
-                        self.mmc.setRelativeXYZPosition(0, 0, self.required_movement)
-                    except:
-                        pass
-
-        # clear data if too large
-        # TODO: value below should NOT be hardcoded.
-        if len(self.time) * self.settings["update_interval_s"] > 60:
-            self.time = []
-            self.data = []
-            self.ptr = 0
+                self.last_movement = self.controller.last_movement
+
+        if self.show_latency_button.isChecked():
+            self.latency_label.setText(self.instrumentation.report())
+        if timing:
+            self.instrumentation.record("gui_tick", tick_ns)
 
         self.ptr += 1
         return
 
+    @staticmethod
+    def _create_device(serial):
+        """
+        Pylon device of the camera with a given serial number, or the first camera found if serial is empty.
+        """
+        factory = pylon.TlFactory.GetInstance()
+        if not serial:
+            return factory.CreateFirstDevice()
+        device_info = pylon.DeviceInfo()
+        device_info.SetSerialNumber(str(serial))
+        try:
+            return factory.CreateFirstDevice(device_info)
+        except pylon.RuntimeException:
+            available = [device.GetSerialNumber() for device in factory.EnumerateDevices()]
+            raise RuntimeError(f"No camera with serial number {serial}. Available cameras: {available}")
+
+    def _create_tracker(self):
+        """Filter of the fit parameters if enabled in the settings, None otherwise."""
+        if not self.settings.get("tracking_filter", False):
+            return None
+        return FitTracker(process_noise_px=self.settings.get("tracking_process_noise_px", 1.0),
+                          measurement_noise_px=self.settings.get("tracking_measurement_noise_px", 0.5),
+                          gate=self.settings.get("tracking_gate", 18.47))
+
+    def _load_reference_library(self):
+        """Reference library to derive positions from, if selected in the settings. None to use the fits."""
+        if self.settings.get("position_estimator", "polynomial") != "library":
+            return None
+        try:
+            return ReferenceLibrary.load(self.reference_library_path)
+        except OSError:
+            print(f"Could not load the reference library from {self.reference_library_path}. "
+                  f"Using the calibration polynomial.")
+            return None
+
+    def _record_reference_library(self):
+        """
+        Record reference projections around the current position, which becomes the zero of the library, and save
+        them to the reference library path. The library is used straight away if selected in the settings.
+        """
+        if self.CameraHandler is None:
+            print("Camera handler is none. Could not acquire.")
+            return
+        if self.lock_button.isChecked():
+            print("Unlock before recording references.")
+            return
+
+        was_grabbing = self.camera.IsGrabbing()
+        if not was_grabbing:
+            self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
+        try:
+            library = acquire_reference_library(
+                self.mmc, self.CameraHandler, self.settings.get("reference_library_range_um", 5.0),
+                self.settings.get("reference_library_step_um", 0.1),
+                n_bins=self.settings.get("reference_library_bins", 64),
+                n_components=self.settings.get("reference_library_components", 8),
+                discard_frames=self.settings.get("recall_surface_discard_frames", 1),
+                frame_timeout_s=max(1.0, 10 * self.settings["exposure_time_ms"] / 1000),
+                max_distance_factor=self.settings.get("reference_library_max_distance_factor", MAX_DISTANCE_FACTOR),
+                focus_device=self.focus_device)
+        finally:
+            if not was_grabbing:
+                self.camera.StopGrabbing()
+
+        library.save(self.reference_library_path)
+        print(f"Recorded {library.z.shape[0]} references to {self.reference_library_path}")
+        if self.settings.get("position_estimator", "polynomial") == "library":
+            self.CameraHandler.reference_library = library
+
+    def _calibrate(self):
+        """
+        Calibrate the position polynomial around the current position, which should be in focus. The result and its
+        goodness of fit are written to the config file and used straight away.
+        """
+        if self.CameraHandler is None:
+            print("Camera handler is none. Could not acquire.")
+            return
+        if self.lock_button.isChecked():
+            print("Unlock before calibrating.")
+            return
+
+        was_grabbing = self.camera.IsGrabbing()
+        if not was_grabbing:
+            self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
+        try:
+            calibration = run_calibration(
+                self.mmc, self.CameraHandler, self.settings.get("calibration_range_um", 5.0),
+                self.settings.get("calibration_step_um", 0.1),
+                frames_per_step=self.settings.get("calibration_frames_per_step", 1),
+                discard_frames=self.settings.get("recall_surface_discard_frames", 1),
+                frame_timeout_s=max(1.0, 10 * self.settings["exposure_time_ms"] / 1000),
+                focus_device=self.focus_device)
+        finally:
+            if not was_grabbing:
+                self.camera.StopGrabbing()
+
+        if calibration is None:
+            print("Calibration failed: not enough fitted frames.")
+            return
+        write_calibration(self.config_path, calibration)
+        self.settings.update(calibration)
+        self.CameraHandler.polyfit = [calibration["p2"], calibration["p1"], calibration["p0"]]
+        print(f"Calibration: p2 = {calibration['p2']:.4g}, p1 = {calibration['p1']:.4g}, p0 = {calibration['p0']:.4g}, "
+              f"R^2 = {calibration['calibration_r_squared']:.4f}, RMSE = {calibration['calibration_rmse_nm']:.1f} nm "
+              f"over {calibration['calibration_points']} frames ({calibration['calibration_failed_fits']} failed fits)")
+
     def _calculate_position(self, guessx, guessy):
         polyfit = [self.settings["p2"], self.settings["p1"], self.settings["p0"]]
-        calculated_position = -np.polyval(polyfit, guessx[2] - guessy[2])
-        return calculated_position
+        return calculate_position(guessx, guessy, polyfit)
+
+    def _move_stage(self, movement):
+        """Relative z movement in um, called by the controller from the processing thread. The movement is only
+        queued, the position returned is the one read back after the previous movement."""
+        self.stage_executor.submit(movement)
+        return self.stage_executor.position_um
+
+    def _execute_software_trigger(self):
+        """Trigger one frame, called by the software trigger thread."""
+        if self.camera.WaitForFrameTriggerReady(1000, pylon.TimeoutHandling_ThrowException):
+            self.camera.ExecuteSoftwareTrigger()
+
+    def _stop_software_trigger(self):
+        if self.software_trigger is not None:
+            self.software_trigger.stop()
+            self.software_trigger = None
+
+    def _stop_stage_executor(self):
+        if self.stage_executor is not None:
+            self.stage_executor.stop()
+            self.stage_executor = None
+
+    def _open_telemetry(self):
+        """Per-frame telemetry writer if enabled in the settings, None otherwise."""
+        if not self.settings.get("telemetry_enabled", False):
+            self.telemetry = None
+        else:
+            # one directory per camera, so several autofocus instances never write to the same files
+            directory = self.settings.get("telemetry_directory") or (
+                    Path.home() / "led_autofocus_telemetry" / (self.settings.get("camera_serial") or "default"))
+            try:
+                self.telemetry = TelemetryWriter(directory, self.settings.get("telemetry_records_per_file", 2 ** 20))
+            except ValueError as e:
+                print(f"Telemetry disabled: {e}")
+                self.telemetry = None
+            else:
+                print(f"Recording telemetry to {self.telemetry.path}")
+        return self.telemetry
+
+    def _close_telemetry(self):
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
 
     def _stop_autofocus(self):
         if self.lock_button.isChecked():
             self.lock_button.setChecked(False)
+            self.controller.unlock()
 
     def _recall_surface(self):
         """
         Command to look for a surface.
         It is called after the stage is moved significantly in xy, or the objective lowered than raised.
         It is useful to take into account the fact that the sample does not sit perfectly horizontal.
+        Each z position is scored on a single frame acquired after the stage settled, and positions are visited with a
+        coarse scan followed by a golden-section search, so only a handful of moves are needed.
         """
         max_travel_um = self.settings["recall_surface_range_um"]
         step_travel_um = self.settings["recall_surface_step_um"]
+        coarse_points = self.settings.get("recall_surface_coarse_points", 9)
+        tolerance = self.settings.get("recall_surface_tolerance", 1e-4)
+        # frames possibly exposed while the stage was still moving
+        discard_frames = self.settings.get("recall_surface_discard_frames", 1)
+        frame_timeout_s = max(1.0, 10 * self.settings["exposure_time_ms"] / 1000)
 
         if self.CameraHandler is None:
             print("Camera handler is none. Could not acquire.")
-            pass
+        elif self.locked_position_profile_x is None or self.locked_position_profile_y is None:
+            print("No locked position to recall, lock the focus first.")
         else:
-            # If camera was grabbing, stop.
-            if self.camera.IsGrabbing():
-                self.camera.StopGrabbing()
-            # Now need to acquire a z-stack
             try:
-                current_z = self.mmc.getZPosition()
+                current_z = self.mmc.getPosition(self.focus_device)
             except:
                 current_z = 0
 
-            # generate an array of movements
-            num_movements = (max_travel_um*2)/step_travel_um
-            z_movements = np.linspace(-max_travel_um, max_travel_um, int(num_movements))
-            pixel_distances = []
-
-            self.CameraHandler.fit_profiles = False  # disable this for now - we don't need to fit anything
-            self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
-
-            # get the target profiles and normalisation factors
-            normalisation_factor_x = np.max(self.locked_position_profile_x)
-            normalisation_factor_y = np.max(self.locked_position_profile_y)
-
-            target_profile_x = self.locked_position_profile_x  / normalisation_factor_x
-            target_profile_y = self.locked_position_profile_y / normalisation_factor_y
-
-            # loop through the z-movements
-            for movement in z_movements:
-                self.mmc.setZPosition(current_z+movement)
-
-                current_profile_x = self.CameraHandler.x_projection / normalisation_factor_x
-                current_profile_y = self.CameraHandler.y_projection / normalisation_factor_y
-
-                difference_x = target_profile_x - current_profile_x
-                difference_y = target_profile_y - current_profile_y
-
-                mean_distance_squared_x = np.mean(np.power(difference_x, 2))
-                mean_distance_squared_y = np.mean(np.power(difference_y, 2))
-
-                current_pixel_distance = mean_distance_squared_x + mean_distance_squared_y
+            def move(z):
+                self.mmc.setPosition(self.focus_device, z)
+                self.mmc.waitForDevice(self.focus_device)
 
-                pixel_distances.append(current_pixel_distance)
+            measure = profile_distance(self.CameraHandler, move, self.locked_position_profile_x,
+                                       self.locked_position_profile_y, discard_frames=discard_frames,
+                                       frame_timeout_s=frame_timeout_s)
 
-                # FIXME: can be made WAYY more elegant, but for testing ok.
-                # essentially at some point we will hit the same profile as the target, which should have a very
-                # small error. We can stop there without continuing.
-                # could also try to do this with fitting?
-
-                if current_pixel_distance < 0.01:
-                    break
-
-            self.camera.StopGrabbing()
-
-            # get the index of the smallest value
-            index_smallest = np.where(pixel_distances == np.min(pixel_distances))
-
-
-            # calculate surface position
-            surface_position = current_z + z_movements[index_smallest[0][0]]
-
-            logging.info(f"Recall surface complete. Initial position was: {current_z}, surface position is: {surface_position}")
-
-            # final move to the position closest to the surface.
-            self.mmc.setZPosition(surface_position)
-
-
-            # set fit profiles to true again
-            self.CameraHandler.guessx = self.locked_position_guess_x
-            self.CameraHandler.guessy = self.locked_position_guess_y
-            self.CameraHandler.fit_profiles = True
+            # the handler and camera are only changed inside the try, so the finally always restores them
+            was_grabbing = self.camera.IsGrabbing()
+            was_fitting = self.CameraHandler.fit_profiles
+            try:
+                self.CameraHandler.fit_profiles = False  # disable this for now - we don't need to fit anything
+                # compute the projections in the same roi as the locked profiles
+                self.CameraHandler.fixed_roi = self.locked_position_roi
+                if not was_grabbing:
+                    self.camera.StartGrabbing(pylon.GrabStrategy_OneByOne, pylon.GrabLoop_ProvidedByInstantCamera)
+
+                surface_position, distance, evaluations = coarse_to_fine_search(
+                    measure, current_z, max_travel_um, step_travel_um, coarse_points=coarse_points,
+                    tolerance=tolerance)
+
+                logging.info(f"Recall surface complete in {len(evaluations)} moves. Initial position was: "
+                             f"{current_z}, surface position is: {surface_position}")
+
+                # final move to the position closest to the surface.
+                self.mmc.setPosition(self.focus_device, surface_position)
+            finally:
+                if not was_grabbing:
+                    self.camera.StopGrabbing()
+
+                # fit the profiles again, as before the search
+                self.CameraHandler.fixed_roi = None
+                self.CameraHandler.guessx = self.locked_position_guess_x
+                self.CameraHandler.guessy = self.locked_position_guess_y
+                self.CameraHandler.fit_profiles = was_fitting
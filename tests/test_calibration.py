@@ -0,0 +1,60 @@
+import pytest
+
+from led_autofocus._calibration import run_calibration
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._reference_library import acquire_reference_library
+from led_autofocus._simulation import SimulatedCamera
+
+POLYFIT = [-0.069, -23.2, 44.15]
+
+
+class TwoDriveCore:
+    """Z drives of a microscope with two autofocus units, with the CMMCorePlus methods the autofocus uses."""
+
+    def __init__(self):
+        self.positions = {"ZLeft": 0.0, "ZRight": 0.0}
+        self.waited = set()
+
+    def getFocusDevice(self):
+        return "ZLeft"
+
+    def getPosition(self, label):
+        return self.positions[label]
+
+    def setPosition(self, label, z):
+        self.positions[label] = z
+
+    def waitForDevice(self, label):
+        self.waited.add(label)
+
+
+@pytest.fixture
+def grabbing():
+    core = TwoDriveCore()
+    camera = SimulatedCamera(lambda: core.positions["ZRight"], polyfit=POLYFIT, width=960, height=540,
+                             centre=(470, 282), sigma=57, frame_rate=500.0)
+    camera.Open()
+    processor = FrameProcessor(camera, roi_tracking=True, polyfit=POLYFIT)
+    processor.store_frame = False
+    camera.RegisterImageEventHandler(processor)
+    camera.StartGrabbing()
+    yield core, processor
+    camera.Close()
+    processor.stop()
+
+
+def test_calibration_moves_its_own_focus_device(grabbing):
+    core, processor = grabbing
+    calibration = run_calibration(core, processor, 2.0, 0.5, frame_timeout_s=2.0, focus_device="ZRight")
+    assert calibration["calibration_failed_fits"] == 0
+    assert calibration["calibration_r_squared"] > 0.99
+    assert core.positions == {"ZLeft": 0.0, "ZRight": 0.0}
+    assert core.waited == {"ZRight"}
+
+
+def test_reference_library_moves_its_own_focus_device(grabbing):
+    core, processor = grabbing
+    library = acquire_reference_library(core, processor, 2.0, 0.5, frame_timeout_s=2.0, focus_device="ZRight")
+    assert library.z.shape == (9,)
+    assert core.positions == {"ZLeft": 0.0, "ZRight": 0.0}
+    assert core.waited == {"ZRight"}
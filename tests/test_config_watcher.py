@@ -0,0 +1,48 @@
+import json
+import os
+
+from led_autofocus._config_watcher import ConfigWatcher
+
+
+def write(path, text, mtime_ns):
+    path.write_text(text)
+    # the modification time is set explicitly, file systems with a coarse resolution would miss quick changes
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_poll_only_reads_changed_files(tmp_path):
+    path = tmp_path / "autofocus_config.json"
+    write(path, json.dumps({"gain": 25}), 1_000_000_000)
+    watcher = ConfigWatcher(path)
+    assert watcher.read() == {"gain": 25}
+    assert watcher.poll() is None
+
+    write(path, json.dumps({"gain": 10}), 2_000_000_000)
+    assert watcher.poll() == {"gain": 10}
+    assert watcher.poll() is None
+
+    # same size, newer file
+    write(path, json.dumps({"gain": 11}), 3_000_000_000)
+    assert watcher.poll() == {"gain": 11}
+
+
+def test_half_written_file_is_read_again_on_its_next_change(tmp_path, capsys):
+    path = tmp_path / "autofocus_config.json"
+    write(path, json.dumps({"gain": 25}), 1_000_000_000)
+    watcher = ConfigWatcher(path)
+
+    write(path, '{"gain": 2', 2_000_000_000)
+    assert watcher.poll() is None
+    assert "Could not read the settings" in capsys.readouterr().out
+    assert watcher.poll() is None
+
+    write(path, json.dumps({"gain": 20}), 3_000_000_000)
+    assert watcher.poll() == {"gain": 20}
+
+
+def test_missing_file(tmp_path):
+    path = tmp_path / "autofocus_config.json"
+    watcher = ConfigWatcher(path)
+    assert watcher.poll() is None
+    write(path, json.dumps({"gain": 25}), 1_000_000_000)
+    assert watcher.poll() == {"gain": 25}
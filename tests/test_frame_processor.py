@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._position import calculate_position
+from led_autofocus._simulation import SimulatedCamera
+from led_autofocus._tracking import FitTracker
+
+POLYFIT = [-0.069, -23.2, 44.15]
+
+
+@pytest.fixture
+def camera():
+    return SimulatedCamera(lambda: 0.0, polyfit=POLYFIT, width=960, height=540, centre=(470, 282), sigma=57)
+
+
+@pytest.fixture
+def processor(camera):
+    processor = FrameProcessor(camera, fit_profiles=True, polyfit=POLYFIT)
+    processor.store_frame = False
+    return processor
+
+
+def grab(processor, frame):
+    """Process a frame as the grab callback would, with the next frame id."""
+    processor.frames_grabbed += 1
+    processor._process_frame(frame, 0, processor.frames_grabbed)
+
+
+def test_arm_request_is_served_by_the_next_valid_frame(camera, processor):
+    grab(processor, camera.render(0.0))
+    request = processor.arm()
+    assert not request.done.is_set()
+
+    # no spot: not a valid measurement, the request stays pending
+    processor.fit_profiles = False
+    grab(processor, camera.render(0.0))
+    assert not processor.measurement.ok
+    assert not request.done.is_set()
+
+    processor.fit_profiles = True
+    grab(processor, camera.render(200.0))
+    assert request.done.is_set() and processor.ready.is_set()
+    measurement, x_projection, y_projection = request.result
+    assert measurement is processor.measurement and measurement.frame_id == 3
+    # the projections are copies of the frame, not the buffers the next frames are written to
+    np.testing.assert_array_equal(x_projection, processor.x_projection)
+    grab(processor, camera.render(-500.0))
+    assert not np.array_equal(x_projection, processor.x_projection)
+    assert request.result[0].frame_id == 3
+
+
+def test_arm_again_moves_the_pending_request_on(camera, processor):
+    request = processor.arm()
+    processor.frames_grabbed += 5
+    # e.g. settings applied by the processing thread before the request was served
+    assert processor.arm() is request
+    assert request.after_frame_id == 5
+
+    grab(processor, camera.render(0.0))
+    assert request.done.is_set() and request.result[0].frame_id == 6
+    # once served, a new request
+    assert processor.arm() is not request
+
+
+
+def test_resize_keeps_the_guesses_in_the_new_coordinates(camera, processor):
+    processor.roi_tracking = True
+    grab(processor, camera.render(0.0))
+    grab(processor, camera.render(0.0))
+    guess_x, guess_y = list(processor.guessx), list(processor.guessy)
+    assert processor.roi != processor.full_roi
+
+    # same size, offsets moved by (40, -20)
+    processor.resize(960, 540, shift=(40, -20))
+    assert processor.guessx[1] == pytest.approx(guess_x[1] - 40)
+    assert processor.guessy[1] == pytest.approx(guess_y[1] + 20)
+    assert processor.guessx[2] == guess_x[2]
+    # the tracking window starts again from the whole frame
+    assert processor.roi == processor.full_roi
+
+
+def test_resize_drops_guesses_moved_out_of_the_frame(camera, processor):
+    grab(processor, camera.render(0.0))
+    guess_x = list(processor.guessx)
+
+    processor.resize(400, 540)
+    assert processor.img.shape == (540, 400)
+    assert processor.full_roi == (0, 400, 0, 540)
+    # the x centre is no longer in the frame, and a single guess is not kept either
+    assert guess_x[1] > 400
+    assert processor.guessx is None and processor.guessy is None
+
+
+def test_resize_reallocates_the_slot_in_pipeline_mode(camera):
+    processor = FrameProcessor(camera, fit_profiles=True, pipeline=True, polyfit=POLYFIT)
+    processor.resize(480, 270)
+    assert processor.img.shape == (270, 480)
+    processor._slot.put(np.zeros((270, 480), dtype=np.uint8), 0, 1)
+    assert processor._slot.take(timeout=0)[1].shape == (270, 480)
+
+
+def test_resize_shifts_the_tracker(camera):
+    tracker = FitTracker()
+    processor = FrameProcessor(camera, fit_profiles=True, polyfit=POLYFIT, tracker=tracker)
+    processor.store_frame = False
+    grab(processor, camera.render(0.0))
+    position = tracker._position.copy()
+    processor.resize(960, 540, shift=(10, 5))
+    np.testing.assert_allclose(tracker._position[[0, 2]], position[[0, 2]] - [10, 5])
+
+
+def test_changes_land_at_a_frame_boundary(camera, processor):
+    grab(processor, camera.render(500.0))
+    events = []
+    processor.add_listener(lambda measurement: events.append(("frame", measurement.frame_id)))
+
+    polyfit = [POLYFIT[0], POLYFIT[1], POLYFIT[2] + 100]
+    processor.reconfigure(camera={"ExposureTime": 50000}, callback=lambda: events.append(("callback", None)),
+                          polyfit=polyfit, estimator="moments")
+    # nothing changes until the next frame is processed
+    assert processor.polyfit == POLYFIT and processor.estimator == "caruana"
+    assert camera.ExposureTime.Value != 50000
+    assert events == []
+
+    grab(processor, camera.render(500.0))
+    # applied before the frame, which is processed with all the new settings
+    assert events == [("callback", None), ("frame", 2)]
+    assert processor.polyfit == polyfit and processor.estimator == "moments"
+    assert camera.ExposureTime.Value == 50000 and processor.exposure_time_ns == 50_000_000
+    measurement = processor.measurement
+    assert measurement.z == pytest.approx(calculate_position(measurement.fit_x, measurement.fit_y, polyfit))
+    assert processor._pending_changes == {}
+
+
+def test_invalid_changes_are_rejected_before_anything_is_pending(processor):
+    with pytest.raises(ValueError):
+        processor.reconfigure(estimator="bogus")
+    with pytest.raises(ValueError):
+        processor.reconfigure(preview_binning=0)
+    with pytest.raises(ValueError):
+        processor.reconfigure(width=100)
+    assert processor._pending_changes == {}
+    processor.validate_settings(estimator="moments_2d", preview_binning=2)
+
+
+def test_applied_changes_arm_the_processor(camera, processor):
+    grab(processor, camera.render(0.0))
+    processor.arm()
+    grab(processor, camera.render(0.0))
+    assert processor.ready.is_set()
+    # frames processed with the previous settings do not count as ready
+    processor.reconfigure(roi_sigmas=3.0)
+    processor.apply_pending_changes()
+    assert not processor.ready.is_set()
+    assert processor.roi_sigmas == 3.0
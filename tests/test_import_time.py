@@ -0,0 +1,27 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from benchmarks.import_time_check import BUDGET_S, CORE_MODULES, HEAVY_MODULES, REPEATS, measure
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+@pytest.fixture(autouse=True)
+def source_tree(monkeypatch):
+    # the fresh interpreters import the package from the source tree, like the tests
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [str(SRC), os.environ.get("PYTHONPATH")])))
+
+
+@pytest.mark.parametrize("module", CORE_MODULES)
+def test_core_module_does_not_load_heavy_modules(module):
+    _, _, heavy = measure(module)
+    assert heavy == [], f"{module} loads {heavy}, none of {HEAVY_MODULES} may be imported by the core"
+
+
+@pytest.mark.parametrize("module", CORE_MODULES)
+def test_core_module_import_time_within_budget(module):
+    # best of a few runs, as in import_time_check, so a busy machine does not fail the check
+    module_s = min(measure(module)[1] for _ in range(REPEATS))
+    assert module_s < BUDGET_S, f"{module} takes {module_s * 1000:.1f} ms to import, budget {BUDGET_S * 1000:.0f} ms"
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from led_autofocus._moments import estimate_spot_moments, image_moments, principal_axes
+
+SHAPE = (256, 288)
+# the window is a region of interest, its coordinates do not start at 0
+X_COORDS = np.arange(SHAPE[1], dtype=np.float64) + 40
+Y_COORDS = np.arange(SHAPE[0], dtype=np.float64) + 30
+CENTRE = (185.3, 152.7)
+S_MAJOR, S_MINOR = 22.0, 11.0
+
+
+def spot(angle_deg, background=10, amplitude=200):
+    """Mono8 frame of a Gaussian spot with its major axis at angle_deg from the x axis of the sensor."""
+    theta = np.deg2rad(angle_deg)
+    x, y = np.meshgrid(X_COORDS - CENTRE[0], Y_COORDS - CENTRE[1])
+    u = x * np.cos(theta) + y * np.sin(theta)
+    v = -x * np.sin(theta) + y * np.cos(theta)
+    frame = background + amplitude * np.exp(-0.5 * ((u / S_MAJOR) ** 2 + (v / S_MINOR) ** 2))
+    return np.round(frame).astype(np.uint8)
+
+
+def wrap(angle):
+    """Angle difference wrapped to [-pi/2, pi/2), as the orientation of an axis is only defined modulo pi."""
+    return (angle + np.pi / 2) % np.pi - np.pi / 2
+
+
+def test_moments_of_a_rotated_spot():
+    background, total, x0, y0, covariance = image_moments(spot(30), X_COORDS, Y_COORDS)
+    assert background == pytest.approx(10, abs=0.5)
+    assert (x0, y0) == pytest.approx(CENTRE, abs=0.05)
+    s_major, s_minor, angle = principal_axes(covariance)
+    assert (s_major, s_minor) == pytest.approx((S_MAJOR, S_MINOR), rel=0.01)
+    assert angle == pytest.approx(np.deg2rad(30), abs=0.005)
+
+
+@pytest.mark.parametrize("axis_angle_deg", [0, 30])
+@pytest.mark.parametrize("spot_angle_deg", [0, 20, 45, 80])
+def test_widths_along_the_axes_of_the_astigmatism(spot_angle_deg, axis_angle_deg):
+    axis_angle = np.deg2rad(axis_angle_deg)
+    fit_x, fit_y, angle = estimate_spot_moments(spot(spot_angle_deg), X_COORDS, Y_COORDS, axis_angle=axis_angle)
+    assert (fit_x[1], fit_y[1]) == pytest.approx(CENTRE, abs=0.05)
+    # the x axis of the spot is the principal axis within 45 degrees of the x axis of the astigmatism
+    assert abs(wrap(angle - axis_angle)) <= np.pi / 4 + 1e-9
+
+    offset = spot_angle_deg - axis_angle_deg
+    if abs(offset) == 45:
+        # either axis is as close to the astigmatism, but the widths must still describe the spot
+        swapped = fit_x[2] < fit_y[2]
+        assert sorted((fit_x[2], fit_y[2])) == pytest.approx((S_MINOR, S_MAJOR), rel=0.01)
+    else:
+        # beyond 45 degrees the minor axis is the closest to the x axis of the astigmatism
+        swapped = abs(offset) > 45
+        expected = (S_MINOR, S_MAJOR) if swapped else (S_MAJOR, S_MINOR)
+        assert (fit_x[2], fit_y[2]) == pytest.approx(expected, rel=0.01)
+    major_angle = angle + np.pi / 2 if swapped else angle
+    assert wrap(major_angle - np.deg2rad(spot_angle_deg)) == pytest.approx(0, abs=0.005)
+
+
+def test_spot_aligned_with_the_sensor_matches_the_projections():
+    fit_x, fit_y, angle = estimate_spot_moments(spot(0), X_COORDS, Y_COORDS)
+    assert angle == pytest.approx(0, abs=1e-3)
+    assert fit_x[2] > fit_y[2]
+    # offset and amplitude of projections normalised to a maximum of 1
+    for fit in (fit_x, fit_y):
+        assert 0 < fit[0] < 1
+        assert fit[0] + fit[3] == pytest.approx(1)
+
+
+def test_flat_frame_has_no_spot():
+    frame = np.full(SHAPE, 10, dtype=np.uint8)
+    assert image_moments(frame, X_COORDS, Y_COORDS) is None
+    assert estimate_spot_moments(frame, X_COORDS, Y_COORDS) is None
+    assert estimate_spot_moments(np.zeros(SHAPE, dtype=np.uint8), X_COORDS, Y_COORDS) is None
+
+
+def test_principal_axes_of_a_degenerate_covariance():
+    assert principal_axes(np.array([[4.0, 0.0], [0.0, 0.0]])) is None
+    assert principal_axes(np.array([[4.0, 2.0], [2.0, 1.0]])) is None
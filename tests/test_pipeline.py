@@ -0,0 +1,130 @@
+import threading
+import time
+
+import numpy as np
+
+from led_autofocus._pipeline import FittingPool, LatestFrameSlot
+
+SHAPE = (8, 8)
+TIMEOUT_S = 5.0
+
+
+class SlowClient:
+    """process callable of one handler, recording how many workers run it at the same time."""
+
+    def __init__(self, monitor, duration_s=0.005):
+        self.monitor = monitor
+        self.duration_s = duration_s
+        self.active = 0
+        self.max_active = 0
+        self.frame_ids = []
+
+    def __call__(self, frame, timestamp, frame_id, arrival_ns):
+        with self.monitor.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.monitor.active += 1
+            self.monitor.max_active = max(self.monitor.max_active, self.monitor.active)
+        time.sleep(self.duration_s)
+        self.frame_ids.append(frame_id)
+        with self.monitor.lock:
+            self.active -= 1
+            self.monitor.active -= 1
+
+
+class Monitor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+
+def test_pool_processes_each_client_on_one_worker_and_all_progress():
+    pool = FittingPool(workers=2)
+    monitor = Monitor()
+    slots = [LatestFrameSlot(SHAPE) for _ in range(4)]
+    clients = [SlowClient(monitor) for _ in slots]
+    workers = [pool.worker(slot, client) for slot, client in zip(slots, clients)]
+    for worker in workers:
+        worker.start()
+
+    # cameras delivering frames faster than the pool can process them
+    frame = np.zeros(SHAPE, dtype=np.uint8)
+    end = time.monotonic() + 0.5
+    frame_id = 0
+    while time.monotonic() < end:
+        frame_id += 1
+        for slot in slots:
+            slot.put(frame, 0, frame_id)
+        time.sleep(0.001)
+
+    for worker in workers:
+        worker.stop()
+    pool.shutdown()
+
+    assert all(client.max_active == 1 for client in clients)
+    # both workers were used, never more
+    assert monitor.max_active == 2
+    processed = [worker.frames_processed for worker in workers]
+    assert min(processed) > 0
+    # round robin: no client is starved by the others
+    assert min(processed) >= max(processed) / 3
+    # only the latest frame is processed, in order
+    assert all(client.frame_ids == sorted(client.frame_ids) for client in clients)
+
+
+def test_idle_worker_does_not_take_a_busy_client():
+    # a single camera on a pool of two: the second worker must wait, not process the next frame in parallel
+    pool = FittingPool(workers=2)
+    monitor = Monitor()
+    slot = LatestFrameSlot(SHAPE)
+    client = SlowClient(monitor)
+    worker = pool.worker(slot, client)
+    worker.start()
+
+    frame = np.zeros(SHAPE, dtype=np.uint8)
+    for frame_id in range(1, 200):
+        slot.put(frame, 0, frame_id)
+        time.sleep(0.001)
+
+    worker.stop()
+    pool.shutdown()
+    assert worker.frames_processed > 0
+    assert client.max_active == 1
+
+
+def test_stop_waits_for_the_frame_being_processed():
+    pool = FittingPool(workers=1)
+    monitor = Monitor()
+    slot = LatestFrameSlot(SHAPE)
+    client = SlowClient(monitor, duration_s=0.2)
+    worker = pool.worker(slot, client)
+    worker.start()
+
+    slot.put(np.zeros(SHAPE, dtype=np.uint8), 0, 1)
+    start = time.monotonic()
+    while not monitor.active and time.monotonic() - start < TIMEOUT_S:
+        time.sleep(0.001)
+    assert monitor.active == 1
+
+    worker.stop()
+    # the handler can release its buffers once stop returns
+    assert monitor.active == 0
+    assert client.frame_ids == [1]
+    pool.shutdown()
+
+
+def test_resize_drops_the_pending_frame_and_takes_the_new_shape():
+    slot = LatestFrameSlot(SHAPE)
+    slot.put(np.ones(SHAPE, dtype=np.uint8), 0, 1)
+    assert slot.queue_depth == 1
+
+    slot.resize((4, 6))
+    assert slot.queue_depth == 0
+    assert slot.take(timeout=0) is None
+
+    slot.put(np.full((4, 6), 7, dtype=np.uint8), 0, 2)
+    index, frame, _, frame_id, _ = slot.take(timeout=0)
+    assert frame.shape == (4, 6) and frame.dtype == np.uint8
+    assert frame_id == 2 and np.all(frame == 7)
+    slot.release(index)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._measurement import FocusMeasurement
+from led_autofocus._reference_library import ReferenceLibrary, _downsample
+from led_autofocus._simulation import SimulatedCamera
+
+Z = np.linspace(-1000, 1000, 21)
+POLYFIT = [-0.069, -23.2, 44.15]
+
+
+def profiles(z, length):
+    # the spot widens away from focus, more along x than along y
+    pixels = np.arange(length)
+    centre = (length - 1) / 2
+    x = np.exp(-0.5 * ((pixels - centre) / (length / 8 + abs(z) / 400 + z / 2000)) ** 2)
+    y = np.exp(-0.5 * ((pixels - centre) / (length / 8 + abs(z) / 400 - z / 2000)) ** 2)
+    return x, y
+
+
+@pytest.mark.parametrize("length", [16, 63, 64, 200])
+def test_downsample_is_finite_for_any_profile_length(length):
+    binned = _downsample(profiles(100, length)[0], 64)
+    assert binned.shape == (min(length, 64),)
+    assert np.all(np.isfinite(binned))
+    assert np.max(binned) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("length", [16, 200])
+def test_library_estimates_the_reference_positions(length):
+    # a roi window can be narrower than the default number of bins
+    x_profiles, y_profiles = zip(*(profiles(z, length) for z in Z))
+    library = ReferenceLibrary.build(Z, x_profiles, y_profiles, n_bins=64)
+    assert np.all(np.isfinite(library.coordinates))
+
+    for z in (-700, 0, 300):
+        estimate, _ = library.estimate(*profiles(z, length))
+        assert estimate == pytest.approx(z, abs=1e-6)
+
+
+def test_frames_far_from_every_reference_are_not_trusted():
+    x_profiles, y_profiles = zip(*(profiles(z, 200) for z in Z))
+    library = ReferenceLibrary.build(Z, x_profiles, y_profiles)
+    assert np.isfinite(library.max_distance)
+
+    for z in (-1000, -350, 1000):
+        assert library.estimate(*profiles(z, 200))[1] <= library.max_distance
+    # beyond the end of the library the position is clamped, and the distance tells it apart
+    estimate, distance = library.estimate(*profiles(4000, 200))
+    assert estimate == Z[-1]
+    assert distance > library.max_distance
+    # no spot
+    assert library.estimate(np.ones(200), np.ones(200))[1] > library.max_distance
+
+
+def test_save_and_load(tmp_path):
+    x_profiles, y_profiles = zip(*(profiles(z, 200) for z in Z))
+    library = ReferenceLibrary.build(Z, x_profiles, y_profiles, roi=(0, 200, 0, 200))
+    library.save(tmp_path / "library.npz")
+    loaded = ReferenceLibrary.load(tmp_path / "library.npz")
+    assert loaded.max_distance == library.max_distance
+    assert loaded.roi == library.roi
+    assert loaded.estimate(*profiles(300, 200)) == pytest.approx(library.estimate(*profiles(300, 200)))
+
+
+def test_processor_flags_frames_outside_the_library():
+    camera = SimulatedCamera(lambda: 0.0, polyfit=POLYFIT, width=960, height=540, centre=(470, 282), sigma=57)
+    processor = FrameProcessor(camera)
+    processor.store_frame = False
+    x_profiles, y_profiles = [], []
+    for frame_id, z in enumerate(Z, 1):
+        processor._process_frame(camera.render(z), 0, frame_id)
+        x_profiles.append(processor.x_projection.copy())
+        y_profiles.append(processor.y_projection.copy())
+    processor.reference_library = ReferenceLibrary.build(Z, x_profiles, y_profiles)
+    processor.fit_profiles = True
+
+    processor._process_frame(camera.render(300), 0, 100)
+    assert processor.measurement.ok
+    assert processor.measurement.z == pytest.approx(300, abs=50)
+
+    for frame in (camera.render(2500), np.full_like(camera.render(0), 15)):
+        processor._process_frame(frame, 0, 101)
+        assert processor.measurement.status == FocusMeasurement.FIT_FAILED
+        assert np.isnan(processor.measurement.z)
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from led_autofocus._stage_executor import StageExecutor
+
+TIMEOUT_S = 5.0
+
+
+class BlockingStage:
+    """Fake stage whose movements block until released, so the executor can be caught while it is busy."""
+
+    def __init__(self, fail_first=False):
+        self.movements = []
+        self.fail_first = fail_first
+        self.moving = threading.Event()
+        self.release = threading.Event()
+
+    def move_relative(self, dz_um):
+        self.moving.set()
+        assert self.release.wait(TIMEOUT_S)
+        if self.fail_first and not self.movements:
+            self.movements.append(None)
+            raise RuntimeError("stage error")
+        self.movements.append(dz_um)
+
+
+@pytest.fixture
+def stage():
+    return BlockingStage()
+
+
+@pytest.fixture
+def executor(stage):
+    executor = StageExecutor(stage.move_relative)
+    executor.start()
+    yield executor
+    stage.release.set()
+    executor.stop()
+
+
+def test_submits_while_busy_are_coalesced_into_one_move(stage, executor):
+    executor.submit(1.0)
+    assert stage.moving.wait(TIMEOUT_S)
+    for movement in (0.5, 0.25, -0.1):
+        executor.submit(movement)
+    stage.release.set()
+
+    assert executor.wait_until_still(TIMEOUT_S)
+    assert stage.movements == [1.0, pytest.approx(0.65)]
+    assert executor.moves == 2
+    assert executor.coalesced == 2
+    assert executor.failures == 0
+
+
+def test_not_still_while_pending():
+    # not started, so the movement stays pending
+    executor = StageExecutor(lambda dz: None)
+    executor.submit(1.0)
+    assert executor.busy
+    assert not executor.is_still_since(time.perf_counter_ns())
+
+
+def test_not_still_while_moving_or_settling(stage):
+    executor = StageExecutor(stage.move_relative, settle_time_s=0.2)
+    executor.start()
+    try:
+        before_ns = time.perf_counter_ns()
+        assert executor.is_still_since(before_ns)
+
+        executor.submit(1.0)
+        assert stage.moving.wait(TIMEOUT_S)
+        assert not executor.is_still_since(before_ns)
+        assert not executor.is_still_since(time.perf_counter_ns())
+
+        # the movement is done, but the stage is settling
+        stage.release.set()
+        while not stage.movements:
+            time.sleep(0.001)
+        assert not executor.is_still_since(time.perf_counter_ns())
+
+        assert executor.wait_until_still(TIMEOUT_S)
+        # frames exposed from before the movement are not still, frames exposed after it are
+        assert not executor.is_still_since(before_ns)
+        assert executor.is_still_since(time.perf_counter_ns())
+    finally:
+        stage.release.set()
+        executor.stop()
+
+
+def test_failed_move_is_counted_and_worker_keeps_running():
+    stage = BlockingStage(fail_first=True)
+    stage.release.set()
+    executor = StageExecutor(stage.move_relative)
+    executor.start()
+    try:
+        executor.submit(1.0)
+        assert executor.wait_until_still(TIMEOUT_S)
+        assert executor.failures == 1
+        assert isinstance(executor.last_error, RuntimeError)
+        assert executor.moves == 0
+
+        executor.submit(2.0)
+        assert executor.wait_until_still(TIMEOUT_S)
+        assert stage.movements == [None, 2.0]
+        assert executor.moves == 1
+        assert executor.failures == 1
+        assert executor._thread.is_alive()
+    finally:
+        executor.stop()
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+import pytest
+
+from led_autofocus._measurement import FocusMeasurement
+from led_autofocus._telemetry import TelemetryWriter, read_telemetry
+
+TIMEOUT_S = 5.0
+
+
+def measurement(frame_id):
+    return FocusMeasurement(frame_id=frame_id, timestamp=frame_id * 1000, status=FocusMeasurement.OK,
+                            fit_x=np.array([0.1, 10.0, 5.0, 0.9]), fit_y=None, z=float(frame_id))
+
+
+def test_writers_started_together_do_not_share_files(tmp_path):
+    first = TelemetryWriter(tmp_path, records_per_file=8)
+    second = TelemetryWriter(tmp_path, records_per_file=8)
+    assert first.path != second.path
+
+    first.record(measurement(1))
+    second.record(measurement(2))
+    first.close()
+    second.close()
+    assert read_telemetry(tmp_path, first.session)["frame_id"].tolist() == [1]
+    assert read_telemetry(tmp_path, second.session)["frame_id"].tolist() == [2]
+
+
+def test_records_roll_over_to_the_next_file(tmp_path):
+    writer = TelemetryWriter(tmp_path, records_per_file=2)
+    for frame_id in range(1, 6):
+        # the next file is prepared on a helper thread, give it the time a frame would take
+        start = time.monotonic()
+        while writer._position == writer.records_per_file and writer._next_records is None:
+            assert time.monotonic() - start < TIMEOUT_S
+            time.sleep(0.001)
+        writer.record(measurement(frame_id))
+    writer.close()
+
+    assert writer.records_written == 5 and writer.records_dropped == 0
+    records = read_telemetry(tmp_path)
+    assert records["frame_id"].tolist() == [1, 2, 3, 4, 5]
+    assert np.isnan(records["fit_y"]).all()
+
+
+@pytest.mark.parametrize("records_per_file", [0, 1])
+def test_too_few_records_per_file_are_rejected(tmp_path, records_per_file):
+    with pytest.raises(ValueError):
+        TelemetryWriter(tmp_path, records_per_file=records_per_file)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from led_autofocus._frame_processor import FrameProcessor
+from led_autofocus._simulation import SimulatedCamera
+from led_autofocus._tracking import FitTracker
+
+# x0, sx, y0, sy at frame 0 and their change per frame
+START = np.array([100.0, 20.0, 50.0, 30.0])
+VELOCITY = np.array([0.5, 0.1, -0.3, 0.0])
+POLYFIT = [-0.069, -23.2, 44.15]
+
+
+def fits(parameters):
+    x0, sx, y0, sy = parameters
+    return [0.2, x0, sx, 0.8], [0.3, y0, sy, 0.7]
+
+
+def track(tracker, frames, noise=0.2, seed=0):
+    """Feed a constant-velocity track to the tracker, return the filtered fits of the last frame."""
+    rng = np.random.default_rng(seed)
+    filtered = None
+    for frame_id in range(frames):
+        tracker.predict(frame_id)
+        measured = START + VELOCITY * frame_id + rng.normal(0, noise, 4)
+        filtered = tracker.update(frame_id, *fits(measured))
+    return filtered
+
+
+def state(tracker):
+    return [array.copy() for array in (tracker._position, tracker._velocity, tracker._p00, tracker._p01,
+                                       tracker._p11)]
+
+
+def test_constant_velocity_track_converges():
+    # without noise the filter locks on to the track and its velocity
+    tracker = FitTracker()
+    filtered_x, filtered_y = track(tracker, 100, noise=0)
+    true = START + VELOCITY * 99
+    assert [filtered_x[1], filtered_x[2], filtered_y[1], filtered_y[2]] == pytest.approx(true, abs=1e-6)
+    assert tracker._velocity == pytest.approx(VELOCITY, abs=1e-6)
+    assert tracker.accepted == 100 and tracker.rejected == 0
+
+    # the prediction of the next frame becomes the guess of its fits
+    guess_x, bounds_x, guess_y, bounds_y = tracker.predict(100)
+    assert [guess_x[1], guess_x[2], guess_y[1], guess_y[2]] == pytest.approx(START + VELOCITY * 100, abs=1e-6)
+    assert bounds_x[0][1] < guess_x[1] < bounds_x[1][1]
+    assert bounds_y[0][3] < guess_y[3] < bounds_y[1][3]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_noisy_track_is_smoothed(seed):
+    # the filtered fits are closer to the track than the measurements
+    tracker = FitTracker(process_noise_px=0.3, measurement_noise_px=0.2)
+    rng = np.random.default_rng(seed)
+    filtered_errors, measured_errors = [], []
+    for frame_id in range(200):
+        tracker.predict(frame_id)
+        true = START + VELOCITY * frame_id
+        measured = true + rng.normal(0, 0.2, 4)
+        filtered_x, filtered_y = tracker.update(frame_id, *fits(measured))
+        if frame_id >= 100:
+            filtered_errors.append([filtered_x[1], filtered_x[2], filtered_y[1], filtered_y[2]] - true)
+            measured_errors.append(measured - true)
+    assert tracker.rejected == 0
+    assert np.sqrt(np.mean(np.square(filtered_errors))) < 0.95 * np.sqrt(np.mean(np.square(measured_errors)))
+
+
+def test_outlier_beyond_gate_is_rejected_and_leaves_state_unchanged():
+    tracker = FitTracker()
+    track(tracker, 50)
+    tracker.predict(50)
+    before = state(tracker)
+
+    outlier = START + VELOCITY * 50 + np.array([40.0, 0, 0, 0])
+    assert tracker.update(50, *fits(outlier)) is None
+    assert tracker.rejected == 1
+    assert tracker.initialised
+    for array, expected in zip(state(tracker), before):
+        np.testing.assert_array_equal(array, expected)
+
+    # the next fit on the track is accepted again
+    assert tracker.update(51, *fits(START + VELOCITY * 51)) is not None
+
+
+def test_consecutive_misses_reset_the_filter():
+    tracker = FitTracker(max_misses=3)
+    track(tracker, 50)
+    outlier = START + VELOCITY * 50 + np.array([40.0, 0, 0, 0])
+
+    # rejected and failed fits both count as misses
+    for frame_id, frame_fits in zip((50, 51), (fits(outlier), (None, None))):
+        tracker.predict(frame_id)
+        assert tracker.update(frame_id, *frame_fits) is None
+    assert tracker.initialised
+
+    tracker.predict(52)
+    assert tracker.update(52, None, None) is None
+    assert not tracker.initialised
+    assert tracker.resets == 1
+    assert tracker.predict(53) is None
+
+    # the filter starts again from the next fit, wherever the spot is now
+    restarted = START + np.array([200.0, 5.0, 100.0, 5.0])
+    filtered_x, _ = tracker.update(53, *fits(restarted))
+    assert filtered_x[1] == pytest.approx(restarted[0])
+
+
+def test_a_successful_fit_clears_the_misses():
+    tracker = FitTracker(max_misses=3)
+    track(tracker, 50)
+    for frame_id in range(50, 60):
+        tracker.predict(frame_id)
+        # every other fit fails, never three in a row
+        frame_fits = fits(START + VELOCITY * frame_id) if frame_id % 2 else (None, None)
+        tracker.update(frame_id, *frame_fits)
+    assert tracker.resets == 0 and tracker.initialised
+
+
+@pytest.mark.parametrize("roi_tracking", [False, True])
+@pytest.mark.parametrize("use_tracker", [False, True])
+def test_one_missing_guess_does_not_raise(roi_tracking, use_tracker):
+    camera = SimulatedCamera(lambda: 0.0, polyfit=POLYFIT, width=960, height=540, centre=(470, 282), sigma=57)
+    processor = FrameProcessor(camera, fit_profiles=True, roi_tracking=roi_tracking, polyfit=POLYFIT,
+                               tracker=FitTracker() if use_tracker else None)
+    processor.store_frame = False
+    frame = camera.render(0.0)
+    processor._process_frame(frame, 0, 1)
+
+    # only one of the two fits available, e.g. after a failed fit or a resize that moved one centre out of the frame
+    processor.guessx = None
+    processor._process_frame(frame, 0, 2)
+    processor.guessy = None
+    processor._process_frame(frame, 0, 3)
+    assert processor.measurement.frame_id == 3
+
+    # a frame without a spot, whatever the fits make of it, the following frames are processed normally
+    processor._process_frame(np.full_like(frame, 15), 0, 4)
+    assert processor.measurement.frame_id == 4
+    for frame_id in range(5, 10):
+        processor._process_frame(frame, 0, frame_id)
+    assert processor.measurement.frame_id == 9